@@ -0,0 +1,315 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from pdf_annotation_flip import (IF_MIRRORED_MODES, AnnotationFilter, configure_logging, flip_annotations, logger,
+                                 parse_pages, parse_region)
+
+class FileTimeout(BaseException):
+    """
+    Raised inside a worker when a file exceeds its time budget
+    
+    Derives from BaseException so the per-annotation error handling in
+    flip_annotations doesn't swallow it.
+    """
+
+def collect_inputs(sources, manifest=None):
+    """
+    Expand directories, glob patterns and plain paths into (input_pdf, relative_name) pairs
+    
+    Directories are searched recursively for .pdf files and keep their
+    relative layout in relative_name. A manifest lists one path per line,
+    blank lines and lines starting with '#' are ignored.
+    """
+    entries = []
+    
+    if manifest:
+        with open(manifest, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    sources.append(line)
+    
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                for name in sorted(files):
+                    if name.lower().endswith('.pdf'):
+                        path = os.path.join(root, name)
+                        entries.append((path, os.path.relpath(path, source)))
+        elif glob.has_magic(source):
+            for path in sorted(glob.glob(source, recursive=True)):
+                if os.path.isfile(path):
+                    entries.append((path, os.path.basename(path)))
+        else:
+            entries.append((source, os.path.basename(source)))
+    
+    # Keep the first occurrence of every input
+    seen = set()
+    unique = []
+    for path, relative_name in entries:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append((path, relative_name))
+    return unique
+
+def output_path_for(output_dir, relative_name):
+    """Return the 'flipped_<name>' output path for an input, keeping its subdirectory"""
+    subdir, base_name = os.path.split(relative_name)
+    name, ext = os.path.splitext(base_name)
+    return os.path.join(output_dir, subdir, f"flipped_{name}{ext}")
+
+def load_checkpoint(checkpoint):
+    """Return the set of inputs recorded as done in a checkpoint file"""
+    done = set()
+    if not checkpoint or not os.path.exists(checkpoint):
+        return done
+    with open(checkpoint, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A partially written last line from an interrupted run
+                continue
+            if record.get('status') == 'ok':
+                done.add(record['input'])
+    return done
+
+class ErrorCapture(logging.Handler):
+    """Remember the last error logged while flipping a file, reported as the failure detail"""
+    
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.last_error = None
+    
+    def emit(self, record):
+        self.last_error = record.getMessage()
+
+def _raise_timeout(signum, frame):
+    raise FileTimeout()
+
+def init_worker(log_level=logging.WARNING):
+    """Prepare a pool worker, the pikepdf import is paid once here instead of per file"""
+    configure_logging(log_level)
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _raise_timeout)
+
+def result_record(input_pdf, output_pdf, status, error, seconds):
+    """Return the record of one input for the summary and the checkpoint"""
+    return {
+        'input': input_pdf,
+        'output': output_pdf,
+        'status': status,
+        'error': error,
+        'seconds': seconds,
+        'bytes': os.path.getsize(input_pdf) if os.path.exists(input_pdf) else 0,
+    }
+
+def flip_file(input_pdf, output_pdf, horizontal, vertical, timeout, if_mirrored='apply', cache_dir=None, select=None):
+    """
+    Flip one file inside a pool worker
+    
+    The last error logged by flip_annotations becomes the failure detail.
+    The timeout is checked by SIGALRM between Python bytecodes, so it
+    can't interrupt a worker stuck inside a single native qpdf call.
+    
+    Returns a result record for the summary and the checkpoint.
+    """
+    start = time.perf_counter()
+    capture = ErrorCapture()
+    status = 'ok'
+    error = None
+    
+    # Per-file timeouts rely on SIGALRM and are not available on Windows
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    logger.addHandler(capture)
+    try:
+        os.makedirs(os.path.dirname(output_pdf) or '.', exist_ok=True)
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        success = flip_annotations(input_pdf, output_pdf, horizontal, vertical,
+                                   if_mirrored=if_mirrored, cache_dir=cache_dir, select=select)
+        if not success:
+            status = 'failed'
+            error = capture.last_error or "flip_annotations failed"
+    except FileTimeout:
+        status = 'timeout'
+        error = f"exceeded {timeout} seconds"
+    except Exception as e:
+        status = 'failed'
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        logger.removeHandler(capture)
+    
+    return result_record(input_pdf, output_pdf, status, error, time.perf_counter() - start)
+
+def run_batch(inputs, output_dir, horizontal=True, vertical=False, workers=None,
+              timeout=None, checkpoint=None, resume=False, log_level=logging.WARNING,
+              if_mirrored='apply', cache_dir=None, select=None):
+    """
+    Flip many PDF files with a persistent worker pool
+    
+    Inputs are handed to the pool two per worker at a time. When a worker
+    dies, e.g. killed for its memory use or crashed in qpdf, the inputs in
+    flight are flipped again one by one in a pool of their own, so only
+    the input that kills its worker again is recorded as failed, and the
+    remaining inputs go on in a new pool.
+    
+    Parameters:
+        inputs: List of (input_pdf, relative_name) pairs from collect_inputs
+        output_dir: Directory receiving the flipped files
+        horizontal: Whether to flip horizontally (default: True)
+        vertical: Whether to flip vertically (default: False)
+        workers: Number of worker processes (default: CPU count)
+        timeout: Per-file time limit in seconds, see flip_file (default: no limit)
+        checkpoint: Path of a JSON-lines file recording finished inputs
+        resume: Skip inputs the checkpoint already records as done
+        log_level: Logging level of the pool workers (default: WARNING)
+        if_mirrored: Handling of inputs that were flipped before, see
+            flip_annotations (default: 'apply')
+        cache_dir: Result cache directory shared by all workers (default: None)
+        select: AnnotationFilter applied to every file (default: None)
+    
+    Returns a summary dictionary with throughput and failures.
+    """
+    done = load_checkpoint(checkpoint) if resume else set()
+    pending = [(path, name) for path, name in inputs if path not in done]
+    skipped = len(inputs) - len(pending)
+    
+    counts = {'ok': 0, 'failed': 0, 'timeout': 0}
+    failures = []
+    total_bytes = 0
+    start = time.perf_counter()
+    
+    checkpoint_file = None
+    if checkpoint:
+        checkpoint_file = open(checkpoint, 'a' if resume else 'w', encoding='utf-8')
+    
+    def finish(record):
+        nonlocal total_bytes
+        counts[record['status']] += 1
+        total_bytes += record['bytes']
+        if record['status'] != 'ok':
+            failures.append({key: record[key] for key in ('input', 'status', 'error')})
+            logger.warning("%s: %s: %s", record['status'].upper(), record['input'], record['error'])
+        if checkpoint_file:
+            checkpoint_file.write(json.dumps(record) + '\n')
+            checkpoint_file.flush()
+    
+    options = (horizontal, vertical, timeout, if_mirrored, cache_dir, select)
+    jobs = deque((path, output_path_for(output_dir, name)) for path, name in pending)
+    window = 2 * (workers or os.cpu_count() or 1)
+    try:
+        while jobs:
+            interrupted = []
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                     initargs=(log_level,)) as executor:
+                running = {}
+                while (jobs or running) and not interrupted:
+                    while jobs and len(running) < window:
+                        path, output_pdf = jobs.popleft()
+                        running[executor.submit(flip_file, path, output_pdf, *options)] = (path, output_pdf)
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    if any(isinstance(future.exception(), BrokenProcessPool) for future in finished):
+                        # A broken pool fails everything in flight, not only the input that killed it
+                        finished, _ = wait(running)
+                    for future in finished:
+                        job = running.pop(future)
+                        try:
+                            finish(future.result())
+                        except BrokenProcessPool:
+                            interrupted.append(job)
+            
+            for path, output_pdf in interrupted:
+                start_file = time.perf_counter()
+                with ProcessPoolExecutor(max_workers=1, initializer=init_worker, initargs=(log_level,)) as single:
+                    try:
+                        finish(single.submit(flip_file, path, output_pdf, *options).result())
+                    except BrokenProcessPool:
+                        finish(result_record(path, output_pdf, 'failed', "the worker process died",
+                                             time.perf_counter() - start_file))
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+    
+    elapsed = time.perf_counter() - start
+    processed = len(pending)
+    return {
+        'total': len(inputs),
+        'processed': processed,
+        'skipped': skipped,
+        'succeeded': counts['ok'],
+        'failed': counts['failed'],
+        'timed_out': counts['timeout'],
+        'elapsed_seconds': elapsed,
+        'files_per_second': processed / elapsed if elapsed > 0 else 0.0,
+        'megabytes_per_second': total_bytes / elapsed / 1e6 if elapsed > 0 else 0.0,
+        'failures': failures,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flip (mirror) annotations in many PDF files with a worker pool")
+    parser.add_argument("inputs", nargs="*", help="Input PDF files, directories or glob patterns")
+    parser.add_argument("-m", "--manifest", help="File listing input PDF paths, one per line")
+    parser.add_argument("-o", "--output-dir", default="flipped", help="Directory for flipped files (default: 'flipped')")
+    parser.add_argument("--horizontal", action="store_true", default=True, help="Flip horizontally (default)")
+    parser.add_argument("--vertical", action="store_true", help="Flip vertically")
+    parser.add_argument("--no-horizontal", dest="horizontal", action="store_false", help="Don't flip horizontally")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--timeout", type=float, help="Per-file time limit in seconds, not checked during native qpdf calls")
+    parser.add_argument("--checkpoint", help="JSON-lines file recording finished inputs")
+    parser.add_argument("--resume", action="store_true", help="Skip inputs already finished in the checkpoint")
+    parser.add_argument("--if-mirrored", choices=IF_MIRRORED_MODES, default='apply',
+                        help="For files flipped before: flip again, copy unchanged, or apply only the "
+                             "difference (default: %(default)s)")
+    parser.add_argument("--cache", metavar="DIR", help="Reuse earlier results for unchanged inputs, cached in DIR")
+    parser.add_argument("--pages", type=parse_pages, metavar="RANGES",
+                        help="Only flip annotations on these pages of every file, e.g. 1-3 (1-based)")
+    parser.add_argument("--subtype", action="append", metavar="NAME",
+                        help="Only flip annotations of this subtype, e.g. Ink, repeat for several")
+    parser.add_argument("--author", action="append", metavar="NAME",
+                        help="Only flip annotations by this author (/T), repeat for several")
+    parser.add_argument("--region", type=parse_region, metavar="X0,Y0,X1,Y1",
+                        help="Only flip annotations whose /Rect lies inside this area, in page coordinates")
+    parser.add_argument("--summary", help="Write the JSON summary to this file instead of stdout")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument("-q", "--quiet", action="store_true", help="Only report errors")
+    verbosity.add_argument("-v", "--verbose", action="store_true", help="Also report every finished file")
+    
+    args = parser.parse_args()
+    
+    if not args.inputs and not args.manifest:
+        parser.error("no inputs given, pass files, directories, globs or --manifest")
+    if args.resume and not args.checkpoint:
+        parser.error("--resume requires --checkpoint")
+    
+    log_level = logging.ERROR if args.quiet else logging.INFO if args.verbose else logging.WARNING
+    configure_logging(log_level)
+    
+    select = None
+    if args.pages is not None or args.subtype or args.author or args.region:
+        select = AnnotationFilter(args.pages, args.subtype, args.author, args.region)
+    
+    inputs = collect_inputs(list(args.inputs), args.manifest)
+    summary = run_batch(inputs, args.output_dir, args.horizontal, args.vertical, args.workers,
+                        args.timeout, args.checkpoint, args.resume, log_level, args.if_mirrored, args.cache,
+                        select)
+    
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    else:
+        print(json.dumps(summary, indent=2))
+    
+    sys.exit(1 if summary['failed'] or summary['timed_out'] else 0)
@@ -0,0 +1,415 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pikepdf
+
+from pdf_annotation_flip import (FlipOptions, FlipStats, configure_logging, flip_annotations, logger,
+                                 page_flip_context, run_handler)
+
+# Default share of each subtype in generated documents
+DEFAULT_MIX = {'/Ink': 3, '/Highlight': 3, '/Line': 1, '/Polygon': 1, '/FreeText': 1}
+
+DEFAULT_SCALES = [10, 1000, 100000]
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+
+def parse_mix(text):
+    """Parse 'Ink=3,Highlight=2' into a {'/Ink': 3, '/Highlight': 2} subtype mix"""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if not name.startswith('/'):
+            name = '/' + name
+        mix[name] = float(weight) if weight else 1.0
+    if not mix or min(mix.values()) < 0 or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError(f"invalid subtype mix {text!r}")
+    return mix
+
+def format_numbers(values):
+    """Format coordinates as a PDF number sequence with two decimals"""
+    return ' '.join(f"{v:.2f}" for v in values).encode()
+
+def random_points(rng, count):
+    """Return count random (x, y) points inside the page as a flat buffer"""
+    points = rng.random((count, 2)) * (PAGE_WIDTH, PAGE_HEIGHT)
+    return points.ravel()
+
+def annotation_body(subtype, rng, points, strokes):
+    """
+    Build the dictionary of one synthetic annotation in PDF syntax
+    
+    Ink annotations get strokes strokes of points points, polygons and
+    polylines points vertices, text markup points // 4 quadrilaterals.
+    Unknown subtypes get a plain /Rect.
+    """
+    x0, y0 = rng.random(2) * (PAGE_WIDTH - 100, PAGE_HEIGHT - 100)
+    rect = format_numbers((x0, y0, x0 + 20 + rng.random() * 80, y0 + 20 + rng.random() * 80))
+    body = b'/Type /Annot /Subtype %s /Rect [ %s ] /T (bench) /F 4' % (subtype.encode(), rect)
+    
+    if subtype == '/Ink':
+        ink_list = b' '.join(b'[ %s ]' % format_numbers(random_points(rng, points)) for _ in range(strokes))
+        body += b' /InkList [ %s ]' % ink_list
+    elif subtype in ('/Polygon', '/PolyLine'):
+        body += b' /Vertices [ %s ]' % format_numbers(random_points(rng, points))
+    elif subtype in ('/Highlight', '/Underline', '/Squiggly', '/StrikeOut'):
+        body += b' /QuadPoints [ %s ]' % format_numbers(random_points(rng, max(1, points // 4) * 4))
+    elif subtype == '/Line':
+        body += b' /L [ %s ] /LE [ /None /OpenArrow ]' % format_numbers(random_points(rng, 2))
+    elif subtype == '/FreeText':
+        body += b' /Contents (benchmark) /DA (/Helv 12 Tf 0 g) /Q 0 /Rotate 90'
+    return b'<< ' + body + b' >>'
+
+def generate_pdf(path, annotations, annots_per_page=100, mix=None, points=16, strokes=2, variants=256,
+                 seed=0):
+    """
+    Write a synthetic annotation-heavy PDF file
+    
+    The file is written directly in PDF syntax instead of through pikepdf,
+    so documents with a million annotations are generated in seconds. Each
+    subtype gets a pool of random variants which are reused across the
+    document, the transform cost doesn't depend on coordinates being
+    unique.
+    
+    Parameters:
+        path: Output PDF path
+        annotations: Total number of annotations
+        annots_per_page: Annotations per page, the last page holds the rest
+        mix: Dictionary of subtype -> relative weight (default: DEFAULT_MIX)
+        points: Points per ink stroke or polygon, quadrilaterals use points // 4
+        strokes: Strokes per ink annotation
+        variants: Distinct random annotations generated per subtype
+        seed: Random seed, the same arguments always give the same file
+    
+    Returns a dictionary describing the generated document.
+    """
+    mix = mix or DEFAULT_MIX
+    rng = np.random.default_rng(seed)
+    subtypes = sorted(mix)
+    pools = {subtype: [annotation_body(subtype, rng, points, strokes) for _ in range(variants)]
+             for subtype in subtypes}
+    
+    # Pick subtypes for the whole document at once in the requested proportions
+    weights = np.array([mix[subtype] for subtype in subtypes], dtype=np.float64)
+    choices = rng.choice(len(subtypes), size=annotations, p=weights / weights.sum())
+    variant_choices = rng.integers(0, variants, size=annotations)
+    
+    page_count = max(1, -(-annotations // annots_per_page))
+    # Objects: 1 catalog, 2 page tree, then per page the page and its /Annots array,
+    # then every annotation
+    first_annot = 3 + 2 * page_count
+    offsets = []
+    
+    with open(path, 'wb') as f:
+        def write_object(body):
+            offsets.append(f.tell())
+            f.write(b'%d 0 obj\n' % len(offsets) + body + b'\nendobj\n')
+        
+        f.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        write_object(b'<< /Type /Catalog /Pages 2 0 R >>')
+        kids = b' '.join(b'%d 0 R' % (3 + 2 * i) for i in range(page_count))
+        write_object(b'<< /Type /Pages /Count %d /Kids [ %s ] /Resources << >> /MediaBox [ 0 0 %d %d ] >>'
+                     % (page_count, kids, PAGE_WIDTH, PAGE_HEIGHT))
+        
+        for page_num in range(page_count):
+            start = page_num * annots_per_page
+            stop = min(annotations, start + annots_per_page)
+            write_object(b'<< /Type /Page /Parent 2 0 R /Annots %d 0 R >>' % (4 + 2 * page_num))
+            refs = b' '.join(b'%d 0 R' % (first_annot + i) for i in range(start, stop))
+            write_object(b'[ ' + refs + b' ]')
+        
+        for choice, variant in zip(choices.tolist(), variant_choices.tolist()):
+            write_object(pools[subtypes[choice]][variant])
+        
+        xref = f.tell()
+        f.write(b'xref\n0 %d\n0000000000 65535 f\r\n' % (len(offsets) + 1))
+        f.write(b''.join(b'%010d 00000 n\r\n' % offset for offset in offsets))
+        f.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(offsets) + 1, xref))
+    
+    counts = np.bincount(choices, minlength=len(subtypes))
+    return {
+        'annotations': annotations,
+        'pages': page_count,
+        'subtypes': {subtype: int(count) for subtype, count in zip(subtypes, counts)},
+        'bytes': os.path.getsize(path),
+    }
+
+def time_phases(input_pdf, output_pdf, horizontal=True, vertical=False):
+    """
+    Flip a file once and time its phases separately
+    
+    Runs the same steps as flip_annotations, but times opening, every
+    subtype handler and saving on their own. Returns a dictionary of
+    seconds, the handler times under 'transform' by subtype.
+    """
+    timings = {'transform': {}}
+    
+    start = time.perf_counter_ns()
+    pdf = pikepdf.open(input_pdf)
+    timings['open'] = (time.perf_counter_ns() - start) / 1e9
+    
+    options = FlipOptions()
+    transform_ns = {}
+    group_ns = 0
+    for page_num, page in enumerate(pdf.pages):
+        if '/Annots' not in page:
+            continue
+        start = time.perf_counter_ns()
+        ctx = page_flip_context(page, page_num, horizontal, vertical, options)
+        groups = {}
+        for annot in page.Annots:
+            subtype = str(annot.Subtype) if '/Subtype' in annot else "Unknown"
+            groups.setdefault(subtype, []).append(annot)
+        group_ns += time.perf_counter_ns() - start
+        
+        for subtype, group in groups.items():
+            start = time.perf_counter_ns()
+            run_handler(subtype, group, ctx)
+            transform_ns[subtype] = transform_ns.get(subtype, 0) + time.perf_counter_ns() - start
+    timings['group'] = group_ns / 1e9
+    timings['transform'] = {subtype: ns / 1e9 for subtype, ns in sorted(transform_ns.items())}
+    
+    start = time.perf_counter_ns()
+    pdf.save(output_pdf)
+    pdf.close()
+    timings['save'] = (time.perf_counter_ns() - start) / 1e9
+    return timings
+
+def best_timings(runs):
+    """Merge repeated phase timings, keeping the fastest run of every phase"""
+    best = {}
+    for run in runs:
+        for phase, value in run.items():
+            if isinstance(value, dict):
+                merged = best.setdefault(phase, {})
+                for key, seconds in value.items():
+                    merged[key] = min(seconds, merged.get(key, seconds))
+            else:
+                best[phase] = min(value, best.get(phase, value))
+    return best
+
+def run_benchmark(scales, work_dir, annots_per_page=100, mix=None, points=16, strokes=2, repeat=1,
+                  horizontal=True, vertical=False, jobs=1, seed=0):
+    """
+    Generate one document per scale, flip it and collect the timings
+    
+    Parameters:
+        scales: Total annotation counts, one generated document each
+        work_dir: Directory receiving the generated and flipped files
+        annots_per_page: Annotations per generated page
+        mix: Dictionary of subtype -> relative weight (default: DEFAULT_MIX)
+        points: Points per ink stroke or polygon
+        strokes: Strokes per ink annotation
+        repeat: Runs per scale, the fastest time of each phase is kept
+        horizontal: Whether to flip horizontally (default: True)
+        vertical: Whether to flip vertically (default: False)
+        jobs: Worker processes of the end-to-end flip_annotations run
+        seed: Random seed of the generated documents
+    
+    Returns a list of result dictionaries, one per scale.
+    """
+    results = []
+    for annotations in scales:
+        input_pdf = os.path.join(work_dir, f"bench_{annotations}.pdf")
+        output_pdf = os.path.join(work_dir, f"bench_{annotations}_flipped.pdf")
+        
+        start = time.perf_counter()
+        document = generate_pdf(input_pdf, annotations, annots_per_page, mix, points, strokes, seed=seed)
+        document['generate_seconds'] = time.perf_counter() - start
+        logger.info("Generated %d annotations on %d pages (%.1f MB)", annotations, document['pages'],
+                    document['bytes'] / 1e6)
+        
+        phases = best_timings([time_phases(input_pdf, output_pdf, horizontal, vertical) for _ in range(repeat)])
+        
+        end_to_end = []
+        for _ in range(repeat):
+            stats = FlipStats()
+            start = time.perf_counter()
+            if not flip_annotations(input_pdf, output_pdf, horizontal, vertical, jobs, stats=stats):
+                raise RuntimeError(f"flip_annotations failed on {input_pdf}")
+            end_to_end.append((time.perf_counter() - start, stats))
+        
+        total, stats = min(end_to_end, key=lambda run: run[0])
+        result = dict(document)
+        result.update({
+            'phases': phases,
+            'transform_seconds': sum(phases['transform'].values()),
+            'end_to_end_seconds': total,
+            'end_to_end_stats': stats.as_dict(),
+            'annotations_per_second': annotations / total if total > 0 else 0.0,
+        })
+        results.append(result)
+        logger.info("%d annotations: open %.3fs, transform %.3fs, save %.3fs, end to end %.3fs",
+                    annotations, phases['open'], result['transform_seconds'], phases['save'], total)
+    return results
+
+def environment():
+    """Describe the interpreter and library versions the benchmark ran with"""
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'pikepdf': pikepdf.__version__,
+        'qpdf': str(pikepdf.__libqpdf_version__),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+# Command lines timed by --startup, none of them gets as far as flipping
+STARTUP_COMMANDS = {
+    'help': ['pdf_annotation_cli.py', '--help'],
+    'invalid_argument': ['pdf_annotation_cli.py', 'input.pdf', '--precision', 'invalid'],
+    'client_help': ['pdf_annotation_client.py', '--help'],
+}
+
+# Modules the command lines must only import once a file is flipped
+DEFERRED_MODULES = ('numpy', 'pikepdf')
+
+def parse_importtime(report):
+    """
+    Parse the stderr of python -X importtime
+    
+    Returns (modules, top_level): the names of all imported modules and a
+    list of (module, cumulative microseconds) of the modules imported at
+    the top level, slowest first.
+    """
+    modules = []
+    top_level = []
+    for line in report.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        modules.append(name.strip())
+        # Nested imports are indented by two more spaces per level
+        if not name[1:].startswith(' '):
+            top_level.append((name.strip(), int(fields[1])))
+    top_level.sort(key=lambda item: -item[1])
+    return modules, top_level
+
+def time_startup(commands=None, repeat=5, slowest=10):
+    """
+    Time the cold start of command lines, each run in a fresh interpreter
+    
+    Parameters:
+        commands: Dictionary of name -> [script, arguments...] (default: STARTUP_COMMANDS)
+        repeat: Runs per command, the fastest wall time is kept
+        slowest: Number of slowest top-level imports listed per command
+    
+    Returns a dictionary of name -> result, plus the bare interpreter's
+    start under 'interpreter'. Every result holds the wall time, the total
+    import time from one python -X importtime run, the slowest top-level
+    imports and the DEFERRED_MODULES that were imported anyway.
+    """
+    commands = STARTUP_COMMANDS if commands is None else commands
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    
+    def wall_time(argv):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(argv, cwd=script_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+    
+    results = {'interpreter': {'wall_seconds': wall_time([sys.executable, '-c', 'pass'])}}
+    for name, command in commands.items():
+        argv = [sys.executable, os.path.join(script_dir, command[0])] + list(command[1:])
+        report = subprocess.run([argv[0], '-X', 'importtime'] + argv[1:], cwd=script_dir,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+        modules, top_level = parse_importtime(report)
+        results[name] = {
+            'command': command,
+            'wall_seconds': wall_time(argv),
+            'import_seconds': sum(us for _, us in top_level) / 1e6,
+            'slowest_imports': [{'module': module, 'seconds': us / 1e6} for module, us in top_level[:slowest]],
+            'deferred_imported': sorted(set(modules) & set(DEFERRED_MODULES)),
+        }
+        logger.info("%s: %.3fs wall, %.3fs importing", name, results[name]['wall_seconds'],
+                    results[name]['import_seconds'])
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PDF annotation flipping on generated documents")
+    parser.add_argument("--scales", default=','.join(str(n) for n in DEFAULT_SCALES),
+                        help="Comma-separated total annotation counts (default: %(default)s), up to 1000000")
+    parser.add_argument("--annots-per-page", type=int, default=100, help="Annotations per page (default: 100)")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="Subtype weights, e.g. Ink=3,Highlight=3,Line=1 (default: Ink=3,Highlight=3,Line=1,Polygon=1,FreeText=1)")
+    parser.add_argument("--points", type=int, default=16, help="Points per ink stroke or polygon (default: 16)")
+    parser.add_argument("--strokes", type=int, default=2, help="Strokes per ink annotation (default: 2)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scale, the fastest is kept (default: 1)")
+    parser.add_argument("--vertical", action="store_true", help="Flip vertically as well")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Worker processes of the end-to-end run (default: 1)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generated documents (default: 0)")
+    parser.add_argument("--work-dir", help="Keep generated files in this directory (default: a temporary directory)")
+    parser.add_argument("--startup", action="store_true",
+                        help="Time the cold start of the command lines instead, failing if NumPy or pikepdf "
+                             "are imported before a file is flipped")
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only report errors")
+    
+    args = parser.parse_args()
+    configure_logging(logging.ERROR if args.quiet else logging.INFO)
+    
+    if args.startup:
+        results = time_startup(repeat=max(args.repeat, 5))
+        report = {'environment': environment(), 'startup': results}
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+        eager = {name: result['deferred_imported'] for name, result in results.items()
+                 if result.get('deferred_imported')}
+        for name, modules in eager.items():
+            logger.error("%s imports %s at start-up", name, ', '.join(modules))
+        sys.exit(1 if eager else 0)
+    
+    try:
+        scales = [int(n) for n in args.scales.split(',') if n.strip()]
+    except ValueError:
+        parser.error(f"invalid --scales {args.scales!r}")
+    
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="pdf_annotation_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        results = run_benchmark(scales, work_dir, args.annots_per_page, args.mix, args.points, args.strokes,
+                                args.repeat, True, args.vertical, args.jobs, args.seed)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    report = {
+        'environment': environment(),
+        'config': {
+            'annots_per_page': args.annots_per_page,
+            'mix': args.mix,
+            'points': args.points,
+            'strokes': args.strokes,
+            'repeat': args.repeat,
+            'vertical': args.vertical,
+            'jobs': args.jobs,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
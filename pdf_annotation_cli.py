@@ -0,0 +1,156 @@
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+
+# Decimals written for transformed coordinates, 1/10000 pt is far below
+# anything a viewer can show
+DEFAULT_PRECISION = 4
+
+# Modes of flip_annotations for documents that already carry a marker
+IF_MIRRORED_MODES = ('apply', 'skip', 'delta')
+
+def parse_matrix(text):
+    """
+    Parse 'a,b,c,d,e,f' from the command line into the six numbers of an affine matrix
+    
+    The numbers are in PDF order, every transform parameter accepts them
+    (see as_affine). NumPy isn't needed for parsing them.
+    """
+    values = [float(v) for v in text.replace(',', ' ').split()]
+    if len(values) != 6:
+        raise argparse.ArgumentTypeError(f"expected six numbers a,b,c,d,e,f, got {text!r}")
+    return tuple(values)
+
+def parse_pages(text):
+    """Parse a --pages argument such as '1-3,7' into a set of zero-based page numbers"""
+    pages = set()
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid page range {part.strip()!r}")
+        if first < 1 or last < first:
+            raise argparse.ArgumentTypeError(f"invalid page range {part.strip()!r}")
+        pages.update(range(first - 1, last))
+    return pages
+
+def parse_region(text):
+    """Parse 'x0,y0,x1,y1' from the command line into a region in page coordinates"""
+    try:
+        values = [float(v) for v in text.replace(',', ' ').split()]
+    except ValueError:
+        values = []
+    if len(values) != 4 or not all(math.isfinite(v) for v in values):
+        raise argparse.ArgumentTypeError(f"expected four numbers x0,y0,x1,y1, got {text!r}")
+    return tuple(values)
+
+def parse_tolerance(text):
+    """Parse a non-negative simplification tolerance"""
+    try:
+        tolerance = float(text)
+    except ValueError:
+        tolerance = -1.0
+    if not tolerance >= 0 or tolerance == float('inf'):
+        raise argparse.ArgumentTypeError(f"expected a non-negative number, got {text!r}")
+    return tolerance
+
+def parse_precision(text):
+    """Parse a decimal count or 'full' from the command line"""
+    if text == 'full':
+        return None
+    precision = int(text)
+    if precision < 0:
+        raise argparse.ArgumentTypeError("precision must be 'full' or a non-negative number of decimals")
+    return precision
+
+def main(argv=None):
+    """
+    Run the flip command line, of this module and of pdf_annotation_flip.py
+    
+    Only the standard library is imported before the arguments are parsed,
+    so --help and argument errors answer without loading NumPy or pikepdf.
+    """
+    parser = argparse.ArgumentParser(description="Flip (mirror) annotations in PDF files")
+    parser.add_argument("input_pdf", help="Path to input PDF file")
+    parser.add_argument("-o", "--output", help="Path to output PDF file (default: 'flipped_<original_name>.pdf')")
+    parser.add_argument("--horizontal", action="store_true", default=True, help="Flip horizontally (default)")
+    parser.add_argument("--vertical", action="store_true", help="Flip vertically")
+    parser.add_argument("--no-horizontal", dest="horizontal", action="store_false", help="Don't flip horizontally")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes to split pages across (default: 1)")
+    parser.add_argument("--incremental", action="store_true", help="Append only the flipped annotations to a copy of the original file")
+    parser.add_argument("--keep-appearance", action="store_true", help="Mirror appearance streams (/AP) instead of deleting them")
+    parser.add_argument("--stats", action="store_true", help="Report per-phase and per-subtype timings and counters")
+    parser.add_argument("--stats-json", metavar="PATH", help="Write the counters and timings as JSON to PATH")
+    parser.add_argument("--precision", type=parse_precision, default=DEFAULT_PRECISION,
+                        help="Decimals written for coordinates, or 'full' (default: %(default)s)")
+    parser.add_argument("--matrix", action="append", type=parse_matrix, metavar="A,B,C,D,E,F",
+                        help="Affine matrix in PDF order applied after the flip, repeat to chain several")
+    parser.add_argument("--if-mirrored", choices=IF_MIRRORED_MODES, default='apply',
+                        help="For files flipped before: flip again, copy unchanged, or apply only the "
+                             "difference (default: %(default)s)")
+    parser.add_argument("--no-marker", dest="mark", action="store_false",
+                        help="Don't record the applied flips in the output file")
+    parser.add_argument("--cache", metavar="DIR", help="Reuse earlier results for unchanged inputs, cached in DIR")
+    parser.add_argument("--pages", type=parse_pages, metavar="RANGES",
+                        help="Only flip annotations on these pages, e.g. 10-20,25 (1-based)")
+    parser.add_argument("--subtype", action="append", metavar="NAME",
+                        help="Only flip annotations of this subtype, e.g. Ink, repeat for several")
+    parser.add_argument("--author", action="append", metavar="NAME",
+                        help="Only flip annotations by this author (/T), repeat for several")
+    parser.add_argument("--region", type=parse_region, metavar="X0,Y0,X1,Y1",
+                        help="Only flip annotations whose /Rect lies inside this area, in page coordinates")
+    parser.add_argument("--simplify", type=parse_tolerance, metavar="TOLERANCE",
+                        help="Simplify ink strokes, dropping points closer than TOLERANCE (PDF units) to the line")
+    parser.add_argument("--tight-rects", action="store_true",
+                        help="Fit /Rect to the flipped lines, vertices, quadrilaterals and ink strokes")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument("-q", "--quiet", action="store_true", help="Only report warnings and errors")
+    verbosity.add_argument("-v", "--verbose", action="store_true", help="Report per-page and per-annotation details")
+    
+    args = parser.parse_args(argv)
+    
+    # Only a flip needs the engine, and with it NumPy and pikepdf
+    from pdf_annotation_flip import AnnotationFilter, FlipStats, configure_logging, flip_annotations, logger
+    
+    if args.quiet:
+        configure_logging(logging.WARNING)
+    elif args.verbose:
+        configure_logging(logging.DEBUG)
+    else:
+        configure_logging(logging.INFO)
+    
+    if not args.output:
+        base_name = os.path.basename(args.input_pdf)
+        name, ext = os.path.splitext(base_name)
+        args.output = f"flipped_{name}{ext}"
+    
+    try:
+        stats = FlipStats() if args.stats or args.stats_json else None
+        select = None
+        if args.pages is not None or args.subtype or args.author or args.region:
+            select = AnnotationFilter(args.pages, args.subtype, args.author, args.region)
+        success = flip_annotations(args.input_pdf, args.output, args.horizontal, args.vertical, args.jobs,
+                                   args.incremental, args.keep_appearance, args.matrix, stats, args.precision,
+                                   args.if_mirrored, args.mark, args.cache, select, args.simplify,
+                                   args.tight_rects)
+        
+        if success:
+            logger.info("PDF annotation flipping successful, results saved to %s", args.output)
+            if args.stats:
+                print(stats.summary())
+            if args.stats_json:
+                with open(args.stats_json, 'w', encoding='utf-8') as f:
+                    json.dump(stats.as_dict(), f, indent=2)
+        else:
+            logger.error("PDF annotation flipping failed, please check error messages.")
+    except Exception as e:
+        logger.exception("Program execution error: %s", e)
+        sys.exit(1) 
+
+if __name__ == "__main__":
+    main()
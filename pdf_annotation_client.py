@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import socket
+import stat
+import sys
+import time
+from urllib.parse import urlencode
+
+# Socket the flip daemon listens on by default, in a directory only its user can access
+if os.environ.get('XDG_RUNTIME_DIR'):
+    DEFAULT_SOCKET = os.path.join(os.environ['XDG_RUNTIME_DIR'], "pdf-annotation-flip.sock")
+else:
+    DEFAULT_SOCKET = os.path.join('/tmp', f"pdf-annotation-flip-{os.getuid()}", "daemon.sock")
+
+class DaemonUnavailable(Exception):
+    """Raised when no flip daemon is listening on the socket"""
+
+class DaemonError(Exception):
+    """A request the daemon answered with an error status"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def replaceable_by_others(path):
+    """
+    Return True if users other than the current one could put another file at path
+    
+    That is the case unless the directory of path belongs to the current
+    user or root, and only its owner can write to it or it is sticky like
+    /tmp.
+    """
+    directory = os.stat(os.path.dirname(os.path.abspath(path)))
+    if directory.st_uid not in (0, os.getuid()):
+        return True
+    return bool(directory.st_mode & (stat.S_IWGRP | stat.S_IWOTH)) and not directory.st_mode & stat.S_ISVTX
+
+def check_socket(socket_path):
+    """
+    Make sure socket_path is the socket of a daemon run by the current user
+    
+    Raises DaemonUnavailable when it's missing, isn't a socket, belongs to
+    another user or could be replaced by another user, so requests never
+    reach a daemon that somebody else started.
+    """
+    try:
+        info = os.lstat(socket_path)
+    except FileNotFoundError as e:
+        raise DaemonUnavailable(f"no flip daemon is listening on {socket_path}: {e.strerror}")
+    if not stat.S_ISSOCK(info.st_mode):
+        raise DaemonUnavailable(f"{socket_path} is not a socket")
+    if info.st_uid != os.getuid():
+        raise DaemonUnavailable(f"{socket_path} belongs to user {info.st_uid}, not to the current user")
+    if replaceable_by_others(socket_path):
+        raise DaemonUnavailable(f"other users can write to the directory of {socket_path}")
+
+def request(socket_path, method, target, body=b'', timeout=None):
+    """
+    Send one HTTP request to the flip service over a Unix socket
+    
+    Only the standard library is used, so a client never pays for
+    importing pikepdf or NumPy.
+    
+    Returns (status, body). Raises DaemonUnavailable when nothing listens
+    on socket_path or it fails check_socket.
+    """
+    check_socket(socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise DaemonUnavailable(f"no flip daemon is listening on {socket_path}: {e.strerror}")
+        head = f"{method} {target} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n"
+        sock.sendall(head.encode('latin-1') + body)
+        
+        # The service closes the connection after every response
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    
+    response = b''.join(chunks)
+    head, _, body = response.partition(b'\r\n\r\n')
+    try:
+        code = int(head.split(None, 2)[1])
+    except (IndexError, ValueError):
+        raise DaemonError(502, "malformed response from the flip daemon")
+    return code, body
+
+def status(socket_path=DEFAULT_SOCKET, timeout=None):
+    """Return the load and counters of the daemon listening on socket_path"""
+    code, body = request(socket_path, 'GET', '/health', timeout=timeout)
+    return json.loads(body)
+
+def flip_file(input_pdf, output_pdf, socket_path=DEFAULT_SOCKET, timeout=None, **params):
+    """
+    Flip (mirror) the annotations of a PDF file in a running flip daemon
+    
+    The daemon reads input_pdf and writes output_pdf itself, only the paths
+    travel over the socket. params are query parameters of the service's
+    /flip-file endpoint, e.g. vertical=True, matrix=['0,1,-1,0,0,0'] or
+    incremental=True.
+    
+    Returns the daemon's answer as a dictionary. Raises DaemonUnavailable
+    when no daemon is listening and DaemonError when the flip fails.
+    """
+    query = {'input': os.path.abspath(input_pdf), 'output': os.path.abspath(output_pdf)}
+    for name, value in params.items():
+        if isinstance(value, bool):
+            value = int(value)
+        query[name] = value
+    code, body = request(socket_path, 'POST', '/flip-file?' + urlencode(query, doseq=True), timeout=timeout)
+    try:
+        answer = json.loads(body)
+    except ValueError:
+        answer = {'error': body.decode('latin-1', 'replace')}
+    if code != 200:
+        raise DaemonError(code, answer.get('error', f"status {code}"))
+    return answer
+
+def flip_locally(args):
+    """Flip in this process when no daemon is running, importing the flip module only now"""
+    import logging
+    from pdf_annotation_flip import configure_logging, flip_annotations, parse_matrix, parse_precision
+    configure_logging(logging.WARNING if args.quiet else logging.INFO)
+    return flip_annotations(args.input_pdf, args.output, args.horizontal, args.vertical,
+                            incremental=args.incremental, keep_appearance=args.keep_appearance,
+                            transform=[parse_matrix(m) for m in args.matrix] if args.matrix else None,
+                            precision=parse_precision(args.precision), if_mirrored=args.if_mirrored,
+                            mark=args.mark, simplify=args.simplify, tight_rects=args.tight_rects)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flip (mirror) annotations in PDF files through a running flip daemon")
+    parser.add_argument("input_pdf", nargs='?', help="Path to input PDF file")
+    parser.add_argument("-o", "--output", help="Path to output PDF file (default: 'flipped_<original_name>.pdf')")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket of the daemon (default: %(default)s)")
+    parser.add_argument("--status", action="store_true", help="Print the daemon's load and counters and exit")
+    parser.add_argument("--no-fallback", dest="fallback", action="store_false",
+                        help="Fail instead of flipping in this process when no daemon is running")
+    parser.add_argument("--timeout", type=float, help="Seconds to wait for the daemon's answer")
+    parser.add_argument("--horizontal", action="store_true", default=True, help="Flip horizontally (default)")
+    parser.add_argument("--vertical", action="store_true", help="Flip vertically")
+    parser.add_argument("--no-horizontal", dest="horizontal", action="store_false", help="Don't flip horizontally")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Append only the flipped annotations to a copy of the original file")
+    parser.add_argument("--keep-appearance", action="store_true",
+                        help="Mirror appearance streams (/AP) instead of deleting them")
+    parser.add_argument("--precision", default='4', help="Decimals written for coordinates, or 'full' (default: %(default)s)")
+    parser.add_argument("--matrix", action="append", metavar="A,B,C,D,E,F",
+                        help="Affine matrix in PDF order applied after the flip, repeat to chain several")
+    parser.add_argument("--if-mirrored", choices=('apply', 'skip', 'delta'), default='apply',
+                        help="For files flipped before: flip again, copy unchanged, or apply only the "
+                             "difference (default: %(default)s)")
+    parser.add_argument("--no-marker", dest="mark", action="store_false",
+                        help="Don't record the applied flips in the output file")
+    parser.add_argument("--simplify", type=float, metavar="TOLERANCE",
+                        help="Simplify ink strokes, dropping points closer than TOLERANCE (PDF units) to the line")
+    parser.add_argument("--tight-rects", action="store_true",
+                        help="Fit /Rect to the flipped lines, vertices, quadrilaterals and ink strokes")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only report errors")
+    
+    args = parser.parse_args()
+    
+    if args.status:
+        try:
+            print(json.dumps(status(args.socket, args.timeout), indent=2))
+        except DaemonUnavailable as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+    if not args.input_pdf:
+        parser.error("an input PDF is required")
+    
+    if not args.output:
+        name, ext = os.path.splitext(os.path.basename(args.input_pdf))
+        args.output = f"flipped_{name}{ext}"
+    
+    params = {'horizontal': args.horizontal, 'vertical': args.vertical, 'incremental': args.incremental,
+              'keep_appearance': args.keep_appearance, 'precision': args.precision,
+              'if_mirrored': args.if_mirrored, 'mark': args.mark, 'tight_rects': args.tight_rects}
+    if args.matrix:
+        params['matrix'] = args.matrix
+    if args.simplify is not None:
+        params['simplify'] = args.simplify
+    
+    start = time.perf_counter()
+    try:
+        flip_file(args.input_pdf, args.output, args.socket, args.timeout, **params)
+        success = True
+    except DaemonUnavailable as e:
+        if not args.fallback:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        if not args.quiet:
+            print(f"{e}, flipping in this process", file=sys.stderr)
+        success = flip_locally(args)
+    except (DaemonError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        success = False
+    
+    if not success:
+        sys.exit(1)
+    if not args.quiet:
+        print(f"Flipped {args.input_pdf} to {args.output} in {time.perf_counter() - start:.3f} s", file=sys.stderr)
@@ -1,547 +1,2168 @@
-import pikepdf
-import argparse
+import hashlib
+import io
+import json
+import logging
+import mmap
 import os
-import sys
+import shutil
 import math
-from decimal import Decimal
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pikepdf
+
+from pdf_annotation_cli import (DEFAULT_PRECISION, IF_MIRRORED_MODES, parse_matrix, parse_pages, parse_precision,
+                                parse_region, parse_tolerance)
+
+logger = logging.getLogger("pdf_annotation_flip")
+
+def configure_logging(level=logging.INFO):
+    """Send log records to stderr as bare messages, used by the command line and pool workers"""
+    logging.basicConfig(format="%(message)s")
+    logger.setLevel(level)
+
+# Quadrilateral corner order after a single-direction flip:
+# top-left, top-right, bottom-left, bottom-right -> top-right, top-left, bottom-right, bottom-left
+QUAD_SWAP_ORDER = np.array([1, 0, 3, 2])
 
-def flip_annotations(input_pdf, output_pdf, horizontal=True, vertical=False):
+def mirror_affine(box, horizontal, vertical):
     """
-    Flip (mirror) annotations in a PDF file
+    Return the mirror about the centre of box as a 2x3 affine matrix
     
-    Parameters:
-        input_pdf: Path to the input PDF file
-        output_pdf: Path to the output PDF file
-        horizontal: Whether to flip horizontally (default: True)
-        vertical: Whether to flip vertically (default: False)
+    The matrix maps a point (x, y) to affine[:, :2] @ (x, y) + affine[:, 2].
+    box is (x0, y0, x1, y1), the mirror axes run through its centre.
+    """
+    x0, y0, x1, y1 = box
+    return np.array([
+        [-1.0 if horizontal else 1.0, 0.0, x0 + x1 if horizontal else 0.0],
+        [0.0, -1.0 if vertical else 1.0, y0 + y1 if vertical else 0.0],
+    ])
+
+def as_affine(matrix):
+    """
+    Convert a matrix given in any supported form into a 2x3 float64 array
+    
+    Accepts a 2x3 or 3x3 array, or the six numbers [a b c d e f] in PDF
+    order, which map (x, y) to (a*x + c*y + e, b*x + d*y + f).
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if matrix.shape == (6,):
+        a, b, c, d, e, f = matrix
+        return np.array([[a, c, e], [b, d, f]])
+    if matrix.shape in ((2, 3), (3, 3)):
+        return matrix[:2].copy()
+    raise ValueError(f"expected a 2x3 or 3x3 matrix or six numbers, got shape {matrix.shape}")
+
+def compose_affine(matrices):
+    """
+    Collapse a sequence of affine matrices into one 2x3 matrix
+    
+    The matrices are applied in order, the first one first. A single
+    matrix in any form accepted by as_affine is returned as is.
     """
     try:
-        # Open PDF file
-        pdf = pikepdf.open(input_pdf)
-        processed = 0
-        
-        # Iterate through all pages
-        for page_num, page in enumerate(pdf.pages):
-            # Get page dimensions
-            mediabox = page.MediaBox
-            width = float(mediabox[2])
-            height = float(mediabox[3])
-            print(f"Page {page_num+1} dimensions: width {width}, height {height}")
-            
-            # Check if page has annotations
-            if '/Annots' not in page:
-                print(f"Page {page_num+1} has no annotations")
-                continue
-            
-            # Get all annotations on the page
-            annots = page.Annots
-            if annots is None:
-                print(f"Page {page_num+1} annotation list is empty")
-                continue
+        single = np.shape(matrices) in ((6,), (2, 3), (3, 3))
+    except ValueError:
+        # A sequence mixing matrix forms has no common array shape
+        single = False
+    if single:
+        return as_affine(matrices)
+    
+    composed = np.eye(3)
+    for matrix in matrices:
+        composed = np.vstack((as_affine(matrix), [0.0, 0.0, 1.0])) @ composed
+    return composed[:2]
 
-            # Iterate through all annotations
-            for i, annot_ref in enumerate(annots):
-                try:
-                    print(f"\nProcessing annotation #{i+1}")
-                    
-                    # Get annotation type
-                    subtype = "Unknown"
-                    if '/Subtype' in annot_ref:
-                        subtype = str(annot_ref.Subtype)
-                        print(f"Annotation type: {subtype}")
-                    
-                    # Delete AP (appearance stream), to force PDF viewer to re-render the annotation
-                    if '/AP' in annot_ref:
-                        print("Deleting AP appearance stream, forcing re-rendering")
-                        del annot_ref.AP
-                    
-                    # 1. Rectangle area - almost all annotations have Rect attribute
-                    if '/Rect' in annot_ref:
-                        rect = annot_ref.Rect
-                        x1, y1, x2, y2 = (float(rect[0]), float(rect[1]), 
-                                           float(rect[2]), float(rect[3]))
-                        
-                        print(f"Original rectangle: ({x1}, {y1}, {x2}, {y2})")
-                        
-                        # Simple coordinate flipping
-                        if horizontal:
-                            x1, x2 = width - x1, width - x2
-                        if vertical:
-                            y1, y2 = height - y1, height - y2
-                        
-                        # Ensure coordinates are in order
-                        if x1 > x2:
-                            x1, x2 = x2, x1
-                        if y1 > y2:
-                            y1, y2 = y2, y1
-                        
-                        print(f"Flipped rectangle: ({x1}, {y1}, {x2}, {y2})")
-                        
-                        annot_ref.Rect = pikepdf.Array([
-                            Decimal(str(x1)), Decimal(str(y1)),
-                            Decimal(str(x2)), Decimal(str(y2))
-                        ])
-                    
-                    # 2. Line annotation
-                    if subtype == '/Line' and '/L' in annot_ref:
-                        points = annot_ref.L
-                        x1, y1, x2, y2 = (float(points[0]), float(points[1]),
-                                           float(points[2]), float(points[3]))
-                        
-                        print(f"Original line: from ({x1}, {y1}) to ({x2}, {y2})")
-                        
-                        # Calculate original line angle and length
-                        orig_dx = x2 - x1
-                        orig_dy = y2 - y1
-                        orig_angle = math.degrees(math.atan2(orig_dy, orig_dx))
-                        print(f"Original line angle: {orig_angle:.2f} degrees")
-                        
-                        # Only flip coordinates, don't swap endpoints
-                        if horizontal:
-                            x1 = width - x1
-                            x2 = width - x2
-                        if vertical:
-                            y1 = height - y1
-                            y2 = height - y2
-                        
-                        # Calculate angle after flipping
-                        new_dx = x2 - x1
-                        new_dy = y2 - y1
-                        new_angle = math.degrees(math.atan2(new_dy, new_dx))
-                        print(f"Angle after coordinate flipping: {new_angle:.2f} degrees")
-                        
-                        # Check if angle is correctly flipped
-                        if horizontal and not vertical:
-                            expected_angle = 180 - orig_angle
-                        elif vertical and not horizontal:
-                            expected_angle = -orig_angle
-                        elif horizontal and vertical:
-                            expected_angle = 180 + orig_angle
-                        else:
-                            expected_angle = orig_angle
-                        
-                        # Normalize angle to [-180, 180] range
-                        expected_angle = ((expected_angle + 180) % 360) - 180
-                        print(f"Expected flipped angle: {expected_angle:.2f} degrees")
-                        
-                        # If angle doesn't match expectation, swap endpoints
-                        angle_diff = abs((new_angle - expected_angle + 180) % 360 - 180)
-                        if angle_diff > 10:  # Allow 10 degree error
-                            print("Angle doesn't match expectation, swapping endpoints")
-                            x1, x2 = x2, x1
-                            y1, y2 = y2, y1
-                            
-                            # Recheck angle
-                            final_dx = x2 - x1
-                            final_dy = y2 - y1
-                            final_angle = math.degrees(math.atan2(final_dy, final_dx))
-                            print(f"Angle after swapping endpoints: {final_angle:.2f} degrees")
-                        
-                        print(f"Flipped line: from ({x1}, {y1}) to ({x2}, {y2})")
-                        
-                        # Update line coordinates
-                        annot_ref.L = pikepdf.Array([
-                            Decimal(str(x1)), Decimal(str(y1)),
-                            Decimal(str(x2)), Decimal(str(y2))
-                        ])
-                        
-                        # Handle line ending styles
-                        if '/LE' in annot_ref and len(annot_ref.LE) == 2:
-                            print("Swapping line ending styles")
-                            annot_ref.LE = pikepdf.Array([annot_ref.LE[1], annot_ref.LE[0]])
-
-                    # 3. Polygon/Polyline annotations
-                    if subtype in ['/Polygon', '/PolyLine'] and '/Vertices' in annot_ref:
-                        vertices = annot_ref.Vertices
-                        print("Processing polygon/polyline")
-                        
-                        # Extract all points
-                        original_points = []
-                        for j in range(0, len(vertices), 2):
-                            if j + 1 < len(vertices):
-                                x = float(vertices[j])
-                                y = float(vertices[j + 1])
-                                original_points.append((x, y))
-                        
-                        print(f"Original vertex count: {len(original_points)}")
-                        
-                        # Create a copy for flipping
-                        flipped_points = []
-                        
-                        # Apply coordinate flipping
-                        for x, y in original_points:
-                            new_x, new_y = x, y
-                            if horizontal:
-                                new_x = width - x
-                            if vertical:
-                                new_y = height - y
-                            flipped_points.append((new_x, new_y))
-                        
-                        # Determine if point sequence should be reversed to maintain shape
-                        # Single-direction flipping (horizontal or vertical only) needs point reversal
-                        if (horizontal != vertical) and len(original_points) > 2:  # Only reverse if more than 2 points
-                            print("Single-direction flip, reversing point sequence")
-                            flipped_points.reverse()
-                        
-                        # Output point changes for checking
-                        if len(original_points) <= 10:  # Avoid excessive output
-                            print("Original point sequence:")
-                            for idx, (x, y) in enumerate(original_points):
-                                print(f"  Point {idx+1}: ({x:.2f}, {y:.2f})")
-                            
-                            print("Flipped point sequence:")
-                            for idx, (x, y) in enumerate(flipped_points):
-                                print(f"  Point {idx+1}: ({x:.2f}, {y:.2f})")
-                        
-                        # Convert back to array format
-                        new_vertices = pikepdf.Array()
-                        for x, y in flipped_points:
-                            new_vertices.append(Decimal(str(x)))
-                            new_vertices.append(Decimal(str(y)))
-                        
-                        annot_ref.Vertices = new_vertices
-                        print("Polygon/polyline flipping completed")
-                        
-                        # Handle polygon border endpoint styles, if any
-                        if '/BE' in annot_ref:
-                            print("Note: This polygon has border endpoint styles, may need additional processing")
-                    
-                    # 4. Highlight/underline annotations
-                    if '/QuadPoints' in annot_ref:
-                        quad_points = annot_ref.QuadPoints
-                        new_quad_points = pikepdf.Array()
-                        print("Processing highlight/underline annotations")
-                        
-                        # Process quadrilateral points
-                        for j in range(0, len(quad_points), 8):
-                            if j + 7 < len(quad_points):
-                                quad = []
-                                for k in range(0, 8, 2):
-                                    x = float(quad_points[j+k])
-                                    y = float(quad_points[j+k+1])
-                                    quad.append((x, y))
-                                
-                                print(f"Original quadrilateral: {quad}")
-                                
-                                # Apply coordinate flipping
-                                flipped_quad = []
-                                for x, y in quad:
-                                    new_x, new_y = x, y
-                                    if horizontal:
-                                        new_x = width - x
-                                    if vertical:
-                                        new_y = height - y
-                                    flipped_quad.append((new_x, new_y))
-                                
-                                # Adjust point order for single-direction flipping
-                                if horizontal != vertical:
-                                    # Point order is typically: top-left, top-right, bottom-left, bottom-right
-                                    # After horizontal flip should be: top-right, top-left, bottom-right, bottom-left
-                                    print("Single-direction flip, adjusting quadrilateral point order")
-                                    flipped_quad = [flipped_quad[1], flipped_quad[0], 
-                                                   flipped_quad[3], flipped_quad[2]]
-                                
-                                print(f"Flipped quadrilateral: {flipped_quad}")
-                                
-                                # Add points to new array
-                                for x, y in flipped_quad:
-                                    new_quad_points.append(Decimal(str(x)))
-                                    new_quad_points.append(Decimal(str(y)))
-                        
-                        annot_ref.QuadPoints = new_quad_points
-                        print("Quadrilateral points flipping completed")
-                    
-                    # 5. Ink annotations
-                    if subtype == '/Ink' and '/InkList' in annot_ref:
-                        ink_list = annot_ref.InkList
-                        new_ink_list = pikepdf.Array()
-                        print("Processing ink annotation")
-                        
-                        for stroke_idx, stroke in enumerate(ink_list):
-                            points = []
-                            # Extract coordinates
-                            for j in range(0, len(stroke), 2):
-                                if j + 1 < len(stroke):
-                                    x = float(stroke[j])
-                                    y = float(stroke[j + 1])
-                                    points.append((x, y))
-                            
-                            print(f"Ink stroke #{stroke_idx+1}, point count: {len(points)}")
-                            
-                            # Apply coordinate flipping
-                            flipped_points = []
-                            for x, y in points:
-                                new_x, new_y = x, y
-                                if horizontal:
-                                    new_x = width - x
-                                if vertical:
-                                    new_y = height - y
-                                flipped_points.append((new_x, new_y))
-                            
-                            # Reverse point sequence for single-direction flip
-                            if (horizontal != vertical) and len(points) > 2:
-                                print("Single-direction flip, reversing ink point sequence")
-                                flipped_points.reverse()
-                            
-                            # Create new array
-                            new_stroke = pikepdf.Array()
-                            for x, y in flipped_points:
-                                new_stroke.append(Decimal(str(x)))
-                                new_stroke.append(Decimal(str(y)))
-                            
-                            new_ink_list.append(new_stroke)
-                        
-                        annot_ref.InkList = new_ink_list
-                        print("Ink annotation flipping completed")
-                    
-                    # 6. Special handling for text annotations
-                    if subtype in ['/FreeText', '/Text', '/Stamp']:
-                        print("Processing text/free text/stamp annotation")
-                        
-                        # Handle rotation angle
-                        if '/Rotate' in annot_ref:
-                            old_rotation = int(annot_ref.Rotate)
-                            new_rotation = old_rotation
-                            
-                            if horizontal and not vertical:
-                                new_rotation = (360 - old_rotation) % 360
-                            elif vertical and not horizontal:
-                                new_rotation = (180 - old_rotation) % 360
-                            elif horizontal and vertical:
-                                new_rotation = (180 + old_rotation) % 360
-                            
-                            print(f"Rotation angle: {old_rotation}° -> {new_rotation}°")
-                            annot_ref.Rotate = new_rotation
-                        
-                        # Handle text alignment
-                        if '/Q' in annot_ref:
-                            old_align = int(annot_ref.Q)
-                            new_align = old_align
-                            
-                            # 0=left, 1=center, 2=right
-                            if horizontal and old_align in [0, 2]:
-                                new_align = 2 if old_align == 0 else 0
-                                print(f"Text alignment: {old_align} -> {new_align}")
-                                annot_ref.Q = new_align
-                    
-                    processed += 1
-                    
-                except Exception as e:
-                    print(f"Error processing annotation: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    continue
-        
-        # Save the modified PDF
-        pdf.save(output_pdf)
-        pdf.close()
-        print(f"Processed {processed} annotations, saved to {output_pdf}")
-        return True
-        
-    except Exception as e:
-        import traceback
-        print(f"Error: {e}")
-        traceback.print_exc()
-        return False
+def invert_affine(affine):
+    """Return the 2x3 matrix undoing affine"""
+    return np.linalg.inv(np.vstack((affine, [0.0, 0.0, 1.0])))[:2]
 
-def update_rect_for_line(annot, x1, y1, x2, y2):
-    """Update the rectangle boundary for a line annotation"""
-    if '/Rect' in annot:
-        # Add some padding
-        padding = 1.0
-        min_x = min(x1, x2) - padding
-        max_x = max(x1, x2) + padding
-        min_y = min(y1, y2) - padding
-        max_y = max(y1, y2) + padding
-        
-        annot.Rect = pikepdf.Array([
-            Decimal(str(min_x)), Decimal(str(min_y)),
-            Decimal(str(max_x)), Decimal(str(max_y))
-        ])
-        print(f"Updated rectangle boundary: [{min_x}, {min_y}, {max_x}, {max_y}]")
-
-def flip_annotation(annot, width, height, horizontal, vertical):
-    """Flip all types of annotations"""
-    
-    # 1. Rectangle area
-    if '/Rect' in annot:
-        rect = annot.Rect
-        x0, y0, x1, y1 = (float(rect[0]), float(rect[1]), 
-                          float(rect[2]), float(rect[3]))
+def rotation_affine(angle, center=(0.0, 0.0)):
+    """Return the counter-clockwise rotation by angle degrees about center"""
+    radians = math.radians(angle)
+    cos, sin = math.cos(radians), math.sin(radians)
+    if angle % 90 == 0:
+        # Keep quarter turns exact
+        cos, sin = round(cos), round(sin)
+    cx, cy = center
+    return np.array([[cos, -sin, cx - cos * cx + sin * cy], [sin, cos, cy - sin * cx - cos * cy]])
+
+def scale_affine(sx, sy=None, center=(0.0, 0.0)):
+    """Return the scaling by (sx, sy) about center, sy defaults to sx"""
+    sy = sx if sy is None else sy
+    cx, cy = center
+    return np.array([[sx, 0.0, cx - sx * cx], [0.0, sy, cy - sy * cy]])
+
+def translation_affine(tx, ty):
+    """Return the translation by (tx, ty), e.g. to follow a cropped page origin"""
+    return np.array([[1.0, 0.0, tx], [0.0, 1.0, ty]])
+
+def transform_points(points, affine):
+    """Apply a 2x3 affine matrix to an array of (x, y) points of any leading shape"""
+    return points @ affine[:, :2].T + affine[:, 2]
+
+def read_coords(array):
+    """Read a PDF number array into a flat float64 buffer in one pass"""
+    try:
+        # The unparsed form of a number array is "[ n n n ... ]", resolved
+        # so a shared (indirect) array yields its contents, not "n g R"
+        return np.array(array.unparse(resolved=True)[1:-1].split(), dtype=np.float64)
+    except ValueError:
+        # Indirect references inside the array can't be decoded from its text form
+        pass
+    return np.fromiter((float(v) for v in array), dtype=np.float64, count=len(array))
+
+def read_ink_list(ink_list):
+    """Read all strokes of an /InkList into one flat buffer plus per-stroke coordinate counts"""
+    try:
+        body = ink_list.unparse(resolved=True).strip()[1:-1]
+        strokes = body.replace(b'[', b' ').split(b']')[:-1]
+        counts = np.array([len(stroke.split()) for stroke in strokes], dtype=np.intp)
+        coords = np.array(b' '.join(strokes).split(), dtype=np.float64)
+        if len(counts) != len(ink_list) or counts.sum() != len(coords):
+            raise ValueError("unexpected /InkList layout")
+    except ValueError:
+        buffers = [read_coords(stroke) for stroke in ink_list]
+        counts = np.array([len(b) for b in buffers], dtype=np.intp)
+        coords = np.concatenate(buffers) if buffers else np.empty(0)
+    return coords, counts
+
+def format_coords(coords, precision=DEFAULT_PRECISION):
+    """
+    Format a flat float64 buffer as PDF number tokens in one bulk pass
+    
+    Values are rounded to precision decimals, None keeps the shortest form
+    that reads back as the same float.
+    """
+    if not np.all(np.isfinite(coords)):
+        raise ValueError("coordinates must be finite numbers")
+    if precision is not None:
+        coords = np.round(coords, precision)
+    # Adding 0.0 turns negative zeros from mirrored zero coordinates into 0
+    coords = coords + 0.0
+    
+    magnitude = np.abs(coords)
+    if np.any((magnitude >= 1e16) | ((magnitude < 1e-4) & (magnitude > 0))):
+        # repr uses exponent notation for these, which PDF doesn't allow
+        digits = 17 if precision is None else precision
+        tokens = ['%.*f' % (digits, v) for v in coords.tolist()]
+        # Only fractional digits may be stripped, precision 0 writes integers
+        return [token.rstrip('0').rstrip('.') if '.' in token else token for token in tokens]
+    return list(map(repr, coords.tolist()))
+
+def write_coord_arrays(coords, counts, precision=DEFAULT_PRECISION, groups=None):
+    """
+    Build one pikepdf.Array per consecutive piece of a flat buffer
+    
+    All pieces are formatted in one pass and parsed by a single
+    Object.parse call, which is much cheaper than building every array
+    from Python floats. With groups, that many consecutive pieces are
+    nested into one array each, e.g. the strokes of every /InkList.
+    """
+    tokens = format_coords(coords, precision)
+    ends = np.cumsum(counts).tolist()
+    pieces = ['[ ' + ' '.join(tokens[start:end]) + ' ]' for start, end in zip([0] + ends[:-1], ends)]
+    if groups is not None:
+        ends = np.cumsum(groups).tolist()
+        pieces = ['[ ' + ' '.join(pieces[start:end]) + ' ]' for start, end in zip([0] + ends[:-1], ends)]
+    
+    # repr writes integral values as "n.0", every token is followed by a space
+    text = ('[ ' + ' '.join(pieces) + ' ]').replace('.0 ', ' ')
+    return list(pikepdf.Object.parse(text.encode()))
+
+def write_coords(coords, precision=DEFAULT_PRECISION):
+    """Build a pikepdf.Array from a flat float64 buffer"""
+    return write_coord_arrays(coords, [len(coords)], precision)[0]
+
+def transform_quads(coords, affine, swap):
+    """
+    Apply an affine matrix to a flat /QuadPoints buffer
+    
+    Incomplete trailing quadrilaterals are dropped. When swap is set the
+    corners of each quadrilateral are reordered with QUAD_SWAP_ORDER.
+    """
+    quads = transform_points(coords[:len(coords) // 8 * 8].reshape(-1, 4, 2), affine)
+    if swap:
+        quads = quads[:, QUAD_SWAP_ORDER]
+    return quads.ravel()
+
+def transform_point_lists(coords, counts, affine, reverse=False):
+    """
+    Apply an affine matrix to several point lists stored back to back in one flat buffer
+    
+    Used for the strokes of an /InkList and for /Vertices of many annotations
+    at once. Returns the transformed buffer and the new per-list coordinate
+    counts. Unpaired trailing coordinates are dropped from each list. When
+    reverse is set, lists with more than two points are reversed.
+    """
+    npoints = counts // 2
+    starts = np.cumsum(counts) - counts
+    first_point = np.cumsum(npoints) - npoints
+    
+    # Position of every kept point within its list, mirrored for reversed lists
+    position = np.arange(int(npoints.sum())) - np.repeat(first_point, npoints)
+    if reverse:
+        flip = np.repeat(npoints > 2, npoints)
+        position = np.where(flip, np.repeat(npoints - 1, npoints) - position, position)
+    
+    index = np.repeat(starts, npoints) + 2 * position
+    points = np.stack((coords[index], coords[index + 1]), axis=1)
+    return transform_points(points, affine).ravel(), npoints * 2
+
+def simplified_points(points, npoints, tolerance, lists=None):
+    """
+    Return the mask of points kept by Ramer-Douglas-Peucker simplification of several point lists
+    
+    points holds lists of npoints points each back to back. Every list
+    keeps its end points plus the interior points that lie further than
+    tolerance from the chord of the span they split, lists of up to two
+    points are kept whole. The spans of all lists are split together, one
+    level of the recursion per pass. With lists, only the lists where it
+    is True are simplified.
+    """
+    keep = np.ones(len(points), dtype=bool)
+    simplify = npoints > 2 if lists is None else (npoints > 2) & lists
+    ends = np.cumsum(npoints)[simplify]
+    firsts = ends - npoints[simplify]
+    keep[np.repeat(simplify, npoints)] = False
+    keep[firsts] = True
+    keep[ends - 1] = True
+    
+    span_starts, span_ends = firsts, ends - 1
+    while len(span_starts):
+        # Distance of every interior point to the chord of its span
+        lengths = span_ends - span_starts - 1
+        span = np.repeat(np.arange(len(lengths)), lengths)
+        index = np.repeat(span_starts + 1 - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        start = points[span_starts]
+        chord = points[span_ends] - start
+        length = np.hypot(chord[:, 0], chord[:, 1])
+        offset = points[index] - start[span]
+        chord = chord[span]
+        distance = np.abs(chord[:, 0] * offset[:, 1] - chord[:, 1] * offset[:, 0])
+        distance /= np.where(length > 0, length, 1.0)[span]
+        # Spans whose ends coincide measure the distance to that point
+        degenerate = (length == 0)[span]
+        if degenerate.any():
+            distance[degenerate] = np.hypot(offset[degenerate, 0], offset[degenerate, 1])
         
-        if horizontal:
-            x0, x1 = width - x0, width - x1
-        if vertical:
-            y0, y1 = height - y0, height - y1
+        # Split every span at its first farthest point, if that is far enough
+        farthest = np.maximum.reduceat(distance, np.cumsum(lengths) - lengths)
+        candidates = np.flatnonzero(distance == farthest[span])
+        first = np.concatenate(([True], span[candidates][1:] != span[candidates][:-1]))
+        split = farthest > tolerance
+        pivots = index[candidates[first]][split]
+        keep[pivots] = True
         
-        # Ensure coordinates are in order
-        xmin, xmax = min(x0, x1), max(x0, x1)
-        ymin, ymax = min(y0, y1), max(y0, y1)
+        span_starts = np.concatenate((span_starts[split], pivots))
+        span_ends = np.concatenate((pivots, span_ends[split]))
+        inner = span_ends - span_starts > 1
+        span_starts, span_ends = span_starts[inner], span_ends[inner]
+    return keep
+
+def simplify_point_lists(coords, counts, tolerance):
+    """
+    Simplify several point lists stored back to back in one flat buffer, see simplified_points
+    
+    Unpaired trailing coordinates are dropped from each list. Returns the
+    simplified buffer and the new per-list coordinate counts.
+    """
+    npoints = counts // 2
+    starts = np.cumsum(counts) - counts
+    first_point = np.cumsum(npoints) - npoints
+    index = np.repeat(starts, npoints) + 2 * (np.arange(int(npoints.sum())) - np.repeat(first_point, npoints))
+    points = np.stack((coords[index], coords[index + 1]), axis=1)
+    
+    keep = simplified_points(points, npoints, tolerance)
+    kept = np.bincount(np.repeat(np.arange(len(npoints)), npoints)[keep], minlength=len(npoints))
+    return points[keep].ravel(), kept * 2
+
+def write_ink_list(coords, counts, precision=DEFAULT_PRECISION):
+    """Build an /InkList array of strokes from a flat buffer and per-stroke counts"""
+    return write_coord_arrays(coords, counts, precision, [len(counts)])[0]
+
+def log_line_angles(original, flipped, affine):
+    """
+    Report the angle of a line before and after flipping
+    
+    The transform maps the angle exactly onto the expected one, so this is a
+    debug diagnostic only and is skipped entirely unless debug logging is on.
+    """
+    x1, y1, x2, y2 = original
+    orig_angle = math.degrees(math.atan2(y2 - y1, x2 - x1))
+    logger.debug("Original line angle: %.2f degrees", orig_angle)
+    
+    x1, y1, x2, y2 = flipped
+    new_angle = math.degrees(math.atan2(y2 - y1, x2 - x1))
+    logger.debug("Angle after coordinate flipping: %.2f degrees", new_angle)
+    
+    # Check if angle is correctly flipped, the direction follows the linear part
+    x1, y1, x2, y2 = original
+    dx, dy = affine[:, :2] @ (x2 - x1, y2 - y1)
+    expected_angle = math.degrees(math.atan2(dy, dx))
+    
+    # Normalize angle to [-180, 180] range
+    expected_angle = ((expected_angle + 180) % 360) - 180
+    logger.debug("Expected flipped angle: %.2f degrees", expected_angle)
+    
+    angle_diff = abs((new_angle - expected_angle + 180) % 360 - 180)
+    if angle_diff > 10:  # Allow 10 degree error
+        logger.debug("Angle doesn't match expectation (difference %.2f degrees)", angle_diff)
+
+class FlipStats:
+    """
+    Counters and cumulative timings of one run, for --stats and monitoring
+    
+    Pass an instance to flip_annotations to have it filled. Times are
+    nanoseconds from time.perf_counter_ns, per I/O phase ('open', 'flip',
+    'save') and per subtype handler. Nothing is measured when no
+    FlipStats is given.
+    """
+    
+    def __init__(self):
+        self.phases = {}
+        # subtype -> [handler calls, annotations, nanoseconds]
+        self.handlers = {}
+        self.pages = 0
+        self.annotations = 0
+        self.coordinates = 0
+        # Shared object cache counters, copied from FlipOptions at the end of a run
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Ink points dropped by simplification, also copied from FlipOptions
+        self.points_removed = 0
+    
+    def add_phase(self, phase, ns):
+        self.phases[phase] = self.phases.get(phase, 0) + ns
+    
+    def add_handler(self, subtype, annotations, ns):
+        entry = self.handlers.setdefault(subtype, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += annotations
+        entry[2] += ns
+        self.annotations += annotations
+    
+    def merge(self, other):
+        """Add the counters of another FlipStats, e.g. from a worker process"""
+        for phase, ns in other.phases.items():
+            self.add_phase(phase, ns)
+        for subtype, (calls, annotations, ns) in other.handlers.items():
+            entry = self.handlers.setdefault(subtype, [0, 0, 0])
+            entry[0] += calls
+            entry[1] += annotations
+            entry[2] += ns
+        self.pages += other.pages
+        self.annotations += other.annotations
+        self.coordinates += other.coordinates
+    
+    def as_dict(self):
+        """Return the counters as plain JSON-serialisable data"""
+        return {
+            'phases_ns': dict(self.phases),
+            'handlers': {subtype: {'calls': calls, 'annotations': annotations, 'ns': ns}
+                         for subtype, (calls, annotations, ns) in sorted(self.handlers.items())},
+            'pages': self.pages,
+            'annotations': self.annotations,
+            'coordinates': self.coordinates,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'points_removed': self.points_removed,
+        }
+    
+    def summary(self):
+        """Return a human-readable multi-line report"""
+        lines = [f"Pages with annotations: {self.pages}, annotations: {self.annotations}, "
+                 f"coordinates transformed: {self.coordinates}, "
+                 f"shared objects transformed/reused: {self.cache_misses}/{self.cache_hits}"]
+        if self.points_removed:
+            lines.append(f"Ink points removed by simplification: {self.points_removed}")
+        for phase, ns in self.phases.items():
+            lines.append(f"  {phase:<12} {ns / 1e6:10.2f} ms")
+        for subtype, (calls, annotations, ns) in sorted(self.handlers.items(), key=lambda item: -item[1][2]):
+            lines.append(f"  {subtype:<12} {ns / 1e6:10.2f} ms  {annotations} annotations in {calls} calls")
+        return '\n'.join(lines)
+
+def count_coordinates(ctx, count):
+    """Add transformed coordinate values to the run's FlipStats, if any"""
+    if ctx.options.stats is not None:
+        ctx.options.stats.coordinates += int(count)
+
+def read_rects(annots):
+    """Read the /Rect of every entry of an /Annots array into an n x 4 array, NaN where there is none"""
+    rects = np.full((len(annots), 4), np.nan)
+    for i, annot in enumerate(annots):
+        if not isinstance(annot, pikepdf.Dictionary) or '/Rect' not in annot:
+            continue
+        try:
+            values = read_coords(annot.Rect)
+        except Exception as e:
+            logger.debug("Annotation #%d has an unreadable /Rect: %s", i + 1, e)
+            continue
+        if len(values) >= 4:
+            rects[i] = values[:4]
+    return rects
+
+def normalize_rects(rects):
+    """Return rectangles given by any two opposite corners as (x0, y0, x1, y1) with x0 <= x1 and y0 <= y1"""
+    rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+    return np.concatenate((np.minimum(rects[:, :2], rects[:, 2:]), np.maximum(rects[:, :2], rects[:, 2:])), axis=1)
+
+def rects_in_region(rects, region, contained=True):
+    """Return the mask of normalized rects lying inside a normalized region, or overlapping it unless contained"""
+    x0, y0, x1, y1 = region
+    if contained:
+        return (rects[:, 0] >= x0) & (rects[:, 1] >= y0) & (rects[:, 2] <= x1) & (rects[:, 3] <= y1)
+    return (rects[:, 0] <= x1) & (rects[:, 2] >= x0) & (rects[:, 1] <= y1) & (rects[:, 3] >= y0)
+
+# Rects covering more grid cells than this are kept aside and tested by
+# every query, so a few page-sized /Rects don't fill the whole grid
+MAX_INDEX_CELLS = 16
+
+# Upper bound of the cells of a grid along either axis
+MAX_GRID_SIZE = 1024
+
+class RectIndex:
+    """
+    Uniform grid over the rectangles of a page, for region queries
+    
+    rects is an n x 4 array of rectangles, rows holding NaN (a missing
+    /Rect) are never returned. The grid spans the bounds of all rects with
+    about one cell per rect, and every rect is listed in each cell it
+    overlaps, cells in one sorted array. A query only tests the rects
+    listed in the cells it touches, plus those too large to be listed, so
+    its cost follows the number of hits rather than the number of rects.
+    """
+    
+    def __init__(self, rects):
+        self.rects = normalize_rects(rects)
+        valid = np.flatnonzero(np.all(np.isfinite(self.rects), axis=1))
+        if len(valid):
+            self.origin = self.rects[valid, :2].min(axis=0)
+            extent = self.rects[valid, 2:].max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
         
-        annot.Rect = pikepdf.Array([
-            Decimal(str(xmin)), Decimal(str(ymin)),
-            Decimal(str(xmax)), Decimal(str(ymax))
-        ])
-    
-    # 2. Line annotation (handled separately through specialized functions)
-    if '/L' in annot and str(annot.Subtype) != '/Line':
-        points = annot.L
-        x1, y1, x2, y2 = (float(points[0]), float(points[1]),
-                           float(points[2]), float(points[3]))
+        # About as many cells as rects, but no smaller than a typical rect
+        # so that most rects are listed in at most four cells
+        cell = np.sqrt(extent[0] * extent[1] / max(len(valid), 1))
+        if len(valid):
+            cell = np.maximum(cell, np.median(self.rects[valid, 2:] - self.rects[valid, :2], axis=0))
+        shape = np.clip(np.ceil(extent / np.where(cell > 0, cell, 1.0)), 1, MAX_GRID_SIZE).astype(np.intp)
+        nx, ny = self.shape = int(shape[0]), int(shape[1])
+        self.cell = np.where(extent > 0, extent / shape, 1.0)
         
-        if horizontal:
-            x1, x2 = width - x1, width - x2
-        if vertical:
-            y1, y2 = height - y1, height - y2
+        lo, hi = self.cell_range(self.rects[valid])
+        spans = hi - lo + 1
+        sizes = spans[:, 0] * spans[:, 1]
+        small = sizes <= MAX_INDEX_CELLS
+        self.large = valid[~small]
+        rows, lo, spans, sizes = valid[small], lo[small], spans[small], sizes[small]
         
-        annot.L = pikepdf.Array([
-            Decimal(str(x1)), Decimal(str(y1)),
-            Decimal(str(x2)), Decimal(str(y2))
-        ])
-    
-    # 3. Polygon/Polyline annotation
-    if '/Vertices' in annot:
-        vertices = annot.Vertices
+        # Every rect enters the cells of its block, numbered row by row
+        position = np.arange(int(sizes.sum())) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        width = np.repeat(spans[:, 0], sizes)
+        cells = (np.repeat(lo[:, 1], sizes) + position // width) * nx + np.repeat(lo[:, 0], sizes) + position % width
+        order = np.argsort(cells, kind='stable')
+        self.cell_rows = np.repeat(rows, sizes)[order]
+        self.cell_offsets = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=nx * ny)))).astype(np.intp)
+    
+    def __len__(self):
+        return len(self.rects)
+    
+    def cell_range(self, rects):
+        """Return the first and last grid cell (column, row) covered by each of the normalized rects"""
+        limit = np.array(self.shape) - 1
+        lo = np.clip(np.floor((rects[:, :2] - self.origin) / self.cell), 0, limit).astype(np.intp)
+        hi = np.clip(np.floor((rects[:, 2:] - self.origin) / self.cell), 0, limit).astype(np.intp)
+        return lo, hi
+    
+    def query(self, region, contained=False):
+        """
+        Return the sorted positions of the rects overlapping region (x0, y0, x1, y1)
         
-        # Group vertices into (x,y) pairs
-        points = []
-        for i in range(0, len(vertices), 2):
-            if i + 1 < len(vertices):
-                x = float(vertices[i])
-                y = float(vertices[i + 1])
-                points.append((x, y))
+        With contained, only rects lying entirely inside region are returned.
+        """
+        region = normalize_rects(region)
+        (cx0, cy0), (cx1, cy1) = (corner[0] for corner in self.cell_range(region))
+        cells = (np.arange(cy0, cy1 + 1)[:, None] * self.shape[0] + np.arange(cx0, cx1 + 1)).ravel()
+        starts = self.cell_offsets[cells]
+        lengths = self.cell_offsets[cells + 1] - starts
+        ends = np.cumsum(lengths)
+        listed = self.cell_rows[np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1])]
+        candidates = np.unique(np.concatenate((listed, self.large)))
+        return candidates[rects_in_region(self.rects[candidates], region[0], contained)]
+
+class AnnotationFilter:
+    """
+    Select the pages and annotations a run flips, everything else is left untouched
+    
+    Parameters:
+        pages: Zero-based page numbers, e.g. a range or a set (default: None, every page)
+        subtypes: Subtype names such as '/Ink', the slash may be left out
+            (default: None, every subtype)
+        authors: Author names, as in the /T entry of annotations (default: None, any author)
+        region: (x0, y0, x1, y1) area in page coordinates, like /Rect,
+            that the /Rect of an annotation must lie inside (default:
+            None, anywhere on the page)
+    
+    Annotations are flipped when they match every given criterion.
+    """
+    
+    def __init__(self, pages=None, subtypes=None, authors=None, region=None):
+        self.pages = None if pages is None else frozenset(pages)
+        self.subtypes = None if subtypes is None else frozenset(
+            name if name.startswith('/') else '/' + name for name in subtypes)
+        self.authors = None if authors is None else frozenset(authors)
+        self.region = None if region is None else tuple(normalize_rects(region)[0].tolist())
+    
+    def page_range(self, start=0, stop=None):
+        """Narrow [start, stop) to the span of the selected pages"""
+        if self.pages is None:
+            return start, stop
+        if not self.pages:
+            return start, start
+        last = max(self.pages) + 1
+        return max(start, min(self.pages)), last if stop is None else min(stop, last)
+    
+    def selects_page(self, page_num):
+        return self.pages is None or page_num in self.pages
+    
+    def selects(self, annot, subtype, in_region=False):
+        """
+        Tell whether an annotation of the given subtype is flipped
         
-        # Flip coordinates
-        flipped_points = []
-        for x, y in points:
-            new_x, new_y = x, y
-            if horizontal:
-                new_x = width - x  # Horizontal flip
-            if vertical:
-                new_y = height - y  # Vertical flip
-            flipped_points.append((new_x, new_y))
+        /T is only read when authors are given, and /Rect only with a region
+        unless in_region tells the annotation is already known to lie inside.
+        """
+        if self.subtypes is not None and subtype not in self.subtypes:
+            return False
+        if self.region is not None and not in_region and not rects_in_region(normalize_rects(read_rects([annot])), self.region)[0]:
+            return False
+        if self.authors is not None:
+            author = annot.get('/T')
+            return author is not None and str(author) in self.authors
+        return True
+    
+    def as_dict(self):
+        """Return the criteria as plain JSON-serialisable data"""
+        return {
+            'pages': None if self.pages is None else sorted(self.pages),
+            'subtypes': None if self.subtypes is None else sorted(self.subtypes),
+            'authors': None if self.authors is None else sorted(self.authors),
+            'region': None if self.region is None else list(self.region),
+        }
+
+class FlipOptions:
+    """
+    Optional behaviour and run-wide state shared by every page of one run
+    
+    Parameters:
+        keep_appearance: Mirror appearance streams instead of deleting /AP (default: False)
+        transform: Affine matrix or sequence of matrices applied after the
+            flip, or a callable (page_num, box) returning one per page
+            (default: None). Callables must be picklable for parallel runs.
+        stats: FlipStats filled during the run (default: None, no measuring)
+        precision: Decimals written for coordinates, None for full
+            precision (default: DEFAULT_PRECISION)
+        undo: Flips already applied to the document, as recorded by its
+            marker, undone before the flip (default: None)
+        select: AnnotationFilter choosing the pages and annotations to
+            flip (default: None, all of them)
+        simplify: Tolerance in PDF units for simplifying ink strokes, None
+            keeps every point (default: None)
+        tight_rects: Fit /Rect to the flipped points of annotations that
+            have any instead of mirroring it, see fit_rects (default: False)
+    """
+    
+    def __init__(self, keep_appearance=False, transform=None, stats=None, precision=DEFAULT_PRECISION,
+                 undo=None, select=None, simplify=None, tight_rects=False):
+        self.keep_appearance = keep_appearance
+        self.precision = precision
+        self.undo = undo
+        self.select = select
+        self.simplify = simplify
+        self.tight_rects = tight_rects
+        self.stats = stats
+        # Fixed transforms are collapsed into one matrix up front
+        if transform is not None and not callable(transform):
+            transform = compose_affine(transform)
+        self.transform = transform
+        # Shared (indirect) coordinate arrays and appearance streams already
+        # transformed in this run, by objgen
+        self.transformed_objects = {}
+        # Indirect annotation dictionaries already flipped, by objgen
+        self.flipped_annotations = set()
+        # Indirect objects holding the annotations the run modified: the
+        # annotation itself, or the /Annots array or page of a direct one
+        self.modified_objects = {}
+        # FlipContext of every distinct page geometry seen so far
+        self.page_contexts = {}
+        # References to shared objects that were reused, and objects transformed
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.points_removed = 0
+    
+    def page_transform(self, page_num, box):
+        """Return the 2x3 transform applied after the flip on a page, or None"""
+        if callable(self.transform):
+            return compose_affine(self.transform(page_num, box))
+        return self.transform
+
+FlipContext = namedtuple("FlipContext", "box affine mirrored debug options")
+
+def make_flip_context(box, horizontal=True, vertical=False, options=None, transform=None):
+    """
+    Bundle the page box and the page's affine matrix shared by all annotation handlers
+    
+    The mirror and transform are collapsed into one matrix. mirrored is set
+    when it reverses orientation, which decides point order and line endings.
+    """
+    affine = mirror_affine(box, horizontal, vertical)
+    if transform is not None:
+        affine = compose_affine((affine, transform))
+    mirrored = bool(np.linalg.det(affine[:, :2]) < 0)
+    return FlipContext(box, affine, mirrored, logger.isEnabledFor(logging.DEBUG), options or FlipOptions())
+
+# Default /MediaBox of pages that have none, US Letter like qpdf
+DEFAULT_MEDIABOX = (0.0, 0.0, 612.0, 792.0)
+
+# Deepest page tree walked for inherited page attributes, guards against /Parent cycles
+MAX_PAGE_TREE_DEPTH = 64
+
+def inherited_value(page_obj, key):
+    """
+    Return an inheritable page attribute such as /MediaBox, or None
+    
+    The page dictionary and its /Parent nodes are read, but never written.
+    pikepdf's Page.mediabox and Page.cropbox copy shared and inherited
+    boxes into the page dictionary, which would rewrite every page the
+    serial path visits and make its output differ from a parallel run.
+    """
+    node = page_obj
+    for _ in range(MAX_PAGE_TREE_DEPTH):
+        if key in node:
+            return node[key]
+        node = node.get('/Parent')
+        if node is None:
+            return None
+    return None
+
+def page_geometry(page):
+    """
+    Return the effective (x0, y0, x1, y1) box and the /Rotate angle of a page
+    
+    The visible area is the /CropBox clipped to the /MediaBox, both possibly
+    inherited from the page tree. The page dictionary is left unchanged.
+    """
+    media = inherited_value(page.obj, '/MediaBox')
+    media = np.array(DEFAULT_MEDIABOX) if media is None else read_coords(media)[:4]
+    crop = inherited_value(page.obj, '/CropBox')
+    crop = media if crop is None else read_coords(crop)[:4]
+    x0 = max(min(media[0], media[2]), min(crop[0], crop[2]))
+    y0 = max(min(media[1], media[3]), min(crop[1], crop[3]))
+    x1 = min(max(media[0], media[2]), max(crop[0], crop[2]))
+    y1 = min(max(media[1], media[3]), max(crop[1], crop[3]))
+    if x0 >= x1 or y0 >= y1:
+        # A crop box outside the media box, fall back to the media box
+        x0, x1 = sorted(media[0::2])
+        y0, y1 = sorted(media[1::2])
+    return (float(x0), float(y0), float(x1), float(y1)), page.rotation
+
+def page_affine(box, rotation, horizontal, vertical, transform=None):
+    """
+    Return the whole 2x3 matrix a flip applies to a page with the given geometry
+    
+    horizontal and vertical are given as the page is displayed, see
+    page_flip_context.
+    """
+    if rotation % 180:
+        horizontal, vertical = vertical, horizontal
+    affine = mirror_affine(box, horizontal, vertical)
+    return affine if transform is None else compose_affine((affine, transform))
+
+def page_flip_context(page, page_num, horizontal=True, vertical=False, options=None):
+    """
+    Return the FlipContext of a page, cached per distinct page geometry
+    
+    Flip directions are given as the page is displayed. On pages rotated
+    by 90 or 270 degrees a displayed horizontal flip is a vertical flip of
+    the page's own coordinates, and vice versa.
+    """
+    box, rotation = page_geometry(page)
+    return geometry_flip_context(box, rotation, page_num, horizontal, vertical, options)
+
+def geometry_flip_context(box, rotation, page_num, horizontal=True, vertical=False, options=None):
+    """Return the FlipContext of a page with the given box and /Rotate, see page_flip_context"""
+    options = options or FlipOptions()
+    transform = options.page_transform(page_num, box)
+    if options.undo:
+        # Go back through the flips recorded in the document first, so the
+        # page ends up flipped once relative to its original annotations
+        applied = compose_affine([page_affine(box, rotation, *step) for step in options.undo])
+        transform = compose_affine((invert_affine(applied), page_affine(box, rotation, horizontal, vertical, transform)))
+        horizontal = vertical = False
+    elif rotation % 180:
+        horizontal, vertical = vertical, horizontal
+    
+    key = (box, horizontal, vertical, None if transform is None else transform.tobytes())
+    ctx = options.page_contexts.get(key)
+    if ctx is None:
+        ctx = make_flip_context(box, horizontal, vertical, options, transform)
+        options.page_contexts[key] = ctx
+    return ctx
+
+def split_coords(coords, counts):
+    """Split a flat buffer into consecutive pieces of the given lengths"""
+    if len(counts) == 0:
+        return []
+    return np.split(coords, np.cumsum(counts)[:-1])
+
+def select_values(annots, key, ctx):
+    """
+    Return the (annot, value) pairs of key that still need transforming
+    
+    Indirect values may be shared by several annotations. Each one is
+    returned once per run, later references count as cache hits.
+    """
+    options = ctx.options
+    selected = []
+    seen = set()
+    for annot in annots:
+        if key not in annot:
+            continue
+        value = annot[key]
+        if value.is_indirect:
+            if value.objgen in options.transformed_objects or value.objgen in seen:
+                options.cache_hits += 1
+                continue
+            seen.add(value.objgen)
+        selected.append((annot, value))
+    return selected
+
+def store_value(annot, key, value, new_value, ctx):
+    """Write a transformed value, in place for indirect objects so every reference sees it"""
+    if value.is_indirect:
+        value[:] = new_value
+        ctx.options.transformed_objects[value.objgen] = value
+        ctx.options.cache_misses += 1
+    else:
+        annot[key] = new_value
+
+# Annotation handler steps
+#
+# Every step receives a list of annotations and a FlipContext and only
+# touches the keys it is responsible for. Steps compute all new values
+# before writing any of them, so a failed bulk call can be retried one
+# annotation at a time.
+
+def mirror_form_matrix(form, affine):
+    """
+    Return the /Matrix of a form XObject with the linear part of affine appended
+    
+    The transform runs about the centre of the form's transformed bounding
+    box, so the box keeps its place and the appearance still maps onto the
+    annotation's (flipped) /Rect, but its content is drawn mirrored.
+    """
+    matrix = read_coords(form.Matrix) if '/Matrix' in form else np.array([1.0, 0.0, 0.0, 1.0, 0.0, 0.0])
+    x0, y0, x1, y1 = read_coords(form.BBox)[:4]
+    corners = np.array([[x0, y0], [x1, y0], [x0, y1], [x1, y1]]) @ matrix[:4].reshape(2, 2) + matrix[4:]
+    center = (corners.min(axis=0) + corners.max(axis=0)) / 2
+    
+    # PDF matrices act on row vectors, so the linear part is appended transposed
+    linear = affine[:, :2].T
+    return np.concatenate(((matrix[:4].reshape(2, 2) @ linear).ravel(), (matrix[4:] - center) @ linear + center))
+
+def appearance_streams(ap):
+    """Yield every form XObject of an /AP dictionary, including per-state appearances"""
+    for key in ('/N', '/R', '/D'):
+        if key not in ap:
+            continue
+        appearance = ap[key]
+        if isinstance(appearance, pikepdf.Stream):
+            yield appearance
+        elif isinstance(appearance, pikepdf.Dictionary):
+            for state in appearance.keys():
+                if isinstance(appearance[state], pikepdf.Stream):
+                    yield appearance[state]
+
+def update_appearance(annots, ctx):
+    """
+    Delete AP (appearance stream), to force PDF viewer to re-render the annotation
+    
+    With keep_appearance the appearance streams are mirrored in place
+    instead. Streams shared between annotations are mirrored once per run.
+    """
+    if not ctx.options.keep_appearance:
+        for annot in annots:
+            if '/AP' in annot:
+                logger.debug("Deleting AP appearance stream, forcing re-rendering")
+                del annot.AP
+        return
+    
+    options = ctx.options
+    updates = {}
+    for annot in annots:
+        if '/AP' not in annot:
+            continue
+        for form in appearance_streams(annot.AP):
+            if '/BBox' not in form:
+                continue
+            if form.objgen in options.transformed_objects or form.objgen in updates:
+                options.cache_hits += 1
+                continue
+            updates[form.objgen] = (form, mirror_form_matrix(form, ctx.affine))
+    
+    for objgen, (form, matrix) in updates.items():
+        logger.debug("Mirroring appearance stream %d %d R", *objgen)
+        # Matrices keep full precision, their entries scale the whole form
+        form.Matrix = write_coords(matrix, None)
+        options.transformed_objects[objgen] = form
+        options.cache_misses += 1
+
+def flip_rects(annots, ctx):
+    """Flip /Rect, almost all annotations have one, keeping its coordinates in order"""
+    selected = select_values(annots, '/Rect', ctx)
+    if not selected:
+        return
+    
+    rects = np.array([read_coords(value)[:4] for _, value in selected])
+    corners = rects[:, [[0, 1], [2, 1], [0, 3], [2, 3]]]
+    corners = transform_points(corners, ctx.affine)
+    flipped = np.concatenate((corners.min(axis=1), corners.max(axis=1)), axis=1)
+    count_coordinates(ctx, rects.size)
+    
+    if ctx.debug:
+        for rect, flipped_rect in zip(rects.tolist(), flipped.tolist()):
+            logger.debug("Original rectangle: (%s, %s, %s, %s)", *rect)
+            logger.debug("Flipped rectangle: (%s, %s, %s, %s)", *flipped_rect)
+    
+    arrays = write_coord_arrays(flipped.ravel(), [4] * len(flipped), ctx.options.precision)
+    for (annot, value), rect in zip(selected, arrays):
+        store_value(annot, '/Rect', value, rect, ctx)
+
+# How far line ending styles (arrows, circles, ...) reach past the end of
+# a line, in border widths, viewers draw them at most about this size
+LINE_ENDING_SCALE = 4.0
+
+def border_width(annot):
+    """Return the border (stroke) width of an annotation, from /BS or /Border, 1 by default"""
+    style = annot.get('/BS')
+    if isinstance(style, pikepdf.Dictionary) and '/W' in style:
+        return abs(float(style.W))
+    border = annot.get('/Border')
+    if isinstance(border, pikepdf.Array) and len(border) >= 3:
+        return abs(float(border[2]))
+    return 1.0
+
+def rect_padding(annot, keep_appearance=False):
+    """
+    Return how far the drawing of an annotation reaches past its points, for a fitted /Rect
+    
+    That is half the border width, plus the line endings and leader lines
+    of lines and polylines. Returns None when the extent can't be told from
+    the points: an appearance stream that is kept (it is drawn into /Rect),
+    /RD rectangle differences, cloudy borders and line captions.
+    """
+    if keep_appearance and '/AP' in annot:
+        return None
+    if '/RD' in annot or annot.get('/Cap', False):
+        return None
+    effect = annot.get('/BE')
+    if isinstance(effect, pikepdf.Dictionary) and effect.get('/S') == '/C':
+        return None
+    
+    width = border_width(annot)
+    padding = width / 2
+    endings = annot.get('/LE')
+    if isinstance(endings, pikepdf.Array) and any(ending != '/None' for ending in endings):
+        padding += LINE_ENDING_SCALE * width
+    # Leader lines run perpendicular to the line from its end points
+    if '/LL' in annot:
+        padding += abs(float(annot.LL)) + abs(float(annot.get('/LLE', 0)))
+    return padding
+
+def fit_rects(annots, coords, counts, ctx, padded=True):
+    """
+    Set /Rect of annotations to the bounds of their flipped points
+    
+    Used by the geometry steps with the tight_rects option, coords being
+    the flipped buffer and counts the number of its coordinates owned by
+    each annotation. The bounds of all annotations are taken by one min/max
+    reduction over the buffer, then padded by rect_padding unless padded is
+    False (text markup has no border). Annotations without points, or whose
+    padding is unknown, keep their flipped /Rect.
+    """
+    counts = np.asarray(counts)
+    rows = np.flatnonzero(counts >= 2)
+    if not len(rows):
+        return
+    keep_appearance = ctx.options.keep_appearance
+    padding = [rect_padding(annots[row], keep_appearance) if padded else 0.0 for row in rows.tolist()]
+    
+    # Empty rows in between own no points, each reduction ends at the next row with some
+    points = coords.reshape(-1, 2)
+    starts = (np.cumsum(counts) - counts)[rows] // 2
+    low = np.minimum.reduceat(points, starts, axis=0)
+    high = np.maximum.reduceat(points, starts, axis=0)
+    
+    known = np.array([pad is not None for pad in padding], dtype=bool)
+    pad = np.array([pad for pad in padding if pad is not None], dtype=np.float64)[:, None]
+    rects = np.concatenate((low[known] - pad, high[known] + pad), axis=1)
+    rows = rows[known]
+    
+    if ctx.debug:
+        for row, rect in zip(rows.tolist(), rects.tolist()):
+            logger.debug("Fitted rectangle: (%s, %s, %s, %s)", *rect)
+    
+    arrays = write_coord_arrays(rects.ravel(), [4] * len(rects), ctx.options.precision)
+    for row, rect in zip(rows.tolist(), arrays):
+        annot = annots[row]
+        value = annot.get('/Rect')
+        if isinstance(value, pikepdf.Array) and value.is_indirect:
+            value[:] = rect
+        else:
+            annot.Rect = rect
+
+def shared_geometry(annots, key, selected, coords, counts, ctx):
+    """
+    Add the annotations sharing a transformed value of key to those fit_rects fits
+    
+    selected are the (annot, value) pairs a geometry step transformed into
+    the flat buffer coords, counts coordinates each. Other annotations of
+    annots whose indirect value of key was transformed as well, by this
+    step or earlier in the run, are appended with the points of that
+    value, so every annotation drawing the flipped points gets its /Rect
+    fitted. Returns (annots, coords, counts) for fit_rects.
+    """
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    positions = {value.objgen: i for i, (_, value) in enumerate(selected) if value.is_indirect}
+    fitted = [annot for annot, _ in selected]
+    pieces = [coords]
+    piece_counts = [np.asarray(counts, dtype=np.intp)]
+    claimed = set()
+    for annot in annots:
+        value = annot.get(key)
+        if value is None or not value.is_indirect:
+            continue
+        i = positions.get(value.objgen)
+        if i is None:
+            # Transformed by an earlier step of the run, the value holds the flipped points
+            if value.objgen not in ctx.options.transformed_objects:
+                continue
+            points = read_ink_list(value)[0] if key == '/InkList' else read_coords(value)
+            points = points[:len(points) // 2 * 2]
+        elif value.objgen not in claimed:
+            # The selected annotation itself
+            claimed.add(value.objgen)
+            continue
+        else:
+            points = coords[starts[i]:ends[i]]
+        fitted.append(annot)
+        pieces.append(points)
+        piece_counts.append(np.array([len(points)], dtype=np.intp))
+    if len(fitted) == len(selected):
+        return fitted, coords, counts
+    return fitted, np.concatenate(pieces), np.concatenate(piece_counts)
+
+def flip_lines(annots, ctx):
+    """Flip /L of line annotations and swap their /LE line ending styles"""
+    selected = select_values(annots, '/L', ctx)
+    if not selected:
+        if ctx.options.tight_rects:
+            fit_rects(*shared_geometry(annots, '/L', selected, np.empty(0), [], ctx), ctx)
+        return
+    
+    # Only flip coordinates, don't swap endpoints
+    lines = np.array([read_coords(value)[:4] for _, value in selected])
+    flipped = transform_points(lines.reshape(-1, 2, 2), ctx.affine).reshape(-1, 4)
+    count_coordinates(ctx, flipped.size)
+    
+    if ctx.debug:
+        for line, flipped_line in zip(lines.tolist(), flipped.tolist()):
+            logger.debug("Original line: from (%s, %s) to (%s, %s)", *line)
+            log_line_angles(line, flipped_line, ctx.affine)
+            logger.debug("Flipped line: from (%s, %s) to (%s, %s)", *flipped_line)
+    
+    arrays = write_coord_arrays(flipped.ravel(), [4] * len(flipped), ctx.options.precision)
+    if ctx.options.tight_rects:
+        fit_rects(*shared_geometry(annots, '/L', selected, flipped.ravel(), [4] * len(flipped), ctx), ctx)
+    for (annot, value), line in zip(selected, arrays):
+        store_value(annot, '/L', value, line, ctx)
+
+def swap_line_endings(annots, ctx):
+    """
+    Swap the two /LE line ending styles of line annotations, for mirroring transforms only
+    
+    Rotations, scales and translations keep the look of the ending at
+    each end of /L, whose points keep their order.
+    """
+    if not ctx.mirrored:
+        return
+    for annot in annots:
+        if '/LE' in annot and len(annot.LE) == 2:
+            logger.debug("Swapping line ending styles")
+            annot.LE = pikepdf.Array([annot.LE[1], annot.LE[0]])
+
+def flip_vertices(annots, ctx):
+    """Flip /Vertices of polygons and polylines"""
+    selected = select_values(annots, '/Vertices', ctx)
+    if not selected:
+        if ctx.options.tight_rects:
+            fit_rects(*shared_geometry(annots, '/Vertices', selected, np.empty(0), [], ctx), ctx)
+        return
+    
+    buffers = [read_coords(value) for _, value in selected]
+    counts = np.array([len(vertices) for vertices in buffers], dtype=np.intp)
+    
+    # Mirroring transforms (e.g. horizontal or vertical only) need point
+    # reversal to maintain shape, only reverse if more than 2 points
+    flipped, counts = transform_point_lists(np.concatenate(buffers), counts, ctx.affine, ctx.mirrored)
+    count_coordinates(ctx, flipped.size)
+    
+    arrays = write_coord_arrays(flipped, counts, ctx.options.precision)
+    if ctx.options.tight_rects:
+        fit_rects(*shared_geometry(annots, '/Vertices', selected, flipped, counts, ctx), ctx)
+    for (annot, value), original, vertices, array in zip(selected, buffers, split_coords(flipped, counts), arrays):
+        if ctx.debug:
+            point_count = len(vertices) // 2
+            logger.debug("Polygon/polyline vertex count: %d", point_count)
+            # Output point changes for checking
+            if point_count <= 10:  # Avoid excessive output
+                logger.debug("Original point sequence:")
+                for idx, (x, y) in enumerate(original[:point_count * 2].reshape(-1, 2).tolist()):
+                    logger.debug("  Point %d: (%.2f, %.2f)", idx + 1, x, y)
+                
+                logger.debug("Flipped point sequence:")
+                for idx, (x, y) in enumerate(vertices.reshape(-1, 2).tolist()):
+                    logger.debug("  Point %d: (%.2f, %.2f)", idx + 1, x, y)
+            
+            # Handle polygon border endpoint styles, if any
+            if '/BE' in annot:
+                logger.debug("Note: This polygon has border endpoint styles, may need additional processing")
         
-        # For polygon, point order is important
-        # If both horizontal and vertical flip, or no flip, maintain original order
-        # If only horizontal or only vertical flip, reverse the point order
-        if (horizontal and not vertical) or (vertical and not horizontal):
-            flipped_points.reverse()  # Reverse point order
+        store_value(annot, '/Vertices', value, array, ctx)
+
+def flip_quad_points(annots, ctx):
+    """Flip /QuadPoints of highlight, underline, squiggly and strikeout annotations"""
+    selected = select_values(annots, '/QuadPoints', ctx)
+    if not selected:
+        if ctx.options.tight_rects:
+            fit_rects(*shared_geometry(annots, '/QuadPoints', selected, np.empty(0), [], ctx), ctx, padded=False)
+        return
+    
+    # Incomplete trailing quadrilaterals are dropped per annotation
+    buffers = [read_coords(value) for _, value in selected]
+    buffers = [quad_points[:len(quad_points) // 8 * 8] for quad_points in buffers]
+    counts = np.array([len(quad_points) for quad_points in buffers], dtype=np.intp)
+    
+    # Point order is typically: top-left, top-right, bottom-left, bottom-right
+    # After horizontal flip should be: top-right, top-left, bottom-right, bottom-left
+    flipped = transform_quads(np.concatenate(buffers), ctx.affine, ctx.mirrored)
+    count_coordinates(ctx, flipped.size)
+    
+    if ctx.debug:
+        for quad, flipped_quad in zip(np.concatenate(buffers).reshape(-1, 4, 2).tolist(),
+                                      flipped.reshape(-1, 4, 2).tolist()):
+            logger.debug("Original quadrilateral: %s", [tuple(p) for p in quad])
+            logger.debug("Flipped quadrilateral: %s", [tuple(p) for p in flipped_quad])
+    
+    arrays = write_coord_arrays(flipped, counts, ctx.options.precision)
+    if ctx.options.tight_rects:
+        fit_rects(*shared_geometry(annots, '/QuadPoints', selected, flipped, counts, ctx), ctx, padded=False)
+    for (annot, value), quad_points in zip(selected, arrays):
+        store_value(annot, '/QuadPoints', value, quad_points, ctx)
+
+def flip_ink_lists(annots, ctx):
+    """
+    Flip every stroke of /InkList, reversing point order for mirroring transforms
+    
+    With the simplify option the strokes are simplified before they are
+    transformed, in the annotation's own coordinates.
+    """
+    selected = select_values(annots, '/InkList', ctx)
+    if not selected:
+        if ctx.options.tight_rects:
+            fit_rects(*shared_geometry(annots, '/InkList', selected, np.empty(0), [], ctx), ctx)
+        return
+    
+    ink_lists = [read_ink_list(value) for _, value in selected]
+    stroke_counts = np.array([len(counts) for _, counts in ink_lists], dtype=np.intp)
+    coords = np.concatenate([coords for coords, _ in ink_lists])
+    counts = np.concatenate([counts for _, counts in ink_lists]).astype(np.intp)
+    
+    if ctx.debug:
+        for stroke_idx, count in enumerate(counts.tolist()):
+            logger.debug("Ink stroke #%d, point count: %d", stroke_idx + 1, count // 2)
+    
+    if ctx.options.simplify is not None:
+        original = int((counts // 2).sum())
+        coords, counts = simplify_point_lists(coords, counts, ctx.options.simplify)
+        ctx.options.points_removed += original - int(counts.sum()) // 2
+        logger.debug("Ink simplification kept %d of %d points", int(counts.sum()) // 2, original)
+    
+    flipped, counts = transform_point_lists(coords, counts, ctx.affine, ctx.mirrored)
+    count_coordinates(ctx, flipped.size)
+    
+    # Regroup the flipped strokes by annotation
+    ink_lists = write_coord_arrays(flipped, counts, ctx.options.precision, stroke_counts)
+    if ctx.options.tight_rects:
+        annot_counts = np.bincount(np.repeat(np.arange(len(selected)), stroke_counts), counts, len(selected))
+        fit_rects(*shared_geometry(annots, '/InkList', selected, flipped, annot_counts.astype(np.intp), ctx), ctx)
+    for (annot, value), ink_list in zip(selected, ink_lists):
+        store_value(annot, '/InkList', value, ink_list, ctx)
+
+def flip_text_orientation(annots, ctx):
+    """Adjust /Rotate and /Q text alignment of text, free text and stamp annotations"""
+    for annot in annots:
+        # Handle rotation angle
+        if '/Rotate' in annot:
+            old_rotation = int(annot.Rotate)
+            
+            # Rotations turn the text with the page, mirrors turn it by
+            # 180 degrees plus the mirror axis angle minus its rotation
+            # (360 - r for a horizontal flip, 180 - r for a vertical flip)
+            angle = round(math.degrees(math.atan2(ctx.affine[1, 0], ctx.affine[0, 0])))
+            if ctx.mirrored:
+                new_rotation = (angle + 180 - old_rotation) % 360
+            else:
+                new_rotation = (angle + old_rotation) % 360
+            
+            logger.debug("Rotation angle: %d° -> %d°", old_rotation, new_rotation)
+            annot.Rotate = new_rotation
         
-        # Convert back to array format
-        new_vertices = pikepdf.Array()
-        for x, y in flipped_points:
-            new_vertices.append(Decimal(str(x)))
-            new_vertices.append(Decimal(str(y)))
+        # Handle text alignment
+        if '/Q' in annot:
+            old_align = int(annot.Q)
+            
+            # 0=left, 1=center, 2=right, swapped when the x axis ends up pointing left
+            if ctx.affine[0, 0] < 0 and old_align in [0, 2]:
+                new_align = 2 if old_align == 0 else 0
+                logger.debug("Text alignment: %d -> %d", old_align, new_align)
+                annot.Q = new_align
+
+# Handler registry: annotation subtype -> steps run in order
+COMMON_STEPS = (update_appearance, flip_rects)
+
+ANNOTATION_HANDLERS = {
+    '/Line': COMMON_STEPS + (flip_lines, swap_line_endings),
+    '/Polygon': COMMON_STEPS + (flip_vertices,),
+    '/PolyLine': COMMON_STEPS + (flip_vertices,),
+    '/Highlight': COMMON_STEPS + (flip_quad_points,),
+    '/Underline': COMMON_STEPS + (flip_quad_points,),
+    '/Squiggly': COMMON_STEPS + (flip_quad_points,),
+    '/StrikeOut': COMMON_STEPS + (flip_quad_points,),
+    '/Ink': COMMON_STEPS + (flip_ink_lists,),
+    '/FreeText': COMMON_STEPS + (flip_text_orientation,),
+    '/Text': COMMON_STEPS + (flip_text_orientation,),
+    '/Stamp': COMMON_STEPS + (flip_text_orientation,),
+}
+
+# Other subtypes (e.g. /Link) may still carry QuadPoints
+DEFAULT_HANDLER = COMMON_STEPS + (flip_quad_points,)
+
+# Coordinate entry flipped by each handler step besides /Rect
+GEOMETRY_STEPS = {
+    flip_lines: '/L',
+    flip_vertices: '/Vertices',
+    flip_quad_points: '/QuadPoints',
+    flip_ink_lists: '/InkList',
+}
+
+def geometry_key(subtype):
+    """Return the coordinate entry besides /Rect that the handler of subtype flips, or None"""
+    for step in ANNOTATION_HANDLERS.get(subtype, DEFAULT_HANDLER):
+        if step in GEOMETRY_STEPS:
+            return GEOMETRY_STEPS[step]
+    return None
+
+def run_handler(subtype, annots, ctx, steps=None):
+    """
+    Run the handler registered for subtype over a list of annotations
+    
+    Each step runs once over the whole list. When a bulk call fails the step
+    is retried per annotation, and annotations that still fail are logged
+    and skipped by the remaining steps. steps runs only those steps instead
+    of the registered ones.
+    
+    Returns the number of successfully processed annotations.
+    """
+    failed = set()
+    for step in ANNOTATION_HANDLERS.get(subtype, DEFAULT_HANDLER) if steps is None else steps:
+        remaining = [annot for i, annot in enumerate(annots) if i not in failed]
+        try:
+            step(remaining, ctx)
+        except Exception:
+            # Fall through to the per-annotation retry below
+            pass
+        else:
+            continue
         
-        annot.Vertices = new_vertices
+        for i, annot in enumerate(annots):
+            if i in failed:
+                continue
+            try:
+                step([annot], ctx)
+            except Exception as e:
+                logger.exception("Error processing %s annotation: %s", subtype, e)
+                failed.add(i)
+    return len(annots) - len(failed)
+
+def flip_annotation_list(annots, width, height, horizontal=True, vertical=False, options=None):
+    """
+    Flip (mirror) a list of annotations in place
+    
+    Annotations are grouped by subtype and every group goes through its
+    registered handler in a single bulk call.
     
-    # 4. Highlight/underline/strikethrough annotations
-    if '/QuadPoints' in annot:
-        quad_points = annot.QuadPoints
-        new_quad_points = pikepdf.Array()
+    Parameters:
+        annots: Iterable of annotation dictionaries
+        width: Page width the horizontal flip mirrors across
+        height: Page height the vertical flip mirrors across
+        horizontal: Whether to flip horizontally (default: True)
+        vertical: Whether to flip vertically (default: False)
+        options: FlipOptions of the run, its transform is called with
+            page_num None (default: FlipOptions())
+    
+    Returns the number of processed annotations.
+    """
+    options = options or FlipOptions()
+    box = (0.0, 0.0, width, height)
+    ctx = make_flip_context(box, horizontal, vertical, options, options.page_transform(None, box))
+    return flip_with_context(annots, ctx)
+
+def flip_with_context(annots, ctx, holder=None):
+    """
+    Flip a list of annotations in place with a prepared FlipContext
+    
+    Flipped annotations are recorded in ctx.options.modified_objects,
+    direct ones through holder, the indirect /Annots array or page
+    storing them, when it is given.
+    
+    Returns the number of processed annotations.
+    """
+    # Look up every subtype once and group annotations by handler
+    groups = {}
+    failed = 0
+    select = ctx.options.select
+    # With a region, one mask over the page's rects picks the annotations to
+    # look at, the others are never decoded. An index would only pay off over
+    # several queries, building it costs more than the mask.
+    indexes = range(len(annots))
+    in_region = select is not None and select.region is not None
+    if in_region:
+        indexes = np.flatnonzero(rects_in_region(normalize_rects(read_rects(annots)), select.region)).tolist()
+    for i in indexes:
+        annot = annots[i]
+        try:
+            subtype = str(annot.Subtype) if '/Subtype' in annot else "Unknown"
+        except Exception as e:
+            logger.exception("Error processing annotation #%d: %s", i + 1, e)
+            failed += 1
+            continue
+        logger.debug("Annotation #%d type: %s", i + 1, subtype)
         
-        # Process every 8 values as a quadrilateral
-        for i in range(0, len(quad_points), 8):
-            if i + 7 < len(quad_points):
-                points = []
-                for j in range(0, 8, 2):
-                    x = float(quad_points[i+j])
-                    y = float(quad_points[i+j+1])
-                    points.append((x, y))
-                
-                # Apply flipping transformation
-                flipped_points = []
-                for x, y in points:
-                    new_x, new_y = x, y
-                    if horizontal:
-                        new_x = width - x
-                    if vertical:
-                        new_y = height - y
-                    flipped_points.append((new_x, new_y))
-                
-                # Adjust point order for single-direction flips
-                if (horizontal != vertical):
-                    # Swap points to maintain proper appearance
-                    flipped_points = [flipped_points[1], flipped_points[0], 
-                                      flipped_points[3], flipped_points[2]]
-                
-                # Add to new array
-                for x, y in flipped_points:
-                    new_quad_points.append(Decimal(str(x)))
-                    new_quad_points.append(Decimal(str(y)))
+        # Annotations left out by the filter are never decoded
+        if select is not None and not select.selects(annot, subtype, in_region):
+            logger.debug("Annotation #%d is not selected", i + 1)
+            continue
         
-        annot.QuadPoints = new_quad_points
+        # An annotation listed on several pages (or twice on one) is flipped once
+        if annot.is_indirect:
+            if annot.objgen in ctx.options.flipped_annotations:
+                logger.debug("Annotation #%d was already flipped", i + 1)
+                continue
+            ctx.options.flipped_annotations.add(annot.objgen)
+            ctx.options.modified_objects[annot.objgen] = annot
+        elif holder is not None:
+            ctx.options.modified_objects[holder.objgen] = holder
+        groups.setdefault(subtype, []).append(annot)
     
-    # 5. Ink annotations
-    if '/InkList' in annot:
-        ink_list = annot.InkList
-        new_ink_list = pikepdf.Array()
-        
-        for stroke in ink_list:
-            new_stroke = pikepdf.Array()
-            
-            # Each stroke is a sequence of (x,y) coordinates
-            points = []
-            for i in range(0, len(stroke), 2):
-                if i + 1 < len(stroke):
-                    x = float(stroke[i])
-                    y = float(stroke[i + 1])
-                    points.append((x, y))
-            
-            # If single-direction flip, reverse point order
-            if (horizontal != vertical):
-                points.reverse()
+    stats = ctx.options.stats
+    processed = 0
+    for subtype, group in groups.items():
+        if stats is None:
+            processed += run_handler(subtype, group, ctx)
+            continue
+        start = time.perf_counter_ns()
+        processed += run_handler(subtype, group, ctx)
+        stats.add_handler(subtype, len(group), time.perf_counter_ns() - start)
+    return processed
+
+def flip_annotation(annot, width, height, horizontal, vertical, options=None):
+    """Flip a single annotation in place with the handler registered for its subtype"""
+    return flip_annotation_list([annot], width, height, horizontal, vertical, options) == 1
+
+def flip_page_annotations(page, page_num, horizontal=True, vertical=False, options=None):
+    """
+    Flip (mirror) all annotations of a single page in place
+    
+    The mirror axes run through the centre of the page's crop box, and the
+    directions follow the page as displayed, taking /Rotate into account.
+    
+    Parameters:
+        page: pikepdf page whose annotations are flipped
+        page_num: Zero-based page index, used in log messages
+        horizontal: Whether to flip horizontally (default: True)
+        vertical: Whether to flip vertically (default: False)
+        options: FlipOptions of the run (default: FlipOptions())
+    
+    Returns the number of processed annotations.
+    """
+    # Check if page has annotations
+    if '/Annots' not in page:
+        logger.debug("Page %d has no annotations", page_num + 1)
+        return 0
+    
+    # Get all annotations on the page
+    annots = page.Annots
+    if annots is None:
+        logger.debug("Page %d annotation list is empty", page_num + 1)
+        return 0
+    
+    # The mirror runs about the centre of the visible page area
+    ctx = page_flip_context(page, page_num, horizontal, vertical, options)
+    if ctx.options.stats is not None:
+        ctx.options.stats.pages += 1
+    logger.debug("Page %d box: (%s, %s, %s, %s)", page_num + 1, *ctx.box)
+    return flip_with_context(annots, ctx, annots if annots.is_indirect else page.obj)
+
+def annotated_pages(pdf, start=0, stop=None, select=None):
+    """
+    Return the (page_num, page) pairs of the pages in [start, stop) that have annotations
+    
+    One pass over the page tree only looks for an /Annots key in each page
+    dictionary, page boxes and contents of the other pages are never read.
+    Looking pages up one by one through pdf.pages[page_num] costs time
+    proportional to the page count, use the returned pairs instead. With
+    an AnnotationFilter only its pages are returned, and the pass ends at
+    the last of them.
+    """
+    if select is not None:
+        start, stop = select.page_range(start, stop)
+        if stop is not None and stop <= start:
+            return []
+    pages = []
+    for page_num, page in enumerate(pdf.pages):
+        if page_num >= start and '/Annots' in page.obj and (select is None or select.selects_page(page_num)):
+            pages.append((page_num, page))
+        if stop is not None and page_num + 1 >= stop:
+            break
+    return pages
+
+def unparse_value(value):
+    """Return the PDF syntax of a value read from a pikepdf container"""
+    if isinstance(value, pikepdf.Object):
+        return value.unparse()
+    # pikepdf hands out numbers and booleans as native Python objects
+    return pikepdf.Array([value]).unparse()[2:-2]
+
+def encode_delta_value(value):
+    """Convert a pikepdf value into a picklable form that decode_delta_value can rebuild"""
+    if not isinstance(value, pikepdf.Object):
+        return value
+    if value.is_indirect:
+        return value.objgen
+    raw = value.unparse()
+    if b' R' not in raw:
+        return raw
+    # Direct containers holding indirect references are rebuilt element by element
+    if isinstance(value, pikepdf.Array):
+        return [encode_delta_value(v) for v in value]
+    if isinstance(value, pikepdf.Dictionary):
+        return {key: encode_delta_value(value[key]) for key in value.keys()}
+    return raw
+
+def decode_delta_value(pdf, encoded):
+    """Rebuild a value produced by encode_delta_value inside pdf"""
+    if isinstance(encoded, bytes):
+        return pikepdf.Object.parse(encoded)
+    if isinstance(encoded, tuple):
+        return pdf.get_object(encoded)
+    if isinstance(encoded, list):
+        return pikepdf.Array([decode_delta_value(pdf, v) for v in encoded])
+    if isinstance(encoded, dict):
+        return pikepdf.Dictionary({key: decode_delta_value(pdf, v) for key, v in encoded.items()})
+    return encoded
+
+def snapshot_annotation(annot):
+    """Return the unparsed form of every entry of an annotation dictionary"""
+    return {key: unparse_value(annot[key]) for key in annot.keys()}
+
+def flip_page_range(input_pdf, start, stop, horizontal=True, vertical=False, options=None, flipped=()):
+    """
+    Flip the annotations of pages [start, stop) and return them as deltas
+    
+    Runs in a worker process. The document is opened independently and
+    never saved, only the entries each annotation gained, changed or lost
+    are reported back as (page_num, annot_index, changed, deleted) tuples.
+    Shared objects transformed in place are reported by objgen, with the
+    new contents of arrays and the new /Matrix of appearance streams.
+    flipped holds the objgens of indirect annotations that an earlier
+    slice flips, they are skipped here.
+    
+    Returns a (processed, deltas, object_deltas, cache_hits, points_removed,
+    stats) tuple, stats being the worker's FlipStats or None.
+    """
+    options = options or FlipOptions()
+    options.flipped_annotations.update(flipped)
+    processed = 0
+    deltas = []
+    with pikepdf.open(input_pdf) as pdf:
+        for page_num, page in annotated_pages(pdf, start, stop, options.select):
+            annots = page.get('/Annots')
+            annots = list(annots) if isinstance(annots, pikepdf.Array) else []
+            # Entries that aren't dictionaries (e.g. null) are never modified
+            before = [snapshot_annotation(annot) if isinstance(annot, pikepdf.Dictionary) else None
+                      for annot in annots]
             
-            # Apply coordinate flipping
-            for x, y in points:
-                if horizontal:
-                    x = width - x
-                if vertical:
-                    y = height - y
-                new_stroke.append(Decimal(str(x)))
-                new_stroke.append(Decimal(str(y)))
+            processed += flip_page_annotations(page, page_num, horizontal, vertical, options)
             
-            new_ink_list.append(new_stroke)
+            for i, annot in enumerate(annots):
+                if before[i] is None:
+                    continue
+                changed = {}
+                for key in annot.keys():
+                    value = annot[key]
+                    if before[i].get(key) != unparse_value(value):
+                        changed[key] = encode_delta_value(value)
+                deleted = [key for key in before[i] if key not in annot]
+                if changed or deleted:
+                    deltas.append((page_num, i, changed, deleted))
         
-        annot.InkList = new_ink_list
+        object_deltas = {}
+        for objgen, obj in options.transformed_objects.items():
+            if isinstance(obj, pikepdf.Stream):
+                object_deltas[objgen] = encode_delta_value(obj.Matrix)
+            else:
+                object_deltas[objgen] = [encode_delta_value(v) for v in obj]
+    return processed, deltas, object_deltas, options.cache_hits, options.points_removed, options.stats
+
+def apply_annotation_deltas(pdf, deltas, object_deltas=None, options=None, pages=None):
+    """
+    Apply deltas returned by flip_page_range to the annotations of pdf
     
-    # 6. Text rotation
-    if '/Rotate' in annot:
-        rotation = int(annot.Rotate)
-        
-        if horizontal and not vertical:
-            rotation = (360 - rotation) % 360
-        elif vertical and not horizontal:
-            rotation = (180 - rotation) % 360
-        elif horizontal and vertical:
-            rotation = (180 + rotation) % 360
+    pages maps page numbers to the pages of pdf, by default it is built
+    from annotated_pages.
+    
+    Shared objects are recorded in options.transformed_objects. The serial
+    path transforms an object shared across page slices with the geometry
+    of the first page referencing it, so with options only the first delta
+    of every object is applied, deltas arriving in page order.
+    
+    Modified annotations are recorded in options.modified_objects.
+    
+    Returns the objects whose delta was dropped for an earlier one, by objgen.
+    """
+    if pages is None:
+        pages = dict(annotated_pages(pdf))
+    for page_num, i, changed, deleted in deltas:
+        annots = pages[page_num].Annots
+        annot = annots[i]
+        if options is not None:
+            holder = annot if annot.is_indirect else annots if annots.is_indirect else pages[page_num].obj
+            options.modified_objects[holder.objgen] = holder
+        for key in deleted:
+            del annot[key]
+        for key, encoded in changed.items():
+            annot[key] = decode_delta_value(pdf, encoded)
+    
+    kept = {}
+    for objgen, encoded in (object_deltas or {}).items():
+        obj = pdf.get_object(objgen)
+        if options is not None and objgen in options.transformed_objects:
+            options.cache_hits += 1
+            kept[objgen] = obj
+            continue
+        if isinstance(obj, pikepdf.Stream):
+            obj.Matrix = decode_delta_value(pdf, encoded)
+        else:
+            obj[:] = decode_delta_value(pdf, encoded)
+        if options is not None:
+            options.transformed_objects[objgen] = obj
+            options.cache_misses += 1
+    return kept
+
+def refit_shared_rects(annots, objects, options):
+    """
+    Fit /Rect of annotations to geometry arrays that an earlier page slice transformed
+    
+    Used by flip_pages_parallel with tight_rects. A worker fits the
+    annotations of its slice to its own transform of a shared array, the
+    serial path to the value transformed for the first page referencing
+    it, which is what objects (by objgen) hold once the earlier slice's
+    deltas are applied.
+    """
+    fit_options = FlipOptions(keep_appearance=options.keep_appearance, precision=options.precision)
+    fit_options.transformed_objects = objects
+    ctx = FlipContext(None, None, False, logger.isEnabledFor(logging.DEBUG), fit_options)
+    groups = {}
+    for annot in annots:
+        if not isinstance(annot, pikepdf.Dictionary):
+            continue
+        key = geometry_key(str(annot.Subtype) if '/Subtype' in annot else "Unknown")
+        value = annot.get(key) if key is not None else None
+        if value is not None and value.is_indirect and value.objgen in objects:
+            groups.setdefault(key, []).append(annot)
+    for key, group in groups.items():
+        fit_rects(*shared_geometry(group, key, [], np.empty(0), [], ctx), ctx, padded=key != '/QuadPoints')
+
+def earlier_annotations(pages, firsts):
+    """
+    Find the indirect annotations each page slice must leave to an earlier slice
+    
+    The serial path flips an annotation listed on several pages once, with
+    the geometry of the first page listing it. pages are the (page_num,
+    page) pairs of the run and firsts the first page number of every slice.
+    Returns one set per slice, holding the objgens of annotations on its
+    pages that are first listed on a page of an earlier slice.
+    """
+    first_page = {}
+    earlier = [set() for _ in firsts]
+    slice_index = 0
+    for page_num, page in pages:
+        while slice_index + 1 < len(firsts) and page_num >= firsts[slice_index + 1]:
+            slice_index += 1
+        annots = page.obj.get('/Annots')
+        if not isinstance(annots, pikepdf.Array):
+            continue
+        for annot in annots:
+            if not isinstance(annot, pikepdf.Dictionary) or not annot.is_indirect:
+                continue
+            if first_page.setdefault(annot.objgen, page_num) < firsts[slice_index]:
+                earlier[slice_index].add(annot.objgen)
+    return earlier
+
+def flip_pages_parallel(pdf, input_pdf, horizontal=True, vertical=False, jobs=2, options=None):
+    """
+    Flip all annotations of pdf using a pool of worker processes
+    
+    The annotated pages are split into contiguous slices with about the
+    same number of pages each, so pages without markup don't unbalance the
+    workers. Each worker flips its slice in a private copy of input_pdf and
+    the resulting deltas are applied to pdf in page order, so the result
+    matches the serial path. Annotations listed in several slices are only
+    flipped by the first one, see earlier_annotations.
+    
+    Returns the number of processed annotations.
+    """
+    options = options or FlipOptions()
+    pages = annotated_pages(pdf, select=options.select)
+    if not pages:
+        return 0
+    # A few slices per worker keep the pool busy when markup is unevenly spread
+    slice_count = min(len(pages), jobs * 4)
+    firsts = [pages[len(pages) * k // slice_count][0] for k in range(slice_count)]
+    bounds = zip(firsts, firsts[1:] + [pages[-1][0] + 1])
+    flipped = earlier_annotations(pages, firsts)
+    
+    # Tasks are pickled as workers pick them up, after earlier results were
+    # merged into options, so the workers get a copy holding no run state
+    worker_options = FlipOptions(options.keep_appearance, options.transform,
+                                 None if options.stats is None else FlipStats(), options.precision, options.undo,
+                                 options.select, options.simplify, options.tight_rects)
+    pages = dict(pages)
+    processed = 0
+    with ProcessPoolExecutor(max_workers=jobs, initializer=configure_logging,
+                             initargs=(logger.getEffectiveLevel(),)) as executor:
+        futures = [executor.submit(flip_page_range, input_pdf, start, stop, horizontal, vertical, worker_options,
+                                   skipped)
+                   for (start, stop), skipped in zip(bounds, flipped)]
+        for future in futures:
+            count, deltas, object_deltas, cache_hits, points_removed, stats = future.result()
+            kept = apply_annotation_deltas(pdf, deltas, object_deltas, options, pages)
+            if kept and options.tight_rects:
+                refit_shared_rects([pages[page_num].Annots[i] for page_num, i, _, _ in deltas], kept, options)
+            options.cache_hits += cache_hits
+            options.points_removed += points_removed
+            if stats is not None:
+                # Handler times are summed over workers, so they can exceed the wall time
+                options.stats.merge(stats)
+            processed += count
+    return processed
+
+def is_path(target):
+    """Tell whether an input or output is a file path, as opposed to a buffer or file object"""
+    return isinstance(target, (str, os.PathLike))
+
+def describe(target):
+    """Name an input or output in log messages"""
+    if is_path(target):
+        return os.fspath(target)
+    return getattr(target, 'name', None) or f"<in-memory {type(target).__name__}>"
+
+def as_source(source):
+    """
+    Return an input as a path, a bytes-like object or a seekable binary file object
+    
+    File objects that can't seek, e.g. pipes and sockets, are read into memory.
+    """
+    if is_path(source) or isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    if not source.seekable():
+        return source.read()
+    return source
+
+def open_source(source, access_mode=pikepdf.AccessMode.default):
+    """
+    Open an input returned by as_source as a pikepdf.Pdf
+    
+    bytes are wrapped without copying them, other buffers are copied once,
+    which is much faster than feeding qpdf through a Python reader.
+    """
+    if is_path(source):
+        return pikepdf.open(source, access_mode=access_mode)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        # BytesIO shares the memory of a bytes object until it is written to
+        return pikepdf.open(io.BytesIO(source))
+    return pikepdf.open(source)
+
+@contextmanager
+def source_buffer(source):
+    """
+    Give access to the raw bytes of an input returned by as_source
+    
+    Files are memory-mapped instead of read, buffers are used as they are.
+    """
+    if is_path(source):
+        with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield memoryview(source).cast('B')
+    else:
+        position = source.tell()
+        source.seek(0)
+        data = source.read()
+        source.seek(position)
+        yield data
+
+def write_output(output, chunks):
+    """Write chunks of bytes to an output path or a writable binary file object"""
+    if is_path(output):
+        with open(output, 'wb') as f:
+            f.writelines(chunks)
+    else:
+        for chunk in chunks:
+            output.write(chunk)
+
+def copy_source(source, output):
+    """Copy an input unchanged to an output"""
+    if is_path(source) and is_path(output):
+        # copyfile uses the platform's zero-copy file copy where available
+        if not (os.path.exists(output) and os.path.samefile(source, output)):
+            shutil.copyfile(source, output)
+        return
+    with source_buffer(source) as data:
+        write_output(output, [data])
+
+def annotation_objects(pdf):
+    """
+    Collect the indirect objects holding annotation dictionaries
+    
+    Indirect annotations are returned themselves. Direct annotations are
+    covered by their /Annots array, or by the page when the array is direct
+    as well. Returns a dictionary of objgen -> object.
+    """
+    objects = {}
+    for _, page in annotated_pages(pdf):
+        page_obj = page.obj
+        annots = page_obj.Annots
+        if not isinstance(annots, pikepdf.Array):
+            continue
+        if any(isinstance(annot, pikepdf.Dictionary) and not annot.is_indirect for annot in annots):
+            container = annots if annots.is_indirect else page_obj
+            objects[container.objgen] = container
+        for annot in annots:
+            if isinstance(annot, pikepdf.Dictionary) and annot.is_indirect:
+                objects[annot.objgen] = annot
+    return objects
+
+def find_startxref(data):
+    """Return the offset of the last cross-reference section of a PDF held in a buffer"""
+    tail = bytes(data[max(0, len(data) - 1024):])
+    pos = tail.rfind(b'startxref')
+    if pos < 0:
+        raise ValueError("startxref not found, can't append an incremental update")
+    return int(tail[pos + 9:pos + 40].split()[0])
+
+def xref_subsections(entries):
+    """Group sorted (objnum, offset, gen) entries into runs of consecutive object numbers"""
+    runs = []
+    for entry in entries:
+        if runs and entry[0] == runs[-1][-1][0] + 1:
+            runs[-1].append(entry)
+        else:
+            runs.append([entry])
+    return runs
+
+def serialize_object(obj):
+    """Return the body of an indirect object in PDF syntax, streams with their raw data"""
+    if isinstance(obj, pikepdf.Stream):
+        raw = obj.read_raw_bytes()
+        stream_dict = pikepdf.Dictionary(obj.stream_dict)
+        stream_dict.Length = len(raw)
+        return stream_dict.unparse() + b'\nstream\n' + raw + b'\nendstream'
+    return obj.unparse(resolved=True)
+
+def save_incremental(pdf, input_pdf, output_pdf, objects):
+    """
+    Save pdf as the original bytes of input_pdf plus an incremental update
+    
+    Only objects, the indirect objects that changed (e.g. flipped
+    annotations, their /Annots arrays, shared coordinate arrays and
+    mirrored appearance streams), are appended, followed by a new
+    cross-reference section chained to the original one through /Prev.
+    The original file is copied without being read into memory, so the
+    cost is proportional to the number of changes, not the file size.
+    A cross-reference stream is written when the original uses one.
+    input_pdf and output_pdf may also be in memory, see flip_annotations.
+    """
+    if pdf.is_encrypted:
+        raise ValueError("incremental updates of encrypted PDF files are not supported")
+    
+    objects = {obj.objgen: obj for obj in objects}
+    
+    with source_buffer(input_pdf) as data:
+        prev = find_startxref(data)
+        use_xref_stream = data[prev:prev + 4] != b'xref'
+        offset = len(data)
+        needs_newline = data[-1:] not in (b'\n', b'\r')
+    
+    # Serialize the modified objects, remembering where each one starts
+    chunks = [b'\n'] if needs_newline else []
+    offset += len(chunks[0]) if chunks else 0
+    entries = []
+    for objgen in sorted(objects):
+        chunk = b'%d %d obj\n' % objgen + serialize_object(objects[objgen]) + b'\nendobj\n'
+        entries.append((objgen[0], offset, objgen[1]))
+        chunks.append(chunk)
+        offset += len(chunk)
+    
+    # The second /ID entry changes with every update
+    update_hash = hashlib.md5(b''.join(chunks)).digest()
+    trailer = {
+        # Objects created since opening the file extend the numbering
+        '/Size': max([int(pdf.trailer.Size)] + [objgen[0] + 1 for objgen in objects]),
+        '/Root': b'%d %d R' % pdf.Root.objgen,
+        '/Prev': b'%d' % prev,
+    }
+    if '/Info' in pdf.trailer and pdf.trailer.Info.is_indirect:
+        trailer['/Info'] = b'%d %d R' % pdf.trailer.Info.objgen
+    if '/ID' in pdf.trailer:
+        trailer['/ID'] = pikepdf.Array([pdf.trailer.ID[0], pikepdf.String(update_hash)]).unparse()
+    
+    if use_xref_stream:
+        # The cross-reference stream is a new object and lists itself
+        xref_num = trailer['/Size']
+        entries.append((xref_num, offset, 0))
+        trailer['/Size'] = xref_num + 1
         
-        annot.Rotate = rotation
+        # Object 0 heads the free list, like in every cross-reference section
+        offset_width = max(4, (offset.bit_length() + 7) // 8)
+        rows = b'\x00' + bytes(offset_width) + b'\xff\xff'
+        rows += b''.join(b'\x01' + entry_offset.to_bytes(offset_width, 'big') + gen.to_bytes(2, 'big')
+                         for _, entry_offset, gen in entries)
+        index = b' '.join([b'0 1'] + [b'%d %d' % (run[0][0], len(run)) for run in xref_subsections(entries)])
+        fields = b''.join(b' %s %s' % (key.encode(), value if isinstance(value, bytes) else b'%d' % value)
+                          for key, value in trailer.items())
+        chunks.append(b'%d 0 obj\n<< /Type /XRef%s /Index [ %s ] /W [ 1 %d 2 ] /Length %d >>\nstream\n'
+                      % (xref_num, fields, index, offset_width, len(rows)))
+        chunks.append(rows + b'\nendstream\nendobj\n')
+    else:
+        lines = [b'xref\n0 1\n0000000000 65535 f\r\n']
+        for run in xref_subsections(entries):
+            lines.append(b'%d %d\n' % (run[0][0], len(run)))
+            lines.extend(b'%010d %05d n\r\n' % (entry_offset, gen) for _, entry_offset, gen in run)
+        fields = b''.join(b' %s %s' % (key.encode(), value if isinstance(value, bytes) else b'%d' % value)
+                          for key, value in trailer.items())
+        lines.append(b'trailer\n<<%s >>\n' % fields)
+        chunks.append(b''.join(lines))
+    chunks.append(b'startxref\n%d\n%%%%EOF\n' % offset)
+    
+    if is_path(input_pdf) and is_path(output_pdf):
+        # copyfile uses the platform's zero-copy file copy where available
+        shutil.copyfile(input_pdf, output_pdf)
+        with open(output_pdf, 'ab') as out:
+            out.write(b''.join(chunks))
+    else:
+        with source_buffer(input_pdf) as data:
+            write_output(output_pdf, [data, b''.join(chunks)])
+    return len(objects)
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Flip (mirror) annotations in PDF files")
-    parser.add_argument("input_pdf", help="Path to input PDF file")
-    parser.add_argument("-o", "--output", help="Path to output PDF file (default: 'flipped_<original_name>.pdf')")
-    parser.add_argument("--horizontal", action="store_true", default=True, help="Flip horizontally (default)")
-    parser.add_argument("--vertical", action="store_true", help="Flip vertically")
-    parser.add_argument("--no-horizontal", dest="horizontal", action="store_false", help="Don't flip horizontally")
+# /PieceInfo entry of the document catalog recording the flips applied
+MARKER_KEY = '/PDFlip'
+
+# Annotation entries holding coordinates, covered by the marker's hash
+COORDINATE_KEYS = ('/Rect', '/L', '/Vertices', '/QuadPoints', '/InkList')
+
+def annotation_hash(pdf):
+    """
+    Return a SHA-256 hex digest of every annotation in pdf
+    
+    Annotations are hashed in their text form. Object numbers change when
+    a document is saved, so annotations referring to other objects are
+    hashed through their coordinates only.
+    """
+    digest = hashlib.sha256()
+    for page_num, page in annotated_pages(pdf):
+        if not isinstance(page.Annots, pikepdf.Array):
+            continue
+        digest.update(b'page %d' % page_num)
+        for annot in page.Annots:
+            if not isinstance(annot, pikepdf.Dictionary):
+                continue
+            text = annot.unparse(resolved=True)
+            if b' R' in text:
+                text = coordinate_text(annot)
+            digest.update(b'annot' + text)
+    return digest.hexdigest()
+
+def coordinate_text(annot):
+    """Return the coordinates of an annotation as bytes independent of object numbers"""
+    parts = []
+    for key in COORDINATE_KEYS:
+        value = annot.get(key)
+        if value is None:
+            continue
+        text = value.unparse(resolved=True)
+        if b' R' in text:
+            # Nested references, hash the values instead
+            if key == '/InkList':
+                coords, counts = read_ink_list(value)
+                text = counts.tobytes() + coords.tobytes()
+            else:
+                text = read_coords(value).tobytes()
+        parts.append(key.encode() + text)
+    return b''.join(parts)
+
+def flip_step(horizontal, vertical, transform):
+    """Return the (horizontal, vertical, matrix) step recorded for a flip, or None for per-page callables"""
+    if callable(transform):
+        return None
+    return (bool(horizontal), bool(vertical), None if transform is None else compose_affine(transform))
+
+def same_steps(steps, other):
+    """Tell whether two lists of recorded flip steps describe the same flips"""
+    if len(steps) != len(other):
+        return False
+    identity = np.eye(3)[:2]
+    for (h1, v1, m1), (h2, v2, m2) in zip(steps, other):
+        if h1 != h2 or v1 != v2:
+            return False
+        if not np.allclose(identity if m1 is None else m1, identity if m2 is None else m2):
+            return False
+    return True
+
+def read_marker(pdf):
+    """
+    Read the flip marker of a document
+    
+    Returns (steps, hash): the (horizontal, vertical, matrix) flips applied
+    so far, in order, and the annotation_hash recorded after the last one,
+    or None when the document carries no readable marker.
+    """
+    try:
+        data = pdf.Root.PieceInfo[MARKER_KEY].Private
+        steps = [(bool(step.Horizontal), bool(step.Vertical),
+                  as_affine(read_coords(step.Matrix)) if '/Matrix' in step else None)
+                 for step in data.Applied]
+        return steps, str(data.Hash)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+def write_marker(pdf, steps):
+    """
+    Record the flips applied to a document in its catalog's /PieceInfo
     
-    args = parser.parse_args()
+    The marker holds every (horizontal, vertical, matrix) step and the
+    annotation_hash of the result. With steps None an existing marker is
+    removed, the document's state can't be described.
     
-    if not args.output:
-        base_name = os.path.basename(args.input_pdf)
-        name, ext = os.path.splitext(base_name)
-        args.output = f"flipped_{name}{ext}"
+    Returns the indirect objects that were modified, for incremental saves.
+    """
+    root = pdf.Root
+    piece_info = root.get('/PieceInfo')
+    if steps is None:
+        if piece_info is not None and MARKER_KEY in piece_info:
+            del piece_info[MARKER_KEY]
+            return [piece_info if piece_info.is_indirect else root]
+        return []
     
+    applied = pikepdf.Array()
+    for horizontal, vertical, matrix in steps:
+        step = pikepdf.Dictionary(Horizontal=horizontal, Vertical=vertical)
+        if matrix is not None:
+            # Stored in PDF order a b c d e f
+            step.Matrix = write_coords(matrix.T.ravel(), None)
+        applied.append(step)
+    marker = pikepdf.Dictionary(
+        LastModified=pikepdf.String(time.strftime('D:%Y%m%d%H%M%SZ', time.gmtime())),
+        Private=pikepdf.Dictionary(Applied=applied, Hash=pikepdf.String(annotation_hash(pdf))),
+    )
+    if piece_info is None:
+        root.PieceInfo = piece_info = pikepdf.Dictionary()
+    piece_info[MARKER_KEY] = marker
+    return [piece_info if piece_info.is_indirect else root]
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_key(input_pdf, settings):
+    """Return the result cache key of an input flipped with the given settings"""
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    if is_path(input_pdf):
+        digest.update(file_digest(input_pdf).encode())
+    else:
+        with source_buffer(input_pdf) as data:
+            digest.update(hashlib.sha256(data).hexdigest().encode())
+    return digest.hexdigest()
+
+def lookup_cache(cache_dir, key, output_pdf):
+    """
+    Reuse a cached result for key by copying it to output_pdf
+    
+    A result is only reused while its file is unchanged since it was cached.
+    
+    Returns True on a cache hit.
+    """
     try:
-        success = flip_annotations(args.input_pdf, args.output, args.horizontal, args.vertical)
+        with open(os.path.join(cache_dir, key + '.json'), encoding='utf-8') as f:
+            entry = json.load(f)
+        if file_digest(entry['output']) != entry['sha256']:
+            logger.debug("Cached result %s has changed since it was written", entry['output'])
+            return False
+    except (OSError, ValueError, KeyError):
+        return False
+    
+    copy_source(entry['output'], output_pdf)
+    logger.info("Reused cached result %s", entry['output'])
+    return True
+
+def store_cache(cache_dir, key, input_pdf, output_pdf):
+    """Record output_pdf as the cached result for key, one small JSON file per entry"""
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = {'input': os.path.abspath(input_pdf) if is_path(input_pdf) else describe(input_pdf),
+             'output': os.path.abspath(output_pdf),
+             'sha256': file_digest(output_pdf)}
+    path = os.path.join(cache_dir, key + '.json')
+    # Written under a temporary name and renamed, so parallel runs never see half an entry
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(entry, f)
+    os.replace(temp_path, path)
+
+def flip_document(pdf, horizontal=True, vertical=False, keep_appearance=False, transform=None, stats=None,
+                  precision=DEFAULT_PRECISION, if_mirrored='apply', mark=True, jobs=1, input_pdf=None, select=None,
+                  simplify=None, tight_rects=False):
+    """
+    Flip (mirror) the annotations of an open document in place
+    
+    Takes the same flip parameters as flip_annotations, and handles and
+    updates the document's flip marker the same way. jobs > 1 needs
+    input_pdf, the path pdf was opened from, as every worker opens its
+    own copy of the file.
+    
+    Returns (processed, options, marked_objects): the number of processed
+    annotations, the FlipOptions of the run and the indirect objects the
+    marker modified. Returns None when the marker shows the document is
+    already flipped as requested and it was left unchanged.
+    """
+    if if_mirrored not in IF_MIRRORED_MODES:
+        raise ValueError(f"if_mirrored must be one of {', '.join(IF_MIRRORED_MODES)}, got {if_mirrored!r}")
+    start = time.perf_counter_ns()
+    step = flip_step(horizontal, vertical, transform)
+    name = input_pdf or "Document"
+    
+    # A marker whose hash no longer matches was left by an earlier flip
+    # of annotations that have been edited since, it can't be trusted
+    marker = read_marker(pdf)
+    stale = marker is not None and marker[1] != annotation_hash(pdf)
+    if stale:
+        logger.warning("%s has been edited since it was flipped, ignoring its flip marker", name)
+        marker = None
+    applied, undo = [] if marker is None else marker[0], None
+    if marker is not None and if_mirrored == 'apply':
+        logger.warning("%s was already flipped, flipping it again", name)
+    elif marker is not None:
+        if if_mirrored == 'skip' or (step is not None and same_steps(applied, [step])):
+            if stats is not None:
+                stats.add_phase('check', time.perf_counter_ns() - start)
+            return None
+        # Only the difference to the requested flip is applied
+        undo, applied = applied, []
+    checked = time.perf_counter_ns()
+    
+    options = FlipOptions(keep_appearance=keep_appearance, transform=transform, stats=stats,
+                          precision=precision, undo=undo, select=select, simplify=simplify,
+                          tight_rects=tight_rects)
+    processed = 0
+    if jobs > 1 and len(pdf.pages) > 1:
+        if input_pdf is None:
+            raise ValueError("parallel flips need the path of the input file")
+        processed = flip_pages_parallel(pdf, input_pdf, horizontal, vertical, jobs, options)
+    else:
+        # Only pages with annotations are visited, their geometry is read on the way
+        for page_num, page in annotated_pages(pdf, select=select):
+            processed += flip_page_annotations(page, page_num, horizontal, vertical, options)
+    
+    # Callable transforms, partial flips and stale markers leave the
+    # document's state unknown
+    marked_objects = []
+    if mark:
+        unknown = step is None or select is not None or stale
+        marked_objects = write_marker(pdf, None if unknown else applied + [step])
+    
+    if stats is not None:
+        stats.add_phase('check', checked - start)
+        stats.add_phase('flip', time.perf_counter_ns() - checked)
+        stats.cache_hits += options.cache_hits
+        stats.cache_misses += options.cache_misses
+        stats.points_removed += options.points_removed
+    if options.cache_misses or options.cache_hits:
+        logger.info("Shared objects: %d transformed, %d references reused (cache misses/hits)",
+                    options.cache_misses, options.cache_hits)
+    if simplify is not None:
+        logger.info("Ink simplification removed %d points", options.points_removed)
+    return processed, options, marked_objects
+
+def flip_annotations(input_pdf, output_pdf, horizontal=True, vertical=False, jobs=1, incremental=False,
+                     keep_appearance=False, transform=None, stats=None, precision=DEFAULT_PRECISION,
+                     if_mirrored='apply', mark=True, cache_dir=None, select=None, simplify=None, tight_rects=False):
+    """
+    Flip (mirror) annotations in a PDF file
+    
+    Parameters:
+        input_pdf: Path of the input PDF file, or the PDF as bytes, any
+            other bytes-like object or a binary file object
+        output_pdf: Path of the output PDF file, or a writable binary file object
+        horizontal: Whether to flip horizontally (default: True)
+        vertical: Whether to flip vertically (default: False)
+        jobs: Number of worker processes to split the pages across, needs
+            an input path (default: 1)
+        incremental: Append only the annotation objects to a copy of the
+            original file instead of rewriting it (default: False)
+        keep_appearance: Mirror appearance streams instead of deleting /AP (default: False)
+        transform: Affine matrix, sequence of matrices or per-page callable
+            applied after the flip, see FlipOptions (default: None)
+        stats: FlipStats receiving counters and phase timings (default: None)
+        precision: Decimals written for coordinates, None for full precision (default: 4)
+        if_mirrored: What to do with a document whose marker shows it was
+            flipped before: 'apply' flips it again, 'skip' copies it
+            unchanged and 'delta' applies only the difference to the
+            requested flip, or copies it if there is none (default: 'apply')
+        mark: Record the flips applied in the document's marker (default: True)
+        cache_dir: Directory of a result cache keyed by the input's content
+            and the settings, unchanged inputs reuse their earlier output.
+            Only used with an output path (default: None, no cache)
+        select: AnnotationFilter limiting the flip to some pages, subtypes
+            or authors. Partly flipped documents get no marker (default: None)
+        simplify: Tolerance in PDF units for Ramer-Douglas-Peucker
+            simplification of ink strokes (default: None, no simplification)
+        tight_rects: Recompute /Rect from the flipped /L, /Vertices,
+            /QuadPoints and /InkList, padded by border width and line
+            endings, instead of mirroring it (default: False)
+    
+    Returns True on success. The metrics of the run are left in stats.
+    """
+    try:
+        start = time.perf_counter_ns()
+        step = flip_step(horizontal, vertical, transform)
+        input_pdf = as_source(input_pdf)
+        if jobs > 1 and not is_path(input_pdf):
+            logger.warning("Parallel flipping needs an input path, flipping in one process")
+            jobs = 1
+        
+        key = None
+        if cache_dir is not None and step is not None and is_path(output_pdf):
+            settings = {
+                'horizontal': step[0], 'vertical': step[1],
+                'matrix': None if step[2] is None else step[2].tolist(),
+                'incremental': incremental, 'keep_appearance': keep_appearance, 'precision': precision,
+                'if_mirrored': if_mirrored, 'mark': mark,
+                'select': None if select is None else select.as_dict(), 'simplify': simplify,
+                'tight_rects': tight_rects,
+            }
+            key = cache_key(input_pdf, settings)
+            if lookup_cache(cache_dir, key, output_pdf):
+                return True
+        
+        # Open PDF file, memory-mapped so large sources aren't read into memory up front
+        pdf = open_source(input_pdf, pikepdf.AccessMode.mmap if incremental else pikepdf.AccessMode.default)
+        if stats is not None:
+            stats.add_phase('open', time.perf_counter_ns() - start)
         
-        if success:
-            print(f"PDF annotation flipping successful, results saved to {args.output}")
+        result = flip_document(pdf, horizontal, vertical, keep_appearance, transform, stats, precision,
+                               if_mirrored, mark, jobs, input_pdf if is_path(input_pdf) else None, select, simplify,
+                               tight_rects)
+        if result is None:
+            pdf.close()
+            copy_source(input_pdf, output_pdf)
+            logger.info("%s is already flipped, copied unchanged to %s", describe(input_pdf), describe(output_pdf))
+            return True
+        processed, options, marked_objects = result
+        flipped = time.perf_counter_ns()
+        
+        # Save the modified PDF
+        if incremental:
+            written = save_incremental(pdf, input_pdf, output_pdf,
+                                       list(options.modified_objects.values()) + list(options.transformed_objects.values())
+                                       + marked_objects)
+            logger.debug("Appended %d objects as an incremental update", written)
         else:
-            print("PDF annotation flipping failed, please check error messages.")
+            pdf.save(output_pdf)
+        pdf.close()
+        
+        if stats is not None:
+            stats.add_phase('save', time.perf_counter_ns() - flipped)
+        if key is not None:
+            store_cache(cache_dir, key, input_pdf, output_pdf)
+        
+        logger.info("Processed %d annotations, saved to %s", processed, describe(output_pdf))
+        return True
+    
     except Exception as e:
-        import traceback
-        print(f"Program execution error: {e}")
-        traceback.print_exc()
-        sys.exit(1) 
\ No newline at end of file
+        logger.exception("Error: %s", e)
+        return False
+
+def flip_bytes(data, horizontal=True, vertical=False, keep_appearance=False, transform=None, stats=None,
+               precision=DEFAULT_PRECISION, if_mirrored='apply', mark=True, select=None, simplify=None,
+               tight_rects=False):
+    """
+    Flip (mirror) the annotations of a PDF held in memory
+    
+    data is the PDF as bytes, any other bytes-like object or a binary file
+    object, the other parameters are those of flip_annotations. Nothing is
+    written to disk, errors are raised instead of logged.
+    
+    Returns the bytes of the flipped PDF, the input's own bytes when it is
+    already flipped as requested.
+    """
+    data = as_source(data)
+    with open_source(data) as pdf:
+        result = flip_document(pdf, horizontal, vertical, keep_appearance, transform, stats, precision,
+                               if_mirrored, mark, select=select, simplify=simplify, tight_rects=tight_rects)
+        if result is None:
+            if isinstance(data, bytes):
+                return data
+            with source_buffer(data) as buffer:
+                return bytes(buffer)
+        start = time.perf_counter_ns()
+        output = io.BytesIO()
+        pdf.save(output)
+        if stats is not None:
+            stats.add_phase('save', time.perf_counter_ns() - start)
+    logger.info("Processed %d annotations", result[0])
+    return output.getvalue()
+
+if __name__ == "__main__":
+    from pdf_annotation_cli import main
+    main()
@@ -0,0 +1,511 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+
+from pdf_annotation_batch import FileTimeout, init_worker
+from pdf_annotation_client import DEFAULT_SOCKET, DaemonUnavailable, replaceable_by_others, request
+from pdf_annotation_flip import (IF_MIRRORED_MODES, configure_logging, flip_annotations, flip_bytes, logger,
+                                 parse_matrix, parse_precision, parse_tolerance)
+
+# Responses are written in chunks of this size, waiting for the client in between
+CHUNK_SIZE = 64 * 1024
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+    413: 'Content Too Large', 422: 'Unprocessable Content', 503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+class ServiceBusy(Exception):
+    """Raised when a FlipService already has as many flips waiting as it accepts"""
+
+def run_job(func, args, kwargs, timeout=None):
+    """
+    Run a flip inside a pool worker
+    
+    With a timeout the worker raises FileTimeout once it is exceeded, so a
+    stuck document frees its worker. Timeouts rely on SIGALRM, which is not
+    available on Windows and can't interrupt a native qpdf call.
+    """
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+def worker_context():
+    """
+    Return the multiprocessing context pool workers are started with
+    
+    Workers started while connections are open, e.g. to replace a pool
+    whose worker died, must not inherit them: a forked copy of a client's
+    socket stays open after the service closed it, and the client waits
+    for the end of its answer forever. The fork server starts workers from
+    a process that never held a connection, with the flip module preloaded
+    so they still start warm. None, the default method, where there is no
+    fork server.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['pdf_annotation_flip'])
+    return context
+
+class FlipService:
+    """
+    Bounded process pool running flips for asyncio code
+    
+    At most workers flips run at once, each in a pool process, and at most
+    max_waiting more wait for a free worker. Further calls fail at once
+    with ServiceBusy instead of queueing without bound. Flips are only
+    handed to the pool when a worker is free, so cancelling a waiting call
+    drops it completely. A flip that already started keeps its worker
+    until it finishes or hits its timeout, its result is discarded. When a
+    worker dies, e.g. killed for its memory use or crashed in qpdf, the
+    flips it broke fail and the next one starts a new pool.
+    
+    Parameters:
+        workers: Number of worker processes (default: CPU count)
+        max_waiting: Calls allowed to wait for a worker (default: 4 per worker)
+        timeout: Per-flip time limit in seconds (default: no limit)
+        log_level: Logging level of the pool workers (default: WARNING)
+    """
+    
+    def __init__(self, workers=None, max_waiting=None, timeout=None, log_level=logging.WARNING):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_waiting = self.workers * 4 if max_waiting is None else max_waiting
+        self.timeout = timeout
+        self.log_level = log_level
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self._slots = asyncio.Semaphore(self.workers)
+        self._executor = None
+    
+    async def __aenter__(self):
+        return self
+    
+    def _pool(self):
+        """Return the worker pool, creating it if there is none"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_context(),
+                                                 initializer=init_worker, initargs=(self.log_level,))
+        return self._executor
+    
+    async def start(self):
+        """Start every worker process now, rather than on the first flips"""
+        self._pool()
+        await asyncio.gather(*(asyncio.wrap_future(self._executor.submit(os.getpid)) for _ in range(self.workers)))
+    
+    async def __aexit__(self, *exc_info):
+        self.close()
+    
+    def close(self):
+        """Stop the worker processes, flips still waiting are cancelled"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+    
+    def status(self):
+        """Return the service's load and counters as a dictionary"""
+        return {
+            'workers': self.workers,
+            'running': self.running,
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'cancelled': self.cancelled,
+        }
+    
+    async def run(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in a worker process once one is free
+        
+        Returns the result of func. Raises ServiceBusy when max_waiting
+        calls are already waiting, FileTimeout when the flip exceeds the
+        service's timeout and BrokenProcessPool when a worker died. Results
+        of False, flip_annotations' failures, count as failed.
+        """
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise ServiceBusy(f"{self.waiting} flips are already waiting for a worker")
+        
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.waiting -= 1
+        
+        self.running += 1
+        try:
+            executor = self._pool()
+            try:
+                result = await asyncio.wrap_future(executor.submit(run_job, func, args, kwargs, self.timeout))
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+            except BrokenProcessPool:
+                # A broken pool fails every flip handed to it, the calls that
+                # shared it only drop it once
+                self.failed += 1
+                if self._executor is executor:
+                    self._executor = None
+                    executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            except BaseException:
+                self.failed += 1
+                raise
+            if result is False:
+                self.failed += 1
+            else:
+                self.completed += 1
+            return result
+        finally:
+            self.running -= 1
+            self._slots.release()
+    
+    async def flip_file(self, input_pdf, output_pdf, horizontal=True, vertical=False, **options):
+        """Run flip_annotations on a pool worker, options are passed on. Returns True on success."""
+        return await self.run(flip_annotations, input_pdf, output_pdf, horizontal, vertical, **options)
+    
+    async def flip_bytes(self, data, horizontal=True, vertical=False, **options):
+        """Run flip_bytes on a pool worker, options are passed on. Returns the flipped PDF."""
+        return await self.run(flip_bytes, data, horizontal, vertical, **options)
+
+_default_service = None
+
+def default_service():
+    """Return the FlipService shared by the module-level functions, created on first use"""
+    global _default_service
+    if _default_service is None:
+        _default_service = FlipService()
+    return _default_service
+
+async def flip_annotations_async(input_pdf, output_pdf, horizontal=True, vertical=False, service=None, **options):
+    """
+    Flip (mirror) annotations in a PDF file without blocking the event loop
+    
+    Takes the parameters of flip_annotations. The flip runs in a worker
+    process of service (default: default_service()), stats passed in
+    options are filled in the worker and not seen by the caller.
+    
+    Returns True on success.
+    """
+    return await (service or default_service()).flip_file(input_pdf, output_pdf, horizontal, vertical, **options)
+
+async def flip_bytes_async(data, horizontal=True, vertical=False, service=None, **options):
+    """
+    Flip (mirror) the annotations of a PDF held in memory without blocking the event loop
+    
+    Takes the parameters of flip_bytes and runs like flip_annotations_async.
+    
+    Returns the bytes of the flipped PDF.
+    """
+    return await (service or default_service()).flip_bytes(data, horizontal, vertical, **options)
+
+class RequestError(Exception):
+    """An HTTP request that is answered with an error status"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def parse_flag(value):
+    """Parse a boolean query parameter"""
+    value = value.lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f"expected a boolean, got {value!r}")
+
+def flip_parameters(query, paths=False):
+    """
+    Turn the query string of a /flip request into flip_bytes keyword arguments
+    
+    Accepts horizontal, vertical, keep_appearance, mark and tight_rects
+    flags, precision (decimals or 'full'), if_mirrored, simplify (a
+    tolerance) and any number of matrix=a,b,c,d,e,f. With paths, for
+    /flip-file, the absolute paths input and output are required and
+    returned as input_pdf and output_pdf, and an incremental flag is
+    accepted as well.
+    """
+    params = parse_qs(query, keep_blank_values=True)
+    known = {'horizontal', 'vertical', 'keep_appearance', 'mark', 'precision', 'if_mirrored', 'matrix', 'simplify',
+             'tight_rects'}
+    if paths:
+        known |= {'input', 'output', 'incremental'}
+    unknown = set(params) - known
+    if unknown:
+        raise RequestError(400, f"unknown parameters: {', '.join(sorted(unknown))}")
+    
+    kwargs = {}
+    if paths:
+        for name, key in (('input', 'input_pdf'), ('output', 'output_pdf')):
+            if name not in params or not os.path.isabs(params[name][-1]):
+                raise RequestError(400, f"an absolute {name} path is required")
+            kwargs[key] = params[name][-1]
+    try:
+        for name in ('horizontal', 'vertical', 'keep_appearance', 'mark', 'tight_rects', 'incremental'):
+            if name in params:
+                kwargs[name] = parse_flag(params[name][-1])
+        if 'precision' in params:
+            kwargs['precision'] = parse_precision(params['precision'][-1])
+        if 'if_mirrored' in params:
+            if params['if_mirrored'][-1] not in IF_MIRRORED_MODES:
+                raise ValueError(f"if_mirrored must be one of {', '.join(IF_MIRRORED_MODES)}")
+            kwargs['if_mirrored'] = params['if_mirrored'][-1]
+        if 'matrix' in params:
+            kwargs['transform'] = [parse_matrix(value) for value in params['matrix']]
+        if 'simplify' in params:
+            kwargs['simplify'] = parse_tolerance(params['simplify'][-1])
+    except (ValueError, argparse.ArgumentTypeError) as e:
+        raise RequestError(400, str(e))
+    return kwargs
+
+async def read_request(reader, max_body):
+    """
+    Read one HTTP/1.1 request
+    
+    Returns (method, path, query, body). The body is read into memory,
+    never to disk, and only with a Content-Length of at most max_body bytes.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        raise ConnectionResetError("connection closed before a request was sent")
+    try:
+        method, target, _ = request_line.decode('latin-1').split()
+    except ValueError:
+        raise RequestError(400, "malformed request line")
+    
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    
+    body = b''
+    if method == 'POST':
+        if 'content-length' not in headers:
+            raise RequestError(411, "a Content-Length header is required")
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            raise RequestError(400, "invalid Content-Length")
+        if length > max_body:
+            raise RequestError(413, f"request body exceeds {max_body} bytes")
+        body = await reader.readexactly(length)
+    
+    parts = urlsplit(target)
+    return method, parts.path, parts.query, body
+
+async def write_response(writer, status, body, content_type='application/json', headers=None):
+    """Write an HTTP response, sending the body in chunks as fast as the client reads it"""
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}",
+             f"Content-Length: {len(body)}", "Connection: close"]
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    view = memoryview(body)
+    for offset in range(0, len(view), CHUNK_SIZE):
+        writer.write(view[offset:offset + CHUNK_SIZE])
+        # Backpressure: don't buffer more than the transport's limit for slow clients
+        await writer.drain()
+    await writer.drain()
+
+def json_body(data):
+    """Encode a JSON response body"""
+    return (json.dumps(data) + '\n').encode()
+
+async def flip_unless_disconnected(reader, service, body, kwargs):
+    """
+    Flip body on the service, cancelling the flip if the client disconnects first
+    
+    Returns the flipped PDF, or None when the client went away.
+    """
+    job = asyncio.ensure_future(service.flip_bytes(body, **kwargs))
+    # The client sends nothing more after its request, EOF means it hung up
+    hangup = asyncio.ensure_future(reader.read(1))
+    try:
+        await asyncio.wait({job, hangup}, return_when=asyncio.FIRST_COMPLETED)
+        if not job.done() and hangup.done() and hangup.result() == b'':
+            job.cancel()
+            return None
+        return await job
+    finally:
+        hangup.cancel()
+        if not job.done():
+            job.cancel()
+
+async def handle_connection(reader, writer, service, max_body, paths=False):
+    """
+    Serve one request of the flip service
+    
+    POST /flip with a PDF as the body answers with the flipped PDF, the
+    flip parameters are given in the query string. GET /health answers
+    with the service's load and counters. With paths, POST /flip-file
+    flips the file at the query's input path into its output path and
+    answers with both, so no PDF data crosses the connection. It is only
+    offered on the Unix socket, whose permissions limit it to the user
+    running the service.
+    """
+    start = time.perf_counter()
+    method, path, status = '-', '-', 500
+    try:
+        try:
+            method, path, query, body = await read_request(reader, max_body)
+            if path == '/health':
+                if method != 'GET':
+                    raise RequestError(405, "use GET")
+                status = 200
+                await write_response(writer, status, json_body(service.status()))
+            elif path == '/flip':
+                if method != 'POST':
+                    raise RequestError(405, "use POST with the PDF as the body")
+                kwargs = flip_parameters(query)
+                result = await flip_unless_disconnected(reader, service, body, kwargs)
+                if result is None:
+                    logger.info("Client disconnected, flip cancelled")
+                    return
+                status = 200
+                await write_response(writer, status, result, 'application/pdf')
+            elif path == '/flip-file' and paths:
+                if method != 'POST':
+                    raise RequestError(405, "use POST")
+                kwargs = flip_parameters(query, paths=True)
+                input_pdf, output_pdf = kwargs.pop('input_pdf'), kwargs.pop('output_pdf')
+                if not os.path.isfile(input_pdf):
+                    raise RequestError(404, f"no such file {input_pdf}")
+                # flip_annotations logs its errors in the worker and returns False
+                if not await service.flip_file(input_pdf, output_pdf, **kwargs):
+                    raise RequestError(422, f"flipping {input_pdf} failed, see the service log")
+                status = 200
+                await write_response(writer, status, json_body({'input': input_pdf, 'output': output_pdf}))
+            else:
+                raise RequestError(404, f"no such endpoint {path}")
+        except RequestError as e:
+            status = e.status
+            await write_response(writer, status, json_body({'error': str(e)}))
+        except ServiceBusy as e:
+            status = 503
+            await write_response(writer, status, json_body({'error': str(e)}), headers={'Retry-After': '1'})
+        except FileTimeout:
+            status = 504
+            await write_response(writer, status, json_body({'error': f"flip exceeded {service.timeout} seconds"}))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        except Exception as e:
+            # Errors raised by the flip itself, mostly unreadable PDF files
+            status = 422
+            await write_response(writer, status, json_body({'error': f"{type(e).__name__}: {e}"}))
+        logger.info("%s %s %d in %.3f s", method, path, status, time.perf_counter() - start)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def serve(host='127.0.0.1', port=8765, unix_socket=None, workers=None, max_waiting=None,
+                max_body=256 * 1024 * 1024, timeout=None, log_level=logging.WARNING):
+    """
+    Run the flip service over HTTP until cancelled
+    
+    On a Unix socket the service runs as a local daemon: the socket is
+    only accessible to the current user, /flip-file flips files by path
+    (see handle_connection), and the socket is removed on exit. A missing
+    directory of the socket is created accessible to the current user only,
+    and directories other users can write to are refused. The worker
+    processes are started up front, so the first request finds them warm.
+    
+    Parameters:
+        host, port: TCP address to listen on (default: 127.0.0.1:8765)
+        unix_socket: Path of a Unix socket to listen on instead of TCP
+        workers, max_waiting, timeout: Limits of the FlipService
+        max_body: Largest accepted upload in bytes (default: 256 MB)
+        log_level: Logging level of the pool workers (default: WARNING)
+    """
+    if unix_socket:
+        directory = os.path.dirname(os.path.abspath(unix_socket))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o700)
+        if replaceable_by_others(unix_socket):
+            raise RuntimeError(f"other users can write to {directory}, refusing to listen on {unix_socket}")
+        
+        # Starting the server would replace the socket of a daemon already running
+        try:
+            request(unix_socket, 'GET', '/health', timeout=5)
+        except (DaemonUnavailable, OSError):
+            pass
+        else:
+            raise RuntimeError(f"a flip daemon is already listening on {unix_socket}")
+    
+    async with FlipService(workers, max_waiting, timeout, log_level) as service:
+        def handler(reader, writer):
+            return handle_connection(reader, writer, service, max_body, paths=bool(unix_socket))
+        
+        await service.start()
+        # Daemons are stopped with SIGTERM, which shuts down like Ctrl+C. The
+        # handler is set after the workers were forked, they keep the default.
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        if unix_socket:
+            server = await asyncio.start_unix_server(handler, path=unix_socket)
+            os.chmod(unix_socket, 0o600)
+            logger.info("Serving on %s with %d workers", unix_socket, service.workers)
+        else:
+            server = await asyncio.start_server(handler, host, port)
+            logger.info("Serving on http://%s:%d with %d workers", host, port, service.workers)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if unix_socket and os.path.exists(unix_socket):
+                os.unlink(unix_socket)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve PDF annotation flipping over local HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: %(default)s)")
+    parser.add_argument("--unix", nargs='?', const=DEFAULT_SOCKET, metavar="PATH",
+                        help="Run as a local daemon on a Unix socket instead of TCP, for pdf_annotation_client.py "
+                             f"(default path: {DEFAULT_SOCKET})")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--max-waiting", type=int, help="Requests allowed to wait for a worker (default: 4 per worker)")
+    parser.add_argument("--max-body", type=int, default=256, metavar="MB", help="Largest upload in megabytes (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, help="Per-flip time limit in seconds")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument("-q", "--quiet", action="store_true", help="Only report errors")
+    verbosity.add_argument("-v", "--verbose", action="store_true", help="Also report every request")
+    
+    args = parser.parse_args()
+    
+    log_level = logging.ERROR if args.quiet else logging.INFO if args.verbose else logging.WARNING
+    configure_logging(log_level)
+    if not args.quiet:
+        logger.warning("Listening on %s", args.unix or f"http://{args.host}:{args.port}")
+    
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.workers, args.max_waiting,
+                          args.max_body * 1024 * 1024, args.timeout, log_level))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    except RuntimeError as e:
+        logger.error("%s", e)
+        raise SystemExit(1)
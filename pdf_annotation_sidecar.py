@@ -0,0 +1,374 @@
+import argparse
+import json
+import logging
+import sys
+
+import pikepdf
+
+from pdf_annotation_flip import (DEFAULT_PRECISION, FlipOptions, annotated_pages, annotation_objects, as_affine,
+                                 as_source, configure_logging, describe, flip_page_annotations, flip_step, logger,
+                                 open_source, page_geometry, parse_matrix, parse_precision, parse_tolerance,
+                                 read_marker, save_incremental, unparse_value, write_marker)
+
+SIDECAR_FORMAT = 'pdflip-annotations'
+SIDECAR_VERSION = 1
+
+# Stands in for entries kept as references while a sidecar is flipped
+REF_PLACEHOLDER = pikepdf.Name('/PDFlipRef')
+
+def encode_value(value, locations, seen=()):
+    """
+    Encode a value of an annotation for the sidecar
+    
+    Values without indirect references become their PDF syntax. Indirect
+    objects are inlined, except streams and objects met before on the same
+    path, which become {"object": [num, gen]} references to the source
+    document, and annotations, which become {"annot": [page, index]}.
+    Containers holding such references become {"array": [...]} or
+    {"dict": {...}}.
+    """
+    if not isinstance(value, pikepdf.Object):
+        return unparse_value(value).decode('latin-1')
+    if value.is_indirect:
+        if value.objgen in locations:
+            return {'annot': list(locations[value.objgen])}
+        if isinstance(value, pikepdf.Stream) or value.objgen in seen:
+            return {'object': list(value.objgen)}
+        seen = seen + (value.objgen,)
+    raw = value.unparse(resolved=True)
+    if b' R' not in raw:
+        return raw.decode('latin-1')
+    if isinstance(value, pikepdf.Array):
+        return {'array': [encode_value(v, locations, seen) for v in value]}
+    if isinstance(value, pikepdf.Dictionary):
+        return {'dict': {key: encode_value(value[key], locations, seen) for key in value.keys()}}
+    return raw.decode('latin-1')
+
+def decode_value(pdf, encoded, annots):
+    """
+    Rebuild a value produced by encode_value inside pdf
+    
+    annots maps (page, index) to the annotations created from the sidecar.
+    Raises KeyError for references to annotations or objects pdf doesn't have.
+    """
+    if isinstance(encoded, str):
+        return pikepdf.Object.parse(encoded.encode('latin-1'))
+    if 'annot' in encoded:
+        return annots[tuple(encoded['annot'])]
+    if 'object' in encoded:
+        obj = pdf.get_object(tuple(encoded['object']))
+        if obj is None:
+            raise KeyError(f"object {encoded['object'][0]} {encoded['object'][1]} R")
+        return obj
+    if 'array' in encoded:
+        return pikepdf.Array([decode_value(pdf, v, annots) for v in encoded['array']])
+    return pikepdf.Dictionary({key: decode_value(pdf, v, annots) for key, v in encoded['dict'].items()})
+
+def encode_steps(steps):
+    """Convert (horizontal, vertical, matrix) flip steps to JSON, matrices in PDF order"""
+    return [[h, v, None if m is None else m.T.ravel().tolist()] for h, v, m in steps]
+
+def decode_steps(encoded):
+    """Convert flip steps written by encode_steps back"""
+    return [(h, v, None if m is None else as_affine(m)) for h, v, m in encoded]
+
+def extract_annotations(input_pdf):
+    """
+    Extract every annotation of a PDF into a sidecar
+    
+    Parameters:
+        input_pdf: Path of the PDF file, or the PDF as bytes or a file object
+    
+    Returns the sidecar as a JSON-compatible dictionary. Each annotated page
+    keeps its box and /Rotate, each annotation its entries as one PDF
+    dictionary in "pdf" plus the entries that refer to other objects in
+    "refs". /P is left out, it is set again when merging. Form field widgets
+    also keep their object number in "object" and their /Parent field as a
+    reference, merging updates them in place. Page contents are never read.
+    """
+    with open_source(as_source(input_pdf)) as pdf:
+        pages = annotated_pages(pdf)
+        
+        # Annotations are referenced by position, so /Popup and /IRT survive
+        locations = {}
+        page_annots = []
+        for page_num, page in pages:
+            annots = page.Annots if isinstance(page.Annots, pikepdf.Array) else []
+            annots = [annot for annot in annots if isinstance(annot, pikepdf.Dictionary)]
+            for index, annot in enumerate(annots):
+                if annot.is_indirect:
+                    locations[annot.objgen] = (page_num, index)
+            page_annots.append(annots)
+        
+        sidecar_pages = []
+        for (page_num, page), annots in zip(pages, page_annots):
+            box, rotation = page_geometry(page)
+            entries = []
+            for annot in annots:
+                widget = annot.is_indirect and annot.get('/Subtype') == pikepdf.Name.Widget
+                text = []
+                refs = {}
+                for key in annot.keys():
+                    if key == '/P':
+                        continue
+                    if widget and key == '/Parent' and annot.Parent.is_indirect:
+                        # Fields belong to the form, /AcroForm keeps pointing to them
+                        refs[key] = {'object': list(annot.Parent.objgen)}
+                        continue
+                    encoded = encode_value(annot[key], locations)
+                    if isinstance(encoded, str):
+                        text.append(f"{key} {encoded}")
+                    else:
+                        refs[key] = encoded
+                entry = {'pdf': '<< ' + ' '.join(text) + ' >>'}
+                if refs:
+                    entry['refs'] = refs
+                if widget:
+                    entry['object'] = list(annot.objgen)
+                entries.append(entry)
+            sidecar_pages.append({'page': page_num, 'box': list(box), 'rotate': rotation, 'annots': entries})
+        
+        marker = read_marker(pdf)
+        return {
+            'format': SIDECAR_FORMAT,
+            'version': SIDECAR_VERSION,
+            'page_count': len(pdf.pages),
+            'flips': encode_steps(marker[0]) if marker is not None else [],
+            'pages': sidecar_pages,
+        }
+
+def flip_sidecar(sidecar, horizontal=True, vertical=False, transform=None, precision=DEFAULT_PRECISION, stats=None,
+                 simplify=None, tight_rects=False):
+    """
+    Flip (mirror) the annotations of a sidecar without any PDF file
+    
+    The annotated pages are rebuilt from their boxes in an empty document
+    and flipped by the same handlers as flip_annotations, so the results
+    are identical. Appearance streams are references into the source
+    document and can't be mirrored, they are dropped like in a default
+    flip.
+    
+    Parameters:
+        sidecar: Sidecar from extract_annotations or read_sidecar
+        horizontal, vertical, transform, precision, stats, simplify, tight_rects: See flip_annotations
+    
+    Returns a new sidecar, the input is left unchanged.
+    """
+    check_sidecar(sidecar)
+    options = FlipOptions(transform=transform, stats=stats, precision=precision, simplify=simplify,
+                          tight_rects=tight_rects)
+    pdf = pikepdf.new()
+    pages = []
+    for sidecar_page in sidecar['pages']:
+        x0, y0, x1, y1 = sidecar_page['box']
+        page = pdf.add_blank_page(page_size=(x1 - x0, y1 - y0))
+        page.MediaBox = pikepdf.Array([x0, y0, x1, y1])
+        if sidecar_page['rotate']:
+            page.Rotate = sidecar_page['rotate']
+        
+        annots = pikepdf.Array()
+        for entry in sidecar_page['annots']:
+            # Indirect like in most files, updating direct objects nested in
+            # the page is several times slower
+            annot = pdf.make_indirect(pikepdf.Object.parse(entry['pdf'].encode('latin-1')))
+            for key in entry.get('refs', {}):
+                annot[key] = REF_PLACEHOLDER
+            annots.append(annot)
+        page.Annots = annots
+        flip_page_annotations(page, sidecar_page['page'], horizontal, vertical, options)
+        
+        entries = []
+        for entry, annot in zip(sidecar_page['annots'], annots):
+            # References the handlers removed, e.g. /AP, are dropped
+            refs = {key: value for key, value in entry.get('refs', {}).items() if key in annot}
+            for key in refs:
+                del annot[key]
+            flipped = {key: value for key, value in entry.items() if key != 'refs'}
+            flipped['pdf'] = annot.unparse(resolved=True).decode('latin-1')
+            if refs:
+                flipped['refs'] = refs
+            entries.append(flipped)
+        pages.append(dict(sidecar_page, annots=entries))
+    
+    if stats is not None:
+        stats.points_removed += options.points_removed
+    
+    # Per-page callables can't be recorded, the flips are then unknown
+    step = flip_step(horizontal, vertical, transform)
+    flips = None if step is None or sidecar['flips'] is None else sidecar['flips'] + encode_steps([step])
+    return dict(sidecar, flips=flips, pages=pages)
+
+def merge_annotations(sidecar, base_pdf, output_pdf, incremental=False):
+    """
+    Put the annotations of a sidecar into a copy of a base document
+    
+    Every page listed in the sidecar gets its annotations, replacing the
+    page's own. References to objects of the source document are resolved
+    in base_pdf, so they are kept when the base is a copy of the source and
+    dropped with a warning otherwise. Form field widgets the base still has
+    are updated in place, so /AcroForm /Fields and the /Kids of their
+    fields stay valid, and the page's other widgets are kept. The flip
+    marker is updated from the sidecar's flips.
+    
+    Parameters:
+        sidecar: Sidecar from extract_annotations, flip_sidecar or read_sidecar
+        base_pdf: Path of the base PDF file, or the PDF as bytes or a file object
+        output_pdf: Path of the output PDF file, or a writable file object
+        incremental: Append only the annotations to a copy of the base
+            instead of rewriting it (default: False)
+    
+    Returns the number of annotations merged.
+    """
+    check_sidecar(sidecar)
+    base_pdf = as_source(base_pdf)
+    with open_source(base_pdf, pikepdf.AccessMode.mmap if incremental else pikepdf.AccessMode.default) as pdf:
+        if sidecar['page_count'] != len(pdf.pages):
+            logger.warning("The sidecar was extracted from %d pages, %s has %d",
+                           sidecar['page_count'], describe(base_pdf), len(pdf.pages))
+        pages = dict(enumerate(pdf.pages))
+        
+        # Create all annotations first, references between them are set afterwards
+        annots = {}
+        page_objects = []
+        for sidecar_page in sidecar['pages']:
+            page = pages.get(sidecar_page['page'])
+            if page is None:
+                raise ValueError(f"the sidecar has annotations for page {sidecar_page['page'] + 1}, "
+                                 f"{describe(base_pdf)} has {len(pdf.pages)} pages")
+            page_annots = pikepdf.Array()
+            for index, entry in enumerate(sidecar_page['annots']):
+                annot = pikepdf.Object.parse(entry['pdf'].encode('latin-1'))
+                widget = base_widget(pdf, entry)
+                if widget is not None:
+                    for key in list(widget.keys()):
+                        del widget[key]
+                    for key in annot.keys():
+                        widget[key] = annot[key]
+                    annot = widget
+                else:
+                    annot = pdf.make_indirect(annot)
+                annot.P = page.obj
+                annots[sidecar_page['page'], index] = annot
+                page_annots.append(annot)
+            
+            # Widgets the sidecar doesn't carry are still listed by their fields
+            merged = {annot.objgen for annot in page_annots}
+            base_annots = page.obj.get('/Annots')
+            for annot in base_annots if isinstance(base_annots, pikepdf.Array) else []:
+                if (isinstance(annot, pikepdf.Dictionary) and annot.is_indirect
+                        and annot.get('/Subtype') == pikepdf.Name.Widget and annot.objgen not in merged):
+                    page_annots.append(annot)
+            page.Annots = page_annots
+            page_objects.append(page.obj)
+        
+        for sidecar_page in sidecar['pages']:
+            for index, entry in enumerate(sidecar_page['annots']):
+                annot = annots[sidecar_page['page'], index]
+                for key, encoded in entry.get('refs', {}).items():
+                    try:
+                        annot[key] = decode_value(pdf, encoded, annots)
+                    except KeyError as e:
+                        logger.warning("Page %d: dropped %s, %s is missing", sidecar_page['page'] + 1, key, e)
+        
+        # Without recorded flips the base's own marker no longer applies
+        flips = sidecar['flips']
+        marked_objects = write_marker(pdf, decode_steps(flips) if flips else None)
+        
+        if incremental:
+            # Every merged annotation is new or replaced
+            save_incremental(pdf, base_pdf, output_pdf,
+                             list(annotation_objects(pdf).values()) + page_objects + marked_objects)
+        else:
+            pdf.save(output_pdf)
+    
+    logger.info("Merged %d annotations into %s", len(annots), describe(output_pdf))
+    return len(annots)
+
+def base_widget(pdf, entry):
+    """Return the widget of pdf a sidecar entry was extracted from, None if pdf doesn't have it"""
+    if 'object' not in entry:
+        return None
+    obj = pdf.get_object(tuple(entry['object']))
+    if isinstance(obj, pikepdf.Dictionary) and obj.get('/Subtype') == pikepdf.Name.Widget:
+        return obj
+    return None
+
+def check_sidecar(sidecar):
+    """Raise ValueError unless sidecar is in a format this version understands"""
+    if sidecar.get('format') != SIDECAR_FORMAT:
+        raise ValueError("not an annotation sidecar")
+    if sidecar.get('version') != SIDECAR_VERSION:
+        raise ValueError(f"unsupported sidecar version {sidecar.get('version')}")
+
+def read_sidecar(path):
+    """Read a sidecar written by write_sidecar"""
+    with open(path, encoding='utf-8') as f:
+        sidecar = json.load(f)
+    check_sidecar(sidecar)
+    return sidecar
+
+def write_sidecar(sidecar, path):
+    """Write a sidecar as compact JSON"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(sidecar, f, separators=(',', ':'))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract, flip and merge PDF annotations as a sidecar file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    extract = commands.add_parser("extract", help="Write the annotations of a PDF to a sidecar")
+    extract.add_argument("input_pdf", help="Path to input PDF file")
+    extract.add_argument("-o", "--output", required=True, help="Path to the sidecar file")
+    
+    flip = commands.add_parser("flip", help="Flip the annotations of a sidecar")
+    flip.add_argument("sidecar", help="Path to the sidecar file")
+    flip.add_argument("-o", "--output", required=True, help="Path to the flipped sidecar file")
+    flip.add_argument("--horizontal", action="store_true", default=True, help="Flip horizontally (default)")
+    flip.add_argument("--vertical", action="store_true", help="Flip vertically")
+    flip.add_argument("--no-horizontal", dest="horizontal", action="store_false", help="Don't flip horizontally")
+    flip.add_argument("--precision", type=parse_precision, default=DEFAULT_PRECISION,
+                      help="Decimals written for coordinates, or 'full' (default: %(default)s)")
+    flip.add_argument("--matrix", action="append", type=parse_matrix, metavar="A,B,C,D,E,F",
+                      help="Affine matrix in PDF order applied after the flip, repeat to chain several")
+    flip.add_argument("--simplify", type=parse_tolerance, metavar="TOLERANCE",
+                      help="Simplify ink strokes, dropping points closer than TOLERANCE (PDF units) to the line")
+    flip.add_argument("--tight-rects", action="store_true",
+                      help="Fit /Rect to the flipped lines, vertices, quadrilaterals and ink strokes")
+    
+    merge = commands.add_parser("merge", help="Put the annotations of a sidecar into a copy of a PDF")
+    merge.add_argument("base_pdf", help="Path to the base PDF file")
+    merge.add_argument("sidecar", help="Path to the sidecar file")
+    merge.add_argument("-o", "--output", required=True, help="Path to output PDF file")
+    merge.add_argument("--incremental", action="store_true", help="Append only the annotations to a copy of the base")
+    
+    for command in (extract, flip, merge):
+        verbosity = command.add_mutually_exclusive_group()
+        verbosity.add_argument("-q", "--quiet", action="store_true", help="Only report warnings and errors")
+        verbosity.add_argument("-v", "--verbose", action="store_true", help="Report per-page details")
+    
+    args = parser.parse_args()
+    
+    if args.quiet:
+        configure_logging(logging.WARNING)
+    elif args.verbose:
+        configure_logging(logging.DEBUG)
+    else:
+        configure_logging(logging.INFO)
+    
+    try:
+        if args.command == "extract":
+            sidecar = extract_annotations(args.input_pdf)
+            write_sidecar(sidecar, args.output)
+            logger.info("Extracted %d annotations from %d pages to %s",
+                        sum(len(page['annots']) for page in sidecar['pages']), len(sidecar['pages']), args.output)
+        elif args.command == "flip":
+            sidecar = flip_sidecar(read_sidecar(args.sidecar), args.horizontal, args.vertical, args.matrix,
+                                   args.precision, simplify=args.simplify, tight_rects=args.tight_rects)
+            write_sidecar(sidecar, args.output)
+            logger.info("Flipped %d annotations, saved to %s",
+                        sum(len(page['annots']) for page in sidecar['pages']), args.output)
+        else:
+            merge_annotations(read_sidecar(args.sidecar), args.base_pdf, args.output, args.incremental)
+    except Exception as e:
+        logger.exception("Error: %s", e)
+        sys.exit(1)
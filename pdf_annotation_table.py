@@ -0,0 +1,480 @@
+import argparse
+import csv
+import logging
+import sys
+
+import numpy as np
+import pikepdf
+
+from pdf_annotation_flip import (ANNOTATION_HANDLERS, DEFAULT_HANDLER, DEFAULT_PRECISION, QUAD_SWAP_ORDER,
+                                 FlipOptions, RectIndex, annotated_pages, configure_logging, flip_text_orientation,
+                                 geometry_flip_context, geometry_key, logger, page_geometry, parse_matrix,
+                                 parse_precision, parse_region, parse_tolerance, read_coords, read_ink_list,
+                                 rect_padding, run_handler, simplified_points, swap_line_endings, transform_points,
+                                 update_appearance, write_coord_arrays)
+
+# Codes of the key column, a table row holds the coordinate entry its
+# subtype's handler flips besides /Rect (see geometry_key), 0 for none
+GEOMETRY_KEYS = (None, '/L', '/Vertices', '/QuadPoints', '/InkList')
+
+# Codes of the point lists whose order a mirroring flip reverses
+POINT_LIST_KEYS = (GEOMETRY_KEYS.index('/Vertices'), GEOMETRY_KEYS.index('/InkList'))
+
+# Handler steps that don't touch coordinates, run on the annotations when a
+# flipped table is written back
+ATTRIBUTE_STEPS = (update_appearance, swap_line_endings, flip_text_orientation)
+
+# Rect of rows whose annotation has none
+MISSING_RECT = np.full(4, np.nan)
+
+def read_geometry(annot, key):
+    """
+    Return the point geometry of an annotation as a flat buffer and per-part coordinate counts
+    
+    Coordinates are cut the way a flip writes them: /L to one segment,
+    /QuadPoints to whole quadrilaterals and every other point list to whole
+    points. Ink strokes are the parts of an /InkList, other entries have
+    one part.
+    """
+    if key == '/InkList':
+        coords, counts = read_ink_list(annot.InkList)
+        kept = counts // 2 * 2
+        if not (counts - kept).any():
+            return coords, counts
+        index = range_index(np.concatenate(([0], np.cumsum(counts))), np.arange(len(counts)), kept)
+        return coords[index], kept
+    coords = read_coords(annot[key])
+    if key == '/L':
+        keep = min(len(coords), 4)
+    elif key == '/QuadPoints':
+        keep = len(coords) // 8 * 8
+    else:
+        keep = len(coords) // 2 * 2
+    return coords[:keep], np.array([keep], dtype=np.intp)
+
+def range_index(offsets, rows, lengths=None):
+    """
+    Return the buffer positions covered by the given rows, row i spanning offsets[i]:offsets[i + 1]
+    
+    With lengths, each range is cut to that many positions from its start.
+    """
+    starts = offsets[rows]
+    if lengths is None:
+        lengths = offsets[rows + 1] - starts
+    ends = np.cumsum(lengths)
+    return np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)
+
+def transform_grouped(points, affines, groups):
+    """Apply the 2x3 matrix affines[groups[i]] to the points of points[i], which is shaped (n, ..., 2)"""
+    if len(affines) == 1:
+        return transform_points(points, affines[0])
+    selected = affines[groups]
+    offset = selected[:, :, 2].reshape((len(points),) + (1,) * (points.ndim - 2) + (2,))
+    return np.einsum('nij,n...j->n...i', selected[:, :, :2], points) + offset
+
+def store_entry(annot, key, array):
+    """Write a coordinate entry back, in place for indirect arrays so every reference sees it"""
+    value = annot.get(key)
+    if isinstance(value, pikepdf.Array) and value.is_indirect:
+        value[:] = array
+    else:
+        annot[key] = array
+
+class AnnotationTable:
+    """
+    Struct-of-arrays table of annotations, for bulk queries and transforms
+    
+    Every annotation is a row. page, index (position in the page's
+    /Annots), subtype (code into subtypes), rect (n x 4, NaN where missing)
+    and key (code into GEOMETRY_KEYS) hold one entry per row. The point
+    geometry of all rows is stored back to back in coords, row i owning
+    coords[offsets[i]:offsets[i + 1]]. It is split into parts, the strokes
+    of an /InkList and a single part otherwise, with coordinate counts
+    parts[part_offsets[i]:part_offsets[i + 1]]. Rows whose point geometry
+    is one indirect array have the same shared code, other rows -1.
+    
+    Tables are read with from_pdf and narrowed with filter, e.g.
+        
+        table.filter(table.is_subtype('/Highlight') & (table.width > 100))
+        table.filter((table.page == 39) & table.is_subtype('/Ink'))
+        table.filter(table.query((0, 0, 200, 100), pages=[0], contained=True))
+    
+    query answers region queries from a RectIndex per page over the rect
+    column, built on loading and again after every flip.
+    
+    flip transforms every row at once. write stores the rows back into the
+    annotations they were read from, which stay owned by the open document.
+    """
+    
+    def __init__(self, annots, page, index, subtype, subtypes, rect, key, coords, parts, part_counts, geometry,
+                 pending=(), shared=None):
+        self.annots = annots
+        self.page = page
+        self.index = index
+        self.subtype = subtype
+        self.subtypes = subtypes
+        self.rect = rect
+        self.key = key
+        self.coords = coords
+        self.parts = parts
+        self.part_offsets = np.concatenate(([0], np.cumsum(part_counts))).astype(np.intp)
+        self.offsets = np.concatenate(([0], np.cumsum(parts))).astype(np.intp)[self.part_offsets]
+        self.shared = np.full(len(annots), -1, dtype=np.int32) if shared is None else shared
+        # page_num -> (box, rotation) of every page with rows
+        self.geometry = geometry
+        # page_num -> FlipContext of each flip not written back yet
+        self.pending = list(pending)
+        self.index_rects()
+    
+    @classmethod
+    def from_pdf(cls, pdf, start=0, stop=None, select=None):
+        """
+        Read the annotations of pages [start, stop) of an open document in one pass
+        
+        An annotation listed several times is read once, at its first place.
+        Entries that aren't dictionaries are skipped, and so are those an
+        AnnotationFilter given as select leaves out.
+        """
+        annots, pages, indexes, subtypes, rects, keys, buffers, parts, part_counts, shared = ([] for _ in range(10))
+        codes = {}
+        shared_codes = {}
+        subtype_keys = {}
+        geometry = {}
+        seen = set()
+        for page_num, page in annotated_pages(pdf, start, stop, select):
+            page_annots = page.obj.get('/Annots')
+            if not isinstance(page_annots, pikepdf.Array):
+                continue
+            geometry[page_num] = page_geometry(page)
+            for i, annot in enumerate(page_annots):
+                if not isinstance(annot, pikepdf.Dictionary):
+                    continue
+                subtype = str(annot.Subtype) if '/Subtype' in annot else "Unknown"
+                if select is not None and not select.selects(annot, subtype):
+                    continue
+                if annot.is_indirect:
+                    if annot.objgen in seen:
+                        continue
+                    seen.add(annot.objgen)
+                
+                if subtype not in codes:
+                    codes[subtype] = len(codes)
+                    subtype_keys[subtype] = geometry_key(subtype)
+                
+                rect = MISSING_RECT
+                value = annot.get('/Rect')
+                if value is not None:
+                    try:
+                        values = read_coords(value)
+                        if len(values) >= 4:
+                            rect = values[:4]
+                    except Exception as e:
+                        logger.warning("Page %d annotation #%d has an unreadable /Rect: %s", page_num + 1, i + 1, e)
+                
+                # Rows whose point geometry can't be read keep it untouched
+                key = subtype_keys[subtype]
+                coords = np.empty(0)
+                counts = np.empty(0, dtype=np.intp)
+                if key is not None and key in annot:
+                    try:
+                        coords, counts = read_geometry(annot, key)
+                    except Exception as e:
+                        logger.warning("Page %d annotation #%d has an unreadable %s: %s", page_num + 1, i + 1, key, e)
+                        key = None
+                else:
+                    key = None
+                if key == '/L' and len(coords) < 4:
+                    key = None
+                    coords = np.empty(0)
+                    counts = np.empty(0, dtype=np.intp)
+                code = -1
+                if key is not None and annot[key].is_indirect:
+                    code = shared_codes.setdefault(annot[key].objgen, len(shared_codes))
+                
+                annots.append(annot)
+                pages.append(page_num)
+                indexes.append(i)
+                subtypes.append(codes[subtype])
+                rects.append(rect)
+                keys.append(GEOMETRY_KEYS.index(key))
+                buffers.append(coords)
+                parts.append(counts)
+                part_counts.append(len(counts))
+                shared.append(code)
+        
+        # Pages whose annotations were all left out have no rows
+        geometry = {page_num: geometry[page_num] for page_num in dict.fromkeys(pages)}
+        return cls(annots, np.array(pages, dtype=np.int32), np.array(indexes, dtype=np.int32),
+                   np.array(subtypes, dtype=np.int16), list(codes), np.array(rects).reshape(-1, 4),
+                   np.array(keys, dtype=np.int8), np.concatenate(buffers) if buffers else np.empty(0),
+                   np.concatenate(parts).astype(np.intp) if parts else np.empty(0, dtype=np.intp),
+                   np.array(part_counts, dtype=np.intp), geometry, shared=np.array(shared, dtype=np.int32))
+    
+    def __len__(self):
+        return len(self.annots)
+    
+    def index_rects(self):
+        """Build the spatial index of every page, page_num -> (rows, RectIndex over their rects)"""
+        order = np.argsort(self.page, kind='stable')
+        pages, starts = np.unique(self.page[order], return_index=True)
+        self.rect_indexes = {page_num: (rows, RectIndex(self.rect[rows]))
+                             for page_num, rows in zip(pages.tolist(), np.split(order, starts[1:]))}
+    
+    def query(self, region, pages=None, contained=False):
+        """
+        Return the sorted rows whose rect overlaps region (x0, y0, x1, y1)
+        
+        With contained, only rows whose rect lies entirely inside region
+        are returned. pages limits the query to those page numbers, only
+        their indexes are searched. Rows without /Rect never match.
+        """
+        if pages is None:
+            pages = self.rect_indexes.keys()
+        hits = [self.rect_indexes[page_num][0][self.rect_indexes[page_num][1].query(region, contained)]
+                for page_num in pages if page_num in self.rect_indexes]
+        return np.sort(np.concatenate(hits)) if hits else np.empty(0, dtype=np.intp)
+    
+    @property
+    def width(self):
+        return np.abs(self.rect[:, 2] - self.rect[:, 0])
+    
+    @property
+    def height(self):
+        return np.abs(self.rect[:, 3] - self.rect[:, 1])
+    
+    @property
+    def points(self):
+        """Number of points of each row"""
+        return np.diff(self.offsets) // 2
+    
+    def subtype_names(self):
+        """Return the subtype name of every row"""
+        return [self.subtypes[code] for code in self.subtype.tolist()]
+    
+    def is_subtype(self, *names):
+        """Return a row mask of the annotations of the given subtypes, e.g. '/Ink'"""
+        return np.isin(self.subtype, [code for code, name in enumerate(self.subtypes) if name in names])
+    
+    def filter(self, rows):
+        """Return a table of the rows selected by a boolean mask or an index array"""
+        rows = np.arange(len(self))[rows]
+        part_counts = self.part_offsets[rows + 1] - self.part_offsets[rows]
+        page = self.page[rows]
+        return AnnotationTable([self.annots[row] for row in rows.tolist()], page, self.index[rows],
+                               self.subtype[rows], self.subtypes, self.rect[rows], self.key[rows],
+                               self.coords[range_index(self.offsets, rows)],
+                               self.parts[range_index(self.part_offsets, rows)], part_counts,
+                               {page_num: self.geometry[page_num] for page_num in np.unique(page).tolist()},
+                               self.pending, self.shared[rows])
+    
+    def flip(self, horizontal=True, vertical=False, options=None):
+        """
+        Flip every row at once, like flip_page_annotations flips a page
+        
+        Only the table changes, entries other than coordinates (/AP, /LE,
+        /Rotate and /Q) are updated on the annotations by write.
+        
+        Parameters:
+            horizontal: Whether to flip horizontally (default: True)
+            vertical: Whether to flip vertically (default: False)
+            options: FlipOptions of the run, for its transform, undo, ink
+                simplification, tight_rects and stats (default: FlipOptions())
+        
+        Returns the number of flipped rows.
+        """
+        options = options or FlipOptions()
+        pages = np.unique(self.page)
+        contexts = {page_num: geometry_flip_context(*self.geometry[page_num], page_num, horizontal, vertical, options)
+                    for page_num in pages.tolist()}
+        affines = np.array([ctx.affine for ctx in contexts.values()]).reshape(-1, 2, 3)
+        mirrored = np.array([ctx.mirrored for ctx in contexts.values()], dtype=bool)
+        row_context = np.searchsorted(pages, self.page)
+        
+        corners = transform_grouped(self.rect[:, [[0, 1], [2, 1], [0, 3], [2, 3]]], affines, row_context)
+        self.rect = np.concatenate((corners.min(axis=1), corners.max(axis=1)), axis=1)
+        
+        # Mirroring transforms reverse the point lists of polygons, polylines
+        # and ink strokes with more than two points, and reorder the corners
+        # of quadrilaterals, the same as the handlers do
+        part_row = np.repeat(np.arange(len(self)), np.diff(self.part_offsets))
+        part_key = self.key[part_row]
+        part_mirrored = mirrored[row_context[part_row]]
+        npoints = self.parts // 2
+        removed = 0
+        if options.simplify is not None:
+            keep = simplified_points(self.coords.reshape(-1, 2), npoints, options.simplify,
+                                     part_key == GEOMETRY_KEYS.index('/InkList'))
+            removed = len(keep) - int(keep.sum())
+            npoints = np.bincount(np.repeat(np.arange(len(npoints)), npoints)[keep], minlength=len(npoints))
+            self.coords = self.coords.reshape(-1, 2)[keep].ravel()
+            self.parts = npoints * 2
+            self.offsets = np.concatenate(([0], np.cumsum(self.parts)))[self.part_offsets]
+            options.points_removed += removed
+        first_point = np.cumsum(npoints) - npoints
+        position = np.arange(int(npoints.sum())) - np.repeat(first_point, npoints)
+        reverse = part_mirrored & np.isin(part_key, POINT_LIST_KEYS) & (npoints > 2)
+        swap = part_mirrored & (part_key == GEOMETRY_KEYS.index('/QuadPoints'))
+        position = np.where(np.repeat(reverse, npoints), np.repeat(npoints - 1, npoints) - position, position)
+        position = np.where(np.repeat(swap, npoints), position // 4 * 4 + QUAD_SWAP_ORDER[position % 4], position)
+        points = self.coords.reshape(-1, 2)[np.repeat(first_point, npoints) + position]
+        self.coords = transform_grouped(points, affines, np.repeat(row_context, self.points)).ravel()
+        self.copy_shared()
+        if options.tight_rects:
+            self.fit_rects(options.keep_appearance)
+        self.index_rects()
+        
+        if options.stats is not None:
+            options.stats.pages += len(pages)
+            options.stats.annotations += len(self)
+            options.stats.coordinates += int(np.isfinite(self.rect).sum()) + self.coords.size
+            options.stats.points_removed += removed
+        self.pending.append(contexts)
+        return len(self)
+    
+    def copy_shared(self):
+        """
+        Give rows sharing an indirect geometry array the flipped points of the first of them
+        
+        A flip transforms a shared array once, with the geometry of the
+        first page referencing it, so every row sharing it has to hold
+        those points when the table is written back.
+        """
+        rows = np.flatnonzero(self.shared >= 0)
+        _, first, inverse = np.unique(self.shared[rows], return_index=True, return_inverse=True)
+        source = rows[first][inverse]
+        lengths = np.diff(self.offsets)
+        copy = (source != rows) & (lengths[source] == lengths[rows])
+        if copy.any():
+            self.coords[range_index(self.offsets, rows[copy])] = self.coords[range_index(self.offsets, source[copy])]
+    
+    def fit_rects(self, keep_appearance=False):
+        """
+        Set the rect of every row with points to their bounds, like fit_rects in a flip
+        
+        The bounds of all rows come from one min/max reduction over coords.
+        Rows of text markup are not padded, the others by rect_padding, and
+        rows whose padding is unknown keep their rect.
+        """
+        points = self.points
+        rows = np.flatnonzero(points > 0)
+        padding = [0.0 if key == GEOMETRY_KEYS.index('/QuadPoints') else rect_padding(self.annots[row], keep_appearance)
+                   for row, key in zip(rows.tolist(), self.key[rows].tolist())]
+        known = np.array([pad is not None for pad in padding], dtype=bool)
+        if not known.any():
+            return
+        
+        # Rows without points in between add nothing to the reduction of the row before
+        coords = self.coords.reshape(-1, 2)
+        starts = self.offsets[rows] // 2
+        low = np.minimum.reduceat(coords, starts, axis=0)[known]
+        high = np.maximum.reduceat(coords, starts, axis=0)[known]
+        pad = np.array([pad for pad in padding if pad is not None])[:, None]
+        self.rect[rows[known]] = np.concatenate((low - pad, high + pad), axis=1)
+    
+    def write(self, precision=DEFAULT_PRECISION):
+        """
+        Store the rows back into their annotations
+        
+        /Rect and the point geometry are rewritten from the table, and the
+        other entries of flipped rows are updated by the handler steps in
+        ATTRIBUTE_STEPS. Rows without /Rect keep theirs missing.
+        """
+        rows = np.flatnonzero(np.all(np.isfinite(self.rect), axis=1))
+        arrays = write_coord_arrays(self.rect[rows].ravel(), [4] * len(rows), precision)
+        for row, array in zip(rows.tolist(), arrays):
+            store_entry(self.annots[row], '/Rect', array)
+        
+        for code, key in enumerate(GEOMETRY_KEYS):
+            rows = np.flatnonzero(self.key == code)
+            if key is None or not len(rows):
+                continue
+            coords = self.coords[range_index(self.offsets, rows)]
+            if key == '/InkList':
+                arrays = write_coord_arrays(coords, self.parts[range_index(self.part_offsets, rows)], precision,
+                                            self.part_offsets[rows + 1] - self.part_offsets[rows])
+            else:
+                arrays = write_coord_arrays(coords, self.offsets[rows + 1] - self.offsets[rows], precision)
+            for row, array in zip(rows.tolist(), arrays):
+                store_entry(self.annots[row], key, array)
+        
+        for contexts in self.pending:
+            groups = {}
+            for row, (page_num, code) in enumerate(zip(self.page.tolist(), self.subtype.tolist())):
+                groups.setdefault((page_num, code), []).append(self.annots[row])
+            for (page_num, code), annots in groups.items():
+                subtype = self.subtypes[code]
+                steps = [step for step in ANNOTATION_HANDLERS.get(subtype, DEFAULT_HANDLER) if step in ATTRIBUTE_STEPS]
+                run_handler(subtype, annots, contexts[page_num], steps)
+        self.pending = []
+    
+    def summary(self):
+        """Return a human-readable report of the rows per subtype"""
+        lines = [f"{len(self)} annotations on {len(self.geometry)} pages, {len(self.coords) // 2} points"]
+        for code, name in enumerate(self.subtypes):
+            rows = self.subtype == code
+            if not rows.any():
+                continue
+            lines.append(f"  {name:<12} {int(rows.sum()):8d} annotations {int(self.points[rows].sum()):10d} points  "
+                         f"median size {np.nanmedian(self.width[rows]):.1f} x {np.nanmedian(self.height[rows]):.1f}")
+        return '\n'.join(lines)
+    
+    def write_csv(self, f):
+        """Write one line per row: page (1-based), index, subtype, rect and point count"""
+        writer = csv.writer(f)
+        writer.writerow(['page', 'index', 'subtype', 'x0', 'y0', 'x1', 'y1', 'points'])
+        for page_num, i, subtype, rect, points in zip(self.page.tolist(), self.index.tolist(), self.subtype_names(),
+                                                      self.rect.tolist(), self.points.tolist()):
+            writer.writerow([page_num + 1, i, subtype] + rect + [points])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load PDF annotations into a table, report on them or flip them")
+    parser.add_argument("input_pdf", help="Path to input PDF file")
+    parser.add_argument("-o", "--output", help="Flip every annotation through the table and save to this path")
+    parser.add_argument("--csv", metavar="FILE", help="Write one line per annotation, '-' for standard output")
+    parser.add_argument("--region", type=parse_region, metavar="X0,Y0,X1,Y1",
+                        help="Only keep annotations whose /Rect lies inside this area, in page coordinates")
+    parser.add_argument("--horizontal", action="store_true", default=True, help="Flip horizontally (default)")
+    parser.add_argument("--vertical", action="store_true", help="Flip vertically")
+    parser.add_argument("--no-horizontal", dest="horizontal", action="store_false", help="Don't flip horizontally")
+    parser.add_argument("--precision", type=parse_precision, default=DEFAULT_PRECISION,
+                        help="Decimals written for coordinates, or 'full' (default: %(default)s)")
+    parser.add_argument("--matrix", action="append", type=parse_matrix, metavar="A,B,C,D,E,F",
+                        help="Affine matrix in PDF order applied after the flip, repeat to chain several")
+    parser.add_argument("--simplify", type=parse_tolerance, metavar="TOLERANCE",
+                        help="Simplify ink strokes, dropping points closer than TOLERANCE (PDF units) to the line")
+    parser.add_argument("--tight-rects", action="store_true",
+                        help="Fit /Rect to the flipped lines, vertices, quadrilaterals and ink strokes")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument("-q", "--quiet", action="store_true", help="Only report warnings and errors")
+    verbosity.add_argument("-v", "--verbose", action="store_true", help="Report per-page details")
+    
+    args = parser.parse_args()
+    
+    if args.quiet:
+        configure_logging(logging.WARNING)
+    elif args.verbose:
+        configure_logging(logging.DEBUG)
+    else:
+        configure_logging(logging.INFO)
+    
+    try:
+        with pikepdf.open(args.input_pdf) as pdf:
+            table = AnnotationTable.from_pdf(pdf)
+            if args.region:
+                table = table.filter(table.query(args.region, contained=True))
+            if args.csv == '-':
+                table.write_csv(sys.stdout)
+            elif args.csv:
+                with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+                    table.write_csv(f)
+            if args.output:
+                options = FlipOptions(transform=args.matrix, simplify=args.simplify, tight_rects=args.tight_rects)
+                table.flip(args.horizontal, args.vertical, options)
+                table.write(args.precision)
+                pdf.save(args.output)
+                logger.info("Flipped %d annotations, saved to %s", len(table), args.output)
+            elif not args.csv:
+                print(table.summary())
+    except Exception as e:
+        logger.exception("Error: %s", e)
+        sys.exit(1)
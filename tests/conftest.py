@@ -0,0 +1,75 @@
+import os
+import re
+import sys
+
+import pikepdf
+import pytest
+
+# The tools are flat scripts in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def without_id(data):
+    """Blank the trailer /ID, qpdf derives its second part from the current time"""
+    return re.sub(rb'/ID \[ ?<[0-9a-f]*> ?<[0-9a-f]*> ?\]', b'/ID []', data)
+
+def annotation(pdf, subtype, rect, **entries):
+    """Return a new indirect annotation dictionary"""
+    return pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.Annot, Subtype=pikepdf.Name(subtype),
+                                                Rect=pikepdf.Array(rect), **entries))
+
+def build_document(path, pages=8):
+    """
+    Write a PDF exercising what a flip has to get right across pages
+    
+    Pages have different sizes, some inherit a shared indirect /MediaBox
+    from the page tree and one is rotated. Geometry arrays are shared
+    between annotations, on the same page and across the first and the
+    last page, one annotation is listed on both of those pages, and some
+    annotations carry appearance streams.
+    """
+    pdf = pikepdf.new()
+    for page_num in range(pages):
+        pdf.add_blank_page(page_size=(600 + 10 * page_num, 800))
+    pdf.Root.Pages.MediaBox = pdf.make_indirect(pikepdf.Array([0, 0, 500, 700]))
+    for page in pdf.pages[1::3]:
+        del page.obj['/MediaBox']
+    pdf.pages[2].obj.Rotate = 90
+    pdf.pages[3].obj.CropBox = pikepdf.Array([20, 30, 580, 760])
+    
+    appearance = pdf.make_stream(b'0 0 m 10 10 l S', Type=pikepdf.Name.XObject, Subtype=pikepdf.Name.Form,
+                                 BBox=[0, 0, 10, 10])
+    listed_twice = annotation(pdf, '/Square', [50, 60, 150, 160], AP=pikepdf.Dictionary(N=appearance))
+    shared_ink_list = pdf.make_indirect(pikepdf.Array([[20, 700, 60, 720, 90, 760]]))
+    for page_num, page in enumerate(pdf.pages):
+        offset = 5 * page_num
+        ink_list = pdf.make_indirect(pikepdf.Array([[100 + offset, 100, 150, 220, 210, 300.5],
+                                                    [120, 400, 130 + offset, 410]]))
+        quad_points = pdf.make_indirect(pikepdf.Array([100, 520, 300 + offset, 520, 100, 500, 300 + offset, 500]))
+        line = pdf.make_indirect(pikepdf.Array([100, 600 + offset, 400, 650]))
+        vertices = pdf.make_indirect(pikepdf.Array([300, 100, 400 + offset, 150, 350, 250, 310, 200]))
+        annots = [
+            annotation(pdf, '/Ink', [90, 90, 220, 420], InkList=ink_list, BS=pikepdf.Dictionary(W=3)),
+            annotation(pdf, '/Ink', [500, 0, 600, 100], InkList=ink_list),
+            annotation(pdf, '/Highlight', [100, 500, 300, 520], QuadPoints=quad_points),
+            annotation(pdf, '/Underline', [0, 0, 10, 10], QuadPoints=quad_points),
+            annotation(pdf, '/Line', [90, 590, 410, 660], L=line,
+                       LE=pikepdf.Array([pikepdf.Name.OpenArrow, pikepdf.Name('/None')])),
+            annotation(pdf, '/Line', [0, 0, 1, 1], L=line),
+            annotation(pdf, '/Polygon', [290, 90, 410, 260], Vertices=vertices),
+            annotation(pdf, '/PolyLine', [0, 0, 5, 5], Vertices=vertices, Border=pikepdf.Array([0, 0, 2])),
+            annotation(pdf, '/FreeText', [200, 700, 400, 740], Q=0, Rotate=90,
+                       AP=pikepdf.Dictionary(N=appearance)),
+            pikepdf.Dictionary(Type=pikepdf.Name.Annot, Subtype=pikepdf.Name.Text,
+                               Rect=pikepdf.Array([10 + offset, 10, 30, 30])),
+        ]
+        if page_num in (0, pages - 1):
+            annots.append(listed_twice)
+            annots.append(annotation(pdf, '/Ink', [20, 700, 90, 760], InkList=shared_ink_list))
+        page.obj.Annots = pdf.make_indirect(pikepdf.Array(annots))
+    pdf.save(path)
+    return path
+
+@pytest.fixture
+def document(tmp_path):
+    """Path of a fresh build_document PDF"""
+    return build_document(str(tmp_path / 'document.pdf'))
@@ -0,0 +1,35 @@
+import json
+import multiprocessing
+import os
+import shutil
+
+import pytest
+
+import pdf_annotation_batch
+from pdf_annotation_batch import run_batch
+
+flip_annotations = pdf_annotation_batch.flip_annotations
+
+def flip_or_crash(input_pdf, *args, **kwargs):
+    """Kill the worker for inputs named crash.pdf, like a crash in qpdf would"""
+    if os.path.basename(input_pdf) == 'crash.pdf':
+        os._exit(1)
+    return flip_annotations(input_pdf, *args, **kwargs)
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason="the workers inherit the patched flip by forking")
+def test_batch_goes_on_after_a_worker_died(document, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_annotation_batch, 'flip_annotations', flip_or_crash)
+    names = [f'input{i}.pdf' for i in range(3)] + ['crash.pdf'] + [f'input{i}.pdf' for i in range(3, 8)]
+    inputs = []
+    for name in names:
+        shutil.copy(document, tmp_path / name)
+        inputs.append((str(tmp_path / name), name))
+    checkpoint = tmp_path / 'checkpoint.jsonl'
+    
+    summary = run_batch(inputs, str(tmp_path / 'flipped'), workers=2, checkpoint=str(checkpoint))
+    assert (summary['succeeded'], summary['failed']) == (8, 1)
+    assert summary['failures'] == [{'input': str(tmp_path / 'crash.pdf'), 'status': 'failed',
+                                    'error': "the worker process died"}]
+    records = [json.loads(line) for line in checkpoint.read_text().splitlines()]
+    assert sorted(record['input'] for record in records) == sorted(path for path, _ in inputs)
+    assert all(os.path.exists(tmp_path / 'flipped' / f'flipped_{name}') for name in names if name != 'crash.pdf')
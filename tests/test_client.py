@@ -0,0 +1,46 @@
+import os
+import socket
+
+import pytest
+
+from pdf_annotation_client import DaemonUnavailable, check_socket
+
+@pytest.fixture
+def listening(tmp_path):
+    """Return a function creating a listening Unix socket in tmp_path"""
+    sockets = []
+    
+    def listen(name):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(str(tmp_path / name))
+        sock.listen()
+        sockets.append(sock)
+        return str(tmp_path / name)
+    
+    os.chmod(tmp_path, 0o700)
+    yield listen
+    for sock in sockets:
+        sock.close()
+
+def test_own_socket_in_private_directory_is_accepted(listening):
+    check_socket(listening('daemon.sock'))
+
+def test_missing_socket_and_other_files_are_refused(tmp_path):
+    with pytest.raises(DaemonUnavailable, match='no flip daemon'):
+        check_socket(str(tmp_path / 'daemon.sock'))
+    (tmp_path / 'file').write_bytes(b'')
+    with pytest.raises(DaemonUnavailable, match='not a socket'):
+        check_socket(str(tmp_path / 'file'))
+
+def test_socket_others_can_replace_is_refused(tmp_path, listening):
+    path = listening('daemon.sock')
+    os.chmod(tmp_path, 0o777)
+    with pytest.raises(DaemonUnavailable, match='other users can write'):
+        check_socket(path)
+
+@pytest.mark.skipif(os.getuid() != 0, reason="changing the owner of a file needs root")
+def test_socket_of_another_user_is_refused(listening):
+    path = listening('daemon.sock')
+    os.chown(path, 65534, 65534)
+    with pytest.raises(DaemonUnavailable, match='belongs to user 65534'):
+        check_socket(path)
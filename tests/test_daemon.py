@@ -0,0 +1,45 @@
+import asyncio
+import os
+
+import pytest
+
+import pdf_annotation_service
+from pdf_annotation_client import DaemonError, DaemonUnavailable, flip_file, status
+
+def flip_or_crash(input_pdf, *args, **kwargs):
+    """Kill the worker for inputs named crash.pdf, like a crash in qpdf would"""
+    if os.path.basename(input_pdf) == 'crash.pdf':
+        os._exit(1)
+    return pdf_annotation_service.flip_annotations(input_pdf, *args, **kwargs)
+
+def test_daemon_keeps_serving_after_a_worker_died(document, tmp_path, monkeypatch):
+    socket_path = str(tmp_path / 'daemon' / 'daemon.sock')
+    crash = tmp_path / 'crash.pdf'
+    crash.write_bytes(open(document, 'rb').read())
+    monkeypatch.setattr(pdf_annotation_service.FlipService, 'flip_file',
+                        lambda self, *args, **kwargs: self.run(flip_or_crash, *args, **kwargs))
+    
+    async def crash_then_flip():
+        daemon = asyncio.ensure_future(pdf_annotation_service.serve(unix_socket=socket_path, workers=1))
+        try:
+            while True:
+                try:
+                    await asyncio.to_thread(status, socket_path)
+                    break
+                except DaemonUnavailable:
+                    assert not daemon.done()
+                    await asyncio.sleep(0.05)
+            with pytest.raises(DaemonError) as error:
+                await asyncio.to_thread(flip_file, str(crash), str(tmp_path / 'crashed.pdf'), socket_path, 30)
+            assert error.value.status == 422
+            answer = await asyncio.to_thread(flip_file, document, str(tmp_path / 'flipped.pdf'), socket_path, 30)
+            assert answer['output'] == str(tmp_path / 'flipped.pdf')
+            return await asyncio.to_thread(status, socket_path)
+        finally:
+            daemon.cancel()
+            await asyncio.gather(daemon, return_exceptions=True)
+    
+    counters = asyncio.run(crash_then_flip())
+    assert (counters['completed'], counters['failed']) == (1, 1)
+    assert os.path.getsize(tmp_path / 'flipped.pdf') > 0
+    assert not os.path.exists(socket_path)
@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+from pdf_annotation_flip import format_coords, write_coord_arrays
+
+@pytest.mark.parametrize('precision, expected', [
+    (0, ['10000000000000000', '100', '0']),
+    (2, ['10000000000000000', '100', '0']),
+    (None, ['10000000000000000', '100', '0.00001']),
+])
+def test_large_and_tiny_values_are_written_without_exponents(precision, expected):
+    assert format_coords(np.array([1e16, 100.0, 1e-5]), precision) == expected
+
+def test_integral_tokens_keep_their_zeros():
+    arrays = write_coord_arrays(np.array([1e16, 100.0, 2e16, 300.0]), [2, 2], precision=0)
+    assert [[int(v) for v in array] for array in arrays] == [[10 ** 16, 100], [2 * 10 ** 16, 300]]
@@ -0,0 +1,35 @@
+import re
+
+import pikepdf
+import pytest
+
+from pdf_annotation_flip import AnnotationFilter, flip_annotations
+
+def appended_objects(path, original_size):
+    """Return the object numbers written by the incremental update of path"""
+    with open(path, 'rb') as f:
+        update = f.read()[original_size:]
+    return {int(num) for num in re.findall(rb'(?m)^(\d+) 0 obj', update)}
+
+def annotations(path):
+    with pikepdf.open(path) as pdf:
+        return [[(annot.objgen, annot.Subtype, [float(v) for v in annot.Rect]) for annot in page.Annots]
+                for page in pdf.pages]
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_filtered_update_appends_only_flipped_annotations(document, tmp_path, jobs):
+    select = AnnotationFilter(pages=[1], subtypes=['Ink'])
+    rewritten = str(tmp_path / 'rewritten.pdf')
+    appended = str(tmp_path / 'appended.pdf')
+    assert flip_annotations(document, rewritten, mark=False, select=select)
+    assert flip_annotations(document, appended, jobs=jobs, incremental=True, mark=False, select=select)
+    assert annotations(appended) == annotations(rewritten)
+    
+    with open(document, 'rb') as f:
+        original_size = len(f.read())
+    with pikepdf.open(document) as pdf:
+        annots = {annot.objgen[0] for page in pdf.pages for annot in page.Annots}
+        flipped = {annot.objgen[0] for annot in pdf.pages[1].Annots if annot.Subtype == '/Ink'}
+    written = appended_objects(appended, original_size)
+    assert flipped and flipped <= written
+    assert written & annots == flipped
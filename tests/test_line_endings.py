@@ -0,0 +1,39 @@
+import pikepdf
+import pytest
+
+from pdf_annotation_flip import flip_annotations
+
+def line_endings(path):
+    with pikepdf.open(path) as pdf:
+        return [str(ending) for ending in pdf.pages[0].Annots[0].LE]
+
+@pytest.fixture
+def line_document(tmp_path):
+    pdf = pikepdf.new()
+    pdf.add_blank_page()
+    pdf.pages[0].obj.Annots = pikepdf.Array([pdf.make_indirect(pikepdf.Dictionary(
+        Type=pikepdf.Name.Annot, Subtype=pikepdf.Name.Line, Rect=[100, 100, 300, 200], L=[100, 100, 300, 200],
+        LE=[pikepdf.Name.OpenArrow, pikepdf.Name('/None')]))])
+    path = str(tmp_path / 'line.pdf')
+    pdf.save(path)
+    return path
+
+@pytest.mark.parametrize('settings, expected', [
+    ({}, ['/None', '/OpenArrow']),
+    ({'horizontal': False, 'transform': (2, 0, 0, 2, 0, 0)}, ['/OpenArrow', '/None']),
+    ({'vertical': True}, ['/OpenArrow', '/None']),
+])
+def test_line_endings_swap_for_mirrors_only(line_document, tmp_path, settings, expected):
+    output = str(tmp_path / 'flipped.pdf')
+    assert flip_annotations(line_document, output, **settings)
+    assert line_endings(output) == expected
+
+@pytest.mark.parametrize('horizontal, vertical', [(False, True), (True, True)])
+def test_delta_line_endings_match_a_direct_flip(line_document, tmp_path, horizontal, vertical):
+    flipped = str(tmp_path / 'flipped.pdf')
+    direct = str(tmp_path / 'direct.pdf')
+    delta = str(tmp_path / 'delta.pdf')
+    assert flip_annotations(line_document, flipped)
+    assert flip_annotations(line_document, direct, horizontal, vertical)
+    assert flip_annotations(flipped, delta, horizontal, vertical, if_mirrored='delta')
+    assert line_endings(delta) == line_endings(direct)
@@ -0,0 +1,19 @@
+import pytest
+
+from conftest import without_id
+from pdf_annotation_flip import flip_annotations
+
+@pytest.mark.parametrize('settings', [
+    {},
+    {'vertical': True},
+    {'horizontal': False, 'transform': (2, 0, 0, 2, 0, 0)},
+    {'keep_appearance': True},
+    {'incremental': True},
+    {'tight_rects': True},
+])
+def test_parallel_output_matches_serial(document, tmp_path, settings):
+    serial = tmp_path / 'serial.pdf'
+    parallel = tmp_path / 'parallel.pdf'
+    assert flip_annotations(document, str(serial), mark=False, **settings)
+    assert flip_annotations(document, str(parallel), jobs=2, mark=False, **settings)
+    assert without_id(serial.read_bytes()) == without_id(parallel.read_bytes())
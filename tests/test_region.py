@@ -0,0 +1,25 @@
+import pikepdf
+
+from pdf_annotation_flip import AnnotationFilter, flip_annotations
+
+def rects(path):
+    with pikepdf.open(path) as pdf:
+        return [[[float(v) for v in annot.Rect] for annot in page.Annots] for page in pdf.pages]
+
+def test_region_flips_only_the_annotations_inside(document, tmp_path):
+    region = (80, 80, 420, 670)
+    everything = str(tmp_path / 'everything.pdf')
+    selected = str(tmp_path / 'selected.pdf')
+    assert flip_annotations(document, everything, mark=False)
+    assert flip_annotations(document, selected, mark=False, select=AnnotationFilter(region=region))
+    
+    inside = 0
+    for before, after, flipped in zip(rects(document), rects(selected), rects(everything)):
+        for rect, result, expected in zip(before, after, flipped):
+            x0, y0, x1, y1 = min(rect[0], rect[2]), min(rect[1], rect[3]), max(rect[0], rect[2]), max(rect[1], rect[3])
+            if region[0] <= x0 and region[1] <= y0 and x1 <= region[2] and y1 <= region[3]:
+                inside += 1
+                assert result == expected
+            else:
+                assert result == rect
+    assert inside
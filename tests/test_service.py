@@ -0,0 +1,32 @@
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from pdf_annotation_service import FlipService
+
+def test_service_replaces_a_pool_whose_worker_died(document, tmp_path):
+    output = str(tmp_path / 'flipped.pdf')
+    
+    async def crash_then_flip():
+        async with FlipService(workers=1) as service:
+            with pytest.raises(BrokenProcessPool):
+                await service.run(os._exit, 1)
+            assert await service.flip_file(document, output)
+            return service.status()
+    
+    status = asyncio.run(crash_then_flip())
+    assert os.path.getsize(output) > 0
+    assert (status['completed'], status['failed']) == (1, 1)
+
+def test_unsuccessful_flips_count_as_failed(tmp_path):
+    (tmp_path / 'broken.pdf').write_bytes(b'not a PDF')
+    
+    async def flip_broken():
+        async with FlipService(workers=1) as service:
+            assert not await service.flip_file(str(tmp_path / 'broken.pdf'), str(tmp_path / 'flipped.pdf'))
+            return service.status()
+    
+    status = asyncio.run(flip_broken())
+    assert (status['completed'], status['failed']) == (0, 1)
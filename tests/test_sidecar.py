@@ -0,0 +1,52 @@
+import pikepdf
+import pytest
+
+from conftest import annotation
+from pdf_annotation_sidecar import extract_annotations, flip_sidecar, merge_annotations
+
+@pytest.fixture
+def form_document(tmp_path):
+    pdf = pikepdf.new()
+    pdf.add_blank_page(page_size=(600, 800))
+    field = pdf.make_indirect(pikepdf.Dictionary(FT=pikepdf.Name.Btn, T=pikepdf.String('choice'), Kids=[]))
+    kids = [annotation(pdf, '/Widget', [x, 700, x + 20, 720], Parent=field) for x in (100, 200)]
+    field.Kids = pikepdf.Array(kids)
+    text_field = annotation(pdf, '/Widget', [300, 600, 500, 630], FT=pikepdf.Name.Tx, T=pikepdf.String('name'))
+    square = annotation(pdf, '/Square', [50, 60, 150, 160])
+    pdf.pages[0].obj.Annots = pdf.make_indirect(pikepdf.Array(kids + [text_field, square]))
+    pdf.Root.AcroForm = pikepdf.Dictionary(Fields=[field, text_field])
+    path = str(tmp_path / 'form.pdf')
+    pdf.save(path)
+    return path
+
+def check_form(path, expected_rects):
+    with pikepdf.open(path) as pdf:
+        page = pdf.pages[0]
+        on_page = {annot.objgen for annot in page.Annots}
+        widgets = []
+        for field in pdf.Root.AcroForm.Fields:
+            for widget in field.Kids if '/Kids' in field else [field]:
+                assert widget.objgen in on_page
+                if '/P' in widget:
+                    assert widget.P.objgen == page.obj.objgen
+                if '/Parent' in widget:
+                    assert widget.Parent.objgen == field.objgen
+                widgets.append([float(v) for v in widget.Rect])
+        assert widgets == expected_rects
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_merge_updates_form_widgets_in_place(form_document, tmp_path, incremental):
+    output = str(tmp_path / 'merged.pdf')
+    sidecar = flip_sidecar(extract_annotations(form_document))
+    assert merge_annotations(sidecar, form_document, output, incremental) == 4
+    check_form(output, [[480, 700, 500, 720], [380, 700, 400, 720], [100, 600, 300, 630]])
+    with pikepdf.open(output) as pdf:
+        assert len(pdf.pages[0].Annots) == 4
+
+def test_merge_keeps_widgets_missing_from_the_sidecar(form_document, tmp_path):
+    output = str(tmp_path / 'merged.pdf')
+    sidecar = flip_sidecar(extract_annotations(form_document))
+    for page in sidecar['pages']:
+        page['annots'] = [entry for entry in page['annots'] if 'object' not in entry]
+    assert merge_annotations(sidecar, form_document, output) == 1
+    check_form(output, [[100, 700, 120, 720], [200, 700, 220, 720], [300, 600, 500, 630]])
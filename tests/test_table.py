@@ -0,0 +1,28 @@
+import pikepdf
+import pytest
+
+from conftest import without_id
+from pdf_annotation_flip import FlipOptions, flip_annotations
+from pdf_annotation_table import AnnotationTable
+
+@pytest.mark.parametrize('settings', [
+    {},
+    {'vertical': True},
+    {'horizontal': False, 'transform': (0, 1, -1, 0, 0, 0)},
+    {'simplify': 20.0},
+    {'tight_rects': True},
+    {'vertical': True, 'tight_rects': True, 'keep_appearance': True},
+])
+def test_table_flip_matches_flip_annotations(document, tmp_path, settings):
+    expected = tmp_path / 'flipped.pdf'
+    assert flip_annotations(document, str(expected), mark=False, **settings)
+    
+    horizontal = settings.pop('horizontal', True)
+    vertical = settings.pop('vertical', False)
+    output = tmp_path / 'table.pdf'
+    with pikepdf.open(document) as pdf:
+        table = AnnotationTable.from_pdf(pdf)
+        table.flip(horizontal, vertical, FlipOptions(**settings))
+        table.write()
+        pdf.save(output)
+    assert without_id(output.read_bytes()) == without_id(expected.read_bytes())
@@ -0,0 +1,26 @@
+import numpy as np
+import pikepdf
+
+from pdf_annotation_flip import flip_annotations, read_coords, read_ink_list, rect_padding
+
+GEOMETRY_KEYS = ('/L', '/Vertices', '/QuadPoints', '/InkList')
+
+def test_every_annotation_sharing_geometry_is_fitted(document, tmp_path):
+    output = tmp_path / 'flipped.pdf'
+    assert flip_annotations(document, str(output), tight_rects=True, mark=False)
+    
+    fitted = 0
+    with pikepdf.open(output) as pdf:
+        for page in pdf.pages:
+            for annot in page.Annots:
+                key = next((key for key in GEOMETRY_KEYS if key in annot), None)
+                if key is None:
+                    continue
+                points = (read_ink_list(annot.InkList)[0] if key == '/InkList' else read_coords(annot[key]))
+                points = points.reshape(-1, 2)
+                pad = 0.0 if key == '/QuadPoints' else rect_padding(annot)
+                expected = np.concatenate((points.min(axis=0) - pad, points.max(axis=0) + pad))
+                assert np.allclose(read_coords(annot.Rect), expected, atol=1e-4), (key, annot.Rect)
+                fitted += 1
+    # Four pairs sharing a geometry array on every page, one pair across pages
+    assert fitted == 8 * 8 + 2